@@ -0,0 +1,98 @@
+'''
+Recall@k and latency of the IVF index against exact search, on synthetic corpora.
+
+Run from the repository root:
+
+    python -m benchmarks.ann_recall --n_copies 1000 --nprobes 1,2,4,8,16,32
+
+A corpus of n_copies perturbed copies of data/synthetic_document.json is chunked and embedded with the
+deterministic local embedder, and queried with perturbed variants of data/queries_for_synthetic.json. For each
+nprobe the recall@k of the IVF results against exact NumpyVectorStore search is reported, along with the
+query latency (one query at a time, and batched).
+Half of the corpus is then indexed first and the other half inserted incrementally after training, to measure
+the recall of incremental inserts.
+'''
+import argparse
+import json
+import time
+
+import numpy as np
+
+import chunking
+from benchmarks import synthetic
+from ivf_index import IVFVectorStore
+from local_embeddings import HashingEmbeddings
+from numpy_store import NumpyVectorStore
+
+def recall_at_k(found_distances: np.ndarray, exact_distances: np.ndarray, tolerance: float = 1e-5) -> float:
+    """Fraction of the results no farther than the exact k-th nearest neighbor, so that ties count as found."""
+    return float(np.mean(found_distances <= exact_distances[:,-1:] + tolerance))
+
+def build_corpus(n_copies: int, n_queries: int, seed: int = 0) -> tuple[list[str],np.ndarray,np.ndarray]:
+    """Returns the chunk ids, chunk embeddings and query embeddings of a synthetic corpus."""
+    embeddings = HashingEmbeddings()
+    chunks = chunking.process_document(synthetic.scale_document(n_copies,seed=seed))
+    with open('data/queries_for_synthetic.json','r') as f:
+        queries = synthetic.perturbed_queries(json.load(f)['queries'],n_queries,seed=seed)
+    return ([c['id'] for c in chunks],
+            np.asarray(embeddings.embed_documents([c['text'] for c in chunks]),dtype=np.float32),
+            np.asarray(embeddings.embed_documents(queries),dtype=np.float32))
+
+def evaluate(ids: list[str], vectors: np.ndarray, queries: np.ndarray, k: int = 4,
+             nprobes: list[int] = (1,2,4,8,16,32), n_lists: int = None, incremental_fraction: float = 0.5) -> list[dict]:
+    """Measures recall@k and latency of the IVF index for each nprobe, after a full and an incremental build."""
+    exact = NumpyVectorStore(None)
+    exact.add_embeddings(ids,ids,[{}]*len(ids),vectors)
+    start = time.perf_counter()
+    _,exact_distances = exact.search(queries,k)
+    exact_ms = 1000*(time.perf_counter() - start)/len(queries)
+    start = time.perf_counter()
+    for query in queries:
+        exact.search(query[None,:],k)
+    exact_single_ms = 1000*(time.perf_counter() - start)/len(queries)
+
+    full = IVFVectorStore(None,n_lists=n_lists)
+    full.add_embeddings(ids,ids,[{}]*len(ids),vectors)
+    start = time.perf_counter()
+    full.train()
+    train_s = time.perf_counter() - start
+    # train on part of the corpus, insert the rest incrementally
+    n_first = int(len(ids)*(1-incremental_fraction))
+    incremental = IVFVectorStore(None,n_lists=full.n_lists)
+    incremental.add_embeddings(ids[:n_first],ids[:n_first],[{}]*n_first,vectors[:n_first])
+    incremental.train()
+    incremental.add_embeddings(ids[n_first:],ids[n_first:],[{}]*(len(ids)-n_first),vectors[n_first:])
+
+    results = []
+    for nprobe in nprobes:
+        result = {'n_chunks':len(ids),'n_lists':full.n_lists,'nprobe':nprobe,'k':k,'exact_ms':exact_ms,'exact_single_ms':exact_single_ms,'train_s':train_s}
+        for name,store in [('full',full),('incremental',incremental)]:
+            start = time.perf_counter()
+            _,distances = store.search(queries,k,nprobe=nprobe)
+            result[f'{name}_ms'] = 1000*(time.perf_counter() - start)/len(queries)
+            start = time.perf_counter()
+            for query in queries:
+                store.search(query[None,:],k,nprobe=nprobe)
+            result[f'{name}_single_ms'] = 1000*(time.perf_counter() - start)/len(queries)
+            result[f'{name}_recall'] = recall_at_k(distances,exact_distances)
+        results.append(result)
+    return results
+
+def main(n_copies: int = 1000, n_queries: int = 200, k: int = 4, nprobes: str = '1,2,4,8,16,32', n_lists: int = None) -> list[dict]:
+    ids,vectors,queries = build_corpus(n_copies,n_queries)
+    results = evaluate(ids,vectors,queries,k=k,nprobes=[int(n) for n in nprobes.split(',')],n_lists=n_lists)
+    for r in results:
+        print(f"{r['n_chunks']} chunks, {r['n_lists']} lists, nprobe {r['nprobe']:>3}: recall@{k} {r['full_recall']:.3f} "
+              f"(incremental {r['incremental_recall']:.3f}), {r['full_single_ms']:.2f} ms/query vs {r['exact_single_ms']:.2f} ms exact, "
+              f"batched {r['full_ms']:.3f} vs {r['exact_ms']:.3f} ms/query")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_copies',default=1000,type=int,help="copies of the synthetic document in the corpus. Default 1000")
+    parser.add_argument('--n_queries',default=200,type=int,help="number of queries. Default 200")
+    parser.add_argument('--k',default=4,type=int,help="recall@k. Default 4")
+    parser.add_argument('--nprobes',default='1,2,4,8,16,32',type=str,help="comma separated nprobe values. Default 1,2,4,8,16,32")
+    parser.add_argument('--n_lists',default=None,type=int,help="number of IVF lists. Default sqrt(n_chunks)")
+    args = parser.parse_args()
+    main(**vars(args))
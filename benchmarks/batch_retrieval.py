@@ -0,0 +1,68 @@
+'''
+Throughput of retrieve_and_rerank_batch against the sequential retrieve_and_rerank loop of demo.py.
+
+Run from the repository root:
+
+    python -m benchmarks.batch_retrieval --repeats 5
+
+Both bundled documents are indexed in a temporary store and their query sets (data/queries.json and
+data/queries_for_synthetic.json) are run through both paths. The deterministic local embedder is used unless
+--openai is given, the cross-encoder is the real one (use --do_rerank false to time the search alone).
+'''
+import argparse
+import json
+import tempfile
+import time
+
+import chunking
+import retrieval
+from local_embeddings import HashingEmbeddings
+
+DATASETS = [('data/document.json','data/queries.json'),
+            ('data/synthetic_document.json','data/queries_for_synthetic.json')]
+
+def main(repeats: int = 5, k: int = 1, first_k: int = 4, do_rerank: bool = True, batch_size: int = 32, openai: bool = False) -> list[dict]:
+    results = []
+    for document_fname,queries_fname in DATASETS:
+        with open(document_fname,'r') as f:
+            chunks = chunking.process_document(json.load(f))
+        with open(queries_fname,'r') as f:
+            queries = json.load(f)['queries']
+        embeddings = retrieval.get_embeddings() if openai else HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=persist_directory)
+            # warm up the models and caches once before timing
+            retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=k,first_k=first_k,do_rerank=do_rerank,batch_size=batch_size)
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                sequential = [retrieval.retrieve_and_rerank(q,vectorstore,k=k,first_k=first_k,do_rerank=do_rerank) for q in queries]
+            sequential_seconds = (time.perf_counter() - start)/repeats
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                batched = retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=k,first_k=first_k,do_rerank=do_rerank,batch_size=batch_size)
+            batched_seconds = (time.perf_counter() - start)/repeats
+
+        identical = [[r.page_content for r,_ in rs] for rs in sequential] == [[r.page_content for r,_ in rs] for rs in batched]
+        result = {'queries':queries_fname,
+                  'n_queries':len(queries),
+                  'sequential_qps':len(queries)/sequential_seconds,
+                  'batched_qps':len(queries)/batched_seconds,
+                  'speedup':sequential_seconds/batched_seconds,
+                  'identical_rankings':identical}
+        results.append(result)
+        print(f"{queries_fname}: sequential {result['sequential_qps']:.1f} q/s, batched {result['batched_qps']:.1f} q/s, "
+              f"speedup {result['speedup']:.2f}x, identical rankings: {identical}")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats',default=5,type=int,help="number of timed passes over each query set. Default 5")
+    parser.add_argument('--k',default=1,type=int,help="number of documents to retrieve per query. Default 1")
+    parser.add_argument('--first_k',default=4,type=int,help="number of candidates to rerank per query. Default 4")
+    parser.add_argument('--do_rerank',default=True,type=lambda t:t.lower()=='true',help="whether to do reranking. Default true")
+    parser.add_argument('--batch_size',default=32,type=int,help="cross-encoder batch size. Default 32")
+    parser.add_argument('--openai',action='store_true',default=False,help="use the (cached) OpenAI embedder instead of the local one")
+    args = parser.parse_args()
+    main(**vars(args))
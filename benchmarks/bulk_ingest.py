@@ -0,0 +1,59 @@
+'''
+Scaling of bulk ingestion (bulk_ingest.py) with the number of chunking processes.
+
+Run from the repository root:
+
+    python -m benchmarks.bulk_ingest --n_documents 200 --n_copies 20 --workers 1,2,4,8
+
+A directory of n_documents synthetic manuals (each n_copies perturbed copies of data/synthetic_document.json,
+with its own seed, see benchmarks.synthetic) is ingested from scratch into a NumPy store with the deterministic
+local embedder, after an untimed warm-up run (page cache, imports, first process pool), and the best of --repeats
+runs is kept per worker count. The throughput is reported with the speedup over the first worker count and the
+scaling efficiency (speedup / workers). The gain is bounded by the cores available (os.cpu_count()) and by the
+single writer, whose embedding and write time does not shrink with more chunking processes.
+'''
+import argparse
+import json
+import os
+import tempfile
+
+import bulk_ingest
+from benchmarks import synthetic
+from local_embeddings import HashingEmbeddings
+
+def write_corpus(directory: str, n_documents: int, n_copies: int) -> None:
+    for i in range(n_documents):
+        with open(os.path.join(directory,f'manual_{i:05d}.json'),'w') as f:
+            json.dump(synthetic.scale_document(n_copies,seed=i),f)
+
+def ingest(corpus: str, n_workers: int) -> dict:
+    with tempfile.TemporaryDirectory() as persist_directory:
+        return bulk_ingest.bulk_ingest(corpus,embeddings=HashingEmbeddings(),persist_directory=persist_directory,
+                                       backend='numpy',n_workers=n_workers)
+
+def main(n_documents: int = 200, n_copies: int = 20, workers: str = '1,2,4,8', repeats: int = 3) -> list[dict]:
+    print(f'{os.cpu_count()} cores')
+    results = []
+    workers = [int(n) for n in workers.split(',')]
+    with tempfile.TemporaryDirectory() as corpus:
+        write_corpus(corpus,n_documents,n_copies)
+        ingest(corpus,workers[0])
+        for n_workers in workers:
+            stats = min((ingest(corpus,n_workers) for _ in range(repeats)),key=lambda stats:stats['seconds'])
+            result = {'workers':n_workers,'documents':stats['ingested'],'chunks':stats['chunks'],'seconds':stats['seconds'],
+                      'documents_per_s':stats['ingested']/stats['seconds'],'chunks_per_s':stats['chunks']/stats['seconds']}
+            result['speedup'] = results[0]['seconds']/result['seconds'] if results else 1.0
+            result['efficiency'] = result['speedup']/n_workers
+            results.append(result)
+            print(f"{n_workers} workers: {result['documents_per_s']:.1f} documents/s, {result['chunks_per_s']:.0f} chunks/s, "
+                  f"speedup {result['speedup']:.2f}x, efficiency {100*result['efficiency']:.0f}%")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_documents',default=200,type=int,help="number of documents in the corpus. Default 200")
+    parser.add_argument('--n_copies',default=20,type=int,help="copies of the synthetic document's sections per document. Default 20")
+    parser.add_argument('--workers',default='1,2,4,8',type=str,help="comma separated numbers of chunking processes. Default 1,2,4,8")
+    parser.add_argument('--repeats',default=3,type=int,help="timed runs per worker count, the fastest is kept. Default 3")
+    args = parser.parse_args()
+    main(**vars(args))
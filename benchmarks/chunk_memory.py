@@ -0,0 +1,64 @@
+'''
+Memory per chunk of the chunk dicts of chunking.process_document against a chunk_store.ChunkStore.
+
+Run from the repository root:
+
+    python -m benchmarks.chunk_memory --n_copies 1000 --n_max_table_rows 1,4
+
+The scaled synthetic document (--n_copies perturbed copies of data/synthetic_document.json, see
+benchmarks.synthetic) is chunked both ways, and the memory the chunks hold on to (measured with tracemalloc,
+the document itself excluded since both keep it alive) is reported per chunk, with the chunking time and the
+time to rehydrate the dicts of k chunks from the store.
+'''
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+import chunking
+from benchmarks import synthetic
+
+def measure(build) -> tuple[object,int,float]:
+    """The result of build(), the bytes it still holds once built, and the time it took."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained,_ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result,retained,elapsed
+
+def main(n_copies: int = 1000, n_max_table_rows: str = '1,4', k: int = 10, seed: int = 0) -> list[dict]:
+    document = synthetic.scale_document(n_copies,seed=seed)
+    results = []
+    for n_rows in map(int,n_max_table_rows.split(',')):
+        chunks,dict_bytes,dict_s = measure(lambda:chunking.process_document(document,N_MAX_TABLE_ROWS=n_rows))
+        store,store_bytes,store_s = measure(lambda:chunking.process_document(document,N_MAX_TABLE_ROWS=n_rows,as_store=True))
+        assert len(chunks) == len(store)
+        rows = random.Random(seed).sample(range(len(store)),min(k,len(store)))
+        start = time.perf_counter()
+        rehydrated = [store.chunk(i) for i in rows]
+        rehydrate_ms = 1000*(time.perf_counter() - start)
+        assert rehydrated == [chunks[i] for i in rows]
+        result = {'n_max_table_rows':n_rows,'n_chunks':len(chunks),
+                  'dict_bytes_per_chunk':dict_bytes/len(chunks),'store_bytes_per_chunk':store_bytes/len(store),
+                  'dict_chunking_s':dict_s,'store_chunking_s':store_s,f'rehydrate_{k}_ms':rehydrate_ms}
+        results.append(result)
+        print(f"N_MAX_TABLE_ROWS {n_rows}, {len(chunks)} chunks: {result['dict_bytes_per_chunk']:.0f} bytes/chunk as dicts, "
+              f"{result['store_bytes_per_chunk']:.0f} bytes/chunk in a ChunkStore "
+              f"({result['dict_bytes_per_chunk']/result['store_bytes_per_chunk']:.1f}x), chunking {dict_s:.2f} / {store_s:.2f} s, "
+              f"rehydrating {k} chunks {rehydrate_ms:.2f} ms")
+        del chunks,store
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_copies',default=1000,type=int,help="copies of the synthetic document. Default 1000")
+    parser.add_argument('--n_max_table_rows',default='1,4',type=str,help="comma separated maximum rows per table chunk. Default 1,4")
+    parser.add_argument('--k',default=10,type=int,help="number of chunks rehydrated from the store. Default 10")
+    parser.add_argument('--seed',default=0,type=int,help="random seed. Default 0")
+    args = parser.parse_args()
+    main(**vars(args))
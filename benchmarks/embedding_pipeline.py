@@ -0,0 +1,68 @@
+'''
+Ingestion throughput and recovery benchmark for the batched embedding pipeline, against the local stub server.
+
+Run from the repository root:
+
+    python -m benchmarks.embedding_pipeline --n_chunks 2000 --error_rate 0.1
+
+For each worker count, all chunks are ingested through ingest.ingest_chunks, and the throughput, the number
+of 429s and retries, and whether every chunk made it into the store are reported. The first row (one worker,
+a single request for the whole corpus) corresponds to the previous Chroma.from_texts behavior.
+'''
+import argparse
+import json
+
+import chunking
+import ingest
+from stub_embedding_server import StubEmbeddingServer, HTTPEmbeddings
+
+class CountingStore:
+    """Vector store sink that only records which chunk IDs were written."""
+    def __init__(self):
+        self.ids = set()
+
+    def add_embeddings(self, ids, texts, metadatas, embeddings):
+        self.ids.update(ids)
+
+def make_chunks(n_chunks: int, document_fname: str = 'data/synthetic_document.json') -> list[dict]:
+    with open(document_fname,'r') as f:
+        chunks = chunking.process_document(json.load(f))
+    # distinct copies of the document's chunks, so each one costs a real embedding
+    return [dict(id=f'{i}-{c["id"]}',text=f'{c["text"]} ({i})',metadata=c['metadata'])
+            for i in range(n_chunks//len(chunks) + 1) for c in chunks][:n_chunks]
+
+def main(n_chunks: int = 2000,
+         workers: str = '1,2,4,8,16',
+         max_tokens: int = 2000,
+         latency: float = 0.05,
+         latency_per_token: float = 0.00002,
+         error_rate: float = 0.05,
+         max_concurrent: int = 8) -> list[dict]:
+    chunks = make_chunks(n_chunks)
+    server = StubEmbeddingServer(latency=latency,latency_per_token=latency_per_token,
+                                 error_rate=error_rate,max_concurrent=max_concurrent,retry_after=0.05).start()
+    embeddings = HTTPEmbeddings(server.url)
+    results = []
+    settings = [('single request',1,10**9,10**9)] + [(f'{w} workers',w,max_tokens,ingest.MAX_BATCH_SIZE) for w in map(int,workers.split(','))]
+    for name,n_workers,batch_tokens,batch_size in settings:
+        store = CountingStore()
+        stats = ingest.ingest_chunks(chunks,store,embeddings,max_tokens=batch_tokens,max_batch_size=batch_size,
+                                     max_workers=n_workers,base_delay=0.05,max_retries=20)
+        stats.update(setting=name,chunks_per_second=stats['chunks']/stats['seconds'],complete=len(store.ids) == len(chunks))
+        results.append(stats)
+        print(f"{name:>15}: {stats['chunks_per_second']:8.1f} chunks/s, {stats['batches']:4d} batches, "
+              f"{stats['rate_limited']:3d} rate limited, {stats['retries']:3d} retries, complete={stats['complete']}")
+    server.shutdown()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_chunks',default=2000,type=int,help="number of chunks to ingest. Default 2000")
+    parser.add_argument('--workers',default='1,2,4,8,16',type=str,help="comma separated worker counts to benchmark. Default 1,2,4,8,16")
+    parser.add_argument('--max_tokens',default=2000,type=int,help="token budget per embedding request. Default 2000")
+    parser.add_argument('--latency',default=0.05,type=float,help="stub server latency per request in seconds. Default 0.05")
+    parser.add_argument('--latency_per_token',default=0.00002,type=float,help="stub server latency per token in seconds. Default 0.00002")
+    parser.add_argument('--error_rate',default=0.05,type=float,help="probability of a 429 per request. Default 0.05")
+    parser.add_argument('--max_concurrent',default=8,type=int,help="concurrent requests the stub serves before answering 429. Default 8")
+    args = parser.parse_args()
+    main(**vars(args))
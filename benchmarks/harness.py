@@ -0,0 +1,302 @@
+'''
+Retrieval evaluation harness: ingest throughput, per-stage latency, peak memory and retrieval quality.
+
+Run from the repository root:
+
+    python -m benchmarks.harness --output baseline.json
+    # ... change chunking or retrieval ...
+    python -m benchmarks.harness --compare baseline.json
+
+Every query of data/queries.json and data/queries_for_synthetic.json has gold labels in data/gold_labels.json.
+A label names the section (and subsection) of a relevant chunk and a piece of its text, so labels still match
+when the chunking changes (e.g. N_MAX_TABLE_ROWS). Each document is chunked and ingested into a fresh store,
+then every query goes through the stages of retrieve_and_rerank one at a time: embed, search (with the lexical
+fusion in hybrid mode) and rerank. Reported per dataset:
+
+- chunking time and ingest throughput (chunks/s),
+- p50/p95/p99 latency of each stage and of the whole query,
+- recall@k (fraction of the gold chunks found in the top k) and MRR (of the first gold chunk) of the final ranking,
+- peak resident memory of the process so far.
+
+Finally, repeat traffic is replayed through retrieve_and_rerank with a semantic result cache (see
+semantic_cache.SemanticCache, --semantic_cache_threshold, 0 to skip): the labeled queries followed by
+--semantic_cache_repeats rounds of near-duplicates of them (a --semantic_cache_rate fraction of their words
+replaced, see benchmarks.synthetic.perturbed_queries), each scored against the labels of its original. The hit
+rate, the latency percentiles, the latency saving (relative to replaying the same traffic without the cache), and
+the recall@k and MRR of the results served are reported with the semantic_cache_ prefix.
+
+The scaled synthetic corpus (--n_copies perturbed copies of the synthetic document, see benchmarks.synthetic)
+is evaluated with the synthetic labels, which only match the original copy. The deterministic local embedder is
+used unless --openai is given, so the harness runs offline; reranking needs the cross-encoder and is off by default.
+'''
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import time
+
+import chunking
+import retrieval
+from benchmarks import synthetic
+from bm25 import BM25Index
+from local_embeddings import HashingEmbeddings
+from rerank_cache import RerankCache
+from semantic_cache import SemanticCache
+
+GOLD_LABELS_PATH = 'data/gold_labels.json'
+# metrics where a higher value is an improvement, for --compare
+HIGHER_IS_BETTER = ('recall','mrr','chunks_per_second','semantic_cache_hit_rate','semantic_cache_saving',
+                    'semantic_cache_recall','semantic_cache_mrr')
+
+def load_gold_labels(path: str = GOLD_LABELS_PATH) -> dict:
+    with open(path,'r') as f:
+        return json.load(f)
+
+def is_relevant(text: str, metadata: dict, label: dict) -> bool:
+    """Whether a chunk matches a gold label: the label's metadata values and a substring of its text."""
+    return label['contains'] in text and all(metadata.get(key) == value for key,value in label.items() if key != 'contains')
+
+def ranking_metrics(rankings: list[list[tuple[str,dict]]], labels: list[list[dict]], ks: list[int]) -> dict:
+    """
+    recall@k and MRR of ranked (text, metadata) results against the gold labels of each query.
+
+    Returns:
+        dict: 'recall@k' for each k, the mean fraction of a query's labels matched within its top k results, and
+            'mrr', the mean reciprocal rank of the first result matching any label (0 when none does).
+    """
+    metrics = {f'recall@{k}':0.0 for k in ks}
+    reciprocal_ranks = []
+    for ranking,relevant in zip(rankings,labels):
+        first_ranks = [next((rank for rank,(text,metadata) in enumerate(ranking,start=1) if is_relevant(text,metadata,label)),None)
+                       for label in relevant]
+        for k in ks:
+            metrics[f'recall@{k}'] += sum(rank is not None and rank <= k for rank in first_ranks)/len(relevant)
+        found = [rank for rank in first_ranks if rank is not None]
+        reciprocal_ranks.append(1/min(found) if found else 0.0)
+    metrics = {name:value/len(rankings) for name,value in metrics.items()}
+    metrics['mrr'] = sum(reciprocal_ranks)/len(reciprocal_ranks)
+    return metrics
+
+def percentiles(seconds: list[float], prefix: str) -> dict:
+    if not seconds:
+        return {}
+    seconds = sorted(seconds)
+    def at(p):
+        return 1000*seconds[min(len(seconds)-1,int(p/100*len(seconds)))]
+    return {f'{prefix}_p50_ms':at(50),f'{prefix}_p95_ms':at(95),f'{prefix}_p99_ms':at(99)}
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/2**20 if sys.platform == 'darwin' else maxrss/2**10
+
+def evaluate_dataset(name: str,
+                     document: dict,
+                     labels: list[dict],
+                     embeddings,
+                     ks: list[int],
+                     first_k: int,
+                     do_rerank: bool,
+                     backend: str,
+                     hybrid: bool,
+                     n_max_table_rows: int,
+                     early_exit_margin: float = None,
+                     max_tokens: int = None,
+                     overlap_tokens: int = 0,
+                     semantic_cache_threshold: float = 0.95,
+                     semantic_cache_repeats: int = 2,
+                     semantic_cache_rate: float = 0.05) -> dict:
+    """Chunks and ingests document into a temporary store, then runs and scores its labeled queries."""
+    queries = [label['query'] for label in labels]
+    lexical_index = BM25Index() if hybrid else None
+    start = time.perf_counter()
+    chunks = chunking.process_document(document,lexical_index=lexical_index,N_MAX_TABLE_ROWS=n_max_table_rows,
+                                       max_tokens=max_tokens,overlap_tokens=overlap_tokens)
+    chunk_seconds = time.perf_counter() - start
+    # a fresh rerank cache, so every (query, chunk) pair is scored by the cross-encoder
+    retrieval.rerank_cache = RerankCache(retrieval.reranker_name())
+    with tempfile.TemporaryDirectory() as persist_directory:
+        start = time.perf_counter()
+        vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=persist_directory,
+                                                    backend=backend,lexical_index=lexical_index)
+        ingest_seconds = time.perf_counter() - start
+
+        def run_query(query):
+            timings = {}
+            start = time.perf_counter()
+            vector = embeddings.embed_query(query)
+            timings['embed'] = time.perf_counter() - start
+            start = time.perf_counter()
+            results = retrieval.similarity_search_by_vectors(vectorstore,[vector],first_k)
+            if lexical_index is not None:
+                results = retrieval.hybrid_search([query],results,vectorstore,lexical_index,first_k)
+            timings['search'] = time.perf_counter() - start
+            if do_rerank:
+                start = time.perf_counter()
+                results = retrieval.rerank([query],results,first_k,
+                                           early_exit_margin=early_exit_margin if lexical_index is None else None)
+                timings['rerank'] = time.perf_counter() - start
+            return [(r.page_content,r.metadata) for r,_ in results[0]],timings
+
+        # warm up lazily loaded models before timing
+        run_query(queries[0])
+        retrieval.rerank_cache.clear()
+        rankings = []
+        stage_seconds = {'embed':[],'search':[],'rerank':[],'query':[]}
+        for query in queries:
+            ranking,timings = run_query(query)
+            rankings.append(ranking)
+            for stage,seconds in timings.items():
+                stage_seconds[stage].append(seconds)
+            stage_seconds['query'].append(sum(timings.values()))
+
+        def replay(traffic,semantic_cache):
+            # the rerank cache would also shorten the cache misses, start from an empty one as above
+            retrieval.rerank_cache.clear()
+            rankings,seconds = [],[]
+            for query in traffic:
+                start = time.perf_counter()
+                results = retrieval.retrieve_and_rerank(query,vectorstore,first_k,do_rerank=do_rerank,lexical_index=lexical_index,
+                                                        early_exit_margin=early_exit_margin,semantic_cache=semantic_cache)
+                seconds.append(time.perf_counter() - start)
+                rankings.append([(r.page_content,r.metadata) for r,_ in results])
+            return rankings,seconds
+
+        cached_rankings = []
+        if semantic_cache_threshold:
+            traffic = synthetic.perturbed_queries(queries,len(queries)*(1 + semantic_cache_repeats),rate=semantic_cache_rate)
+            _,uncached_seconds = replay(traffic,None)
+            semantic_cache = SemanticCache(threshold=semantic_cache_threshold)
+            cached_rankings,cached_seconds = replay(traffic,semantic_cache)
+
+    result = {'dataset':name,
+              'n_chunks':len(chunks),
+              'n_queries':len(queries),
+              'chunk_ms':1000*chunk_seconds,
+              'ingest_seconds':ingest_seconds,
+              'chunks_per_second':len(chunks)/ingest_seconds}
+    for stage,seconds in stage_seconds.items():
+        result.update(percentiles(seconds,stage))
+    result.update(ranking_metrics(rankings,[label['relevant'] for label in labels],ks))
+    if cached_rankings:
+        result['semantic_cache_hit_rate'] = semantic_cache.hit_rate
+        result.update(percentiles(cached_seconds,'semantic_cache_query'))
+        result['semantic_cache_saving'] = 1 - sum(cached_seconds)/sum(uncached_seconds)
+        cached_labels = [labels[i % len(labels)]['relevant'] for i in range(len(cached_rankings))]
+        cached_metrics = ranking_metrics(cached_rankings,cached_labels,ks)
+        result.update({f'semantic_cache_{metric}':value for metric,value in cached_metrics.items()})
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def compare(results: list[dict], baseline: list[dict]) -> list[dict]:
+    """
+    Differences of every numeric metric with a baseline run, for the datasets present in both.
+
+    Returns:
+        list[dict]: One row per dataset and metric, with the baseline and current values, the relative change and
+            whether it is an improvement.
+    """
+    baseline = {result['dataset']:result for result in baseline}
+    rows = []
+    for result in results:
+        before = baseline.get(result['dataset'])
+        if before is None:
+            continue
+        for metric,value in result.items():
+            if metric in ('dataset','n_queries') or not isinstance(value,(int,float)) or not isinstance(before.get(metric),(int,float)):
+                continue
+            change = (value - before[metric])/abs(before[metric]) if before[metric] else None
+            higher_is_better = metric.startswith(HIGHER_IS_BETTER)
+            rows.append({'dataset':result['dataset'],'metric':metric,'baseline':before[metric],'current':value,'change':change,
+                         'improved':None if value == before[metric] or metric == 'n_chunks' else (value > before[metric]) == higher_is_better})
+    return rows
+
+def main(gold_labels: str = GOLD_LABELS_PATH,
+         n_copies: int = 100,
+         ks: str = '1,3,5',
+         first_k: int = 5,
+         do_rerank: bool = False,
+         backend: str = 'numpy',
+         hybrid: bool = False,
+         n_max_table_rows: int = 1,
+         max_tokens: int = None,
+         overlap_tokens: int = 0,
+         rerank_engine: str = 'fp32',
+         early_exit_margin: float = None,
+         semantic_cache_threshold: float = 0.95,
+         semantic_cache_repeats: int = 2,
+         semantic_cache_rate: float = 0.05,
+         openai: bool = False,
+         output: str = None,
+         compare_to: str = None) -> dict:
+    ks = [int(k) for k in ks.split(',')]
+    gold = load_gold_labels(gold_labels)
+    datasets = []
+    for queries_fname,entry in gold.items():
+        with open(entry['document'],'r') as f:
+            datasets.append((queries_fname,json.load(f),entry['labels']))
+    if n_copies:
+        synthetic_labels = gold['data/queries_for_synthetic.json']['labels']
+        datasets.append((f'scaled_synthetic_x{n_copies}',synthetic.scale_document(n_copies),synthetic_labels))
+    embeddings = retrieval.get_embeddings() if openai else HashingEmbeddings()
+    retrieval.configure_reranker(rerank_engine)
+    config = {'n_copies':n_copies,'ks':ks,'first_k':first_k,'do_rerank':do_rerank,'backend':backend,'hybrid':hybrid,
+              'n_max_table_rows':n_max_table_rows,'max_tokens':max_tokens,'overlap_tokens':overlap_tokens,'rerank_engine':rerank_engine,'early_exit_margin':early_exit_margin,
+              'semantic_cache_threshold':semantic_cache_threshold,'semantic_cache_repeats':semantic_cache_repeats,
+              'semantic_cache_rate':semantic_cache_rate,'embeddings':getattr(embeddings,'model',type(embeddings).__name__)}
+    results = []
+    for name,document,labels in datasets:
+        result = evaluate_dataset(name,document,labels,embeddings,ks=ks,first_k=max(first_k,max(ks)),do_rerank=do_rerank,
+                                  backend=backend,hybrid=hybrid,n_max_table_rows=n_max_table_rows,
+                                  early_exit_margin=early_exit_margin,max_tokens=max_tokens,overlap_tokens=overlap_tokens,
+                                  semantic_cache_threshold=semantic_cache_threshold,semantic_cache_repeats=semantic_cache_repeats,
+                                  semantic_cache_rate=semantic_cache_rate)
+        results.append(result)
+        print(f"{name}: {result['n_chunks']} chunks, ingest {result['chunks_per_second']:.0f} chunks/s, "
+              f"query p50 {result['query_p50_ms']:.2f} ms p99 {result['query_p99_ms']:.2f} ms, "
+              + ', '.join(f"recall@{k} {result[f'recall@{k}']:.2f}" for k in ks)
+              + f", MRR {result['mrr']:.3f}, peak RSS {result['peak_rss_mb']:.0f} MB")
+        if 'semantic_cache_hit_rate' in result:
+            print(f"{name} semantic cache: hit rate {100*result['semantic_cache_hit_rate']:.0f}%, "
+                  f"latency saving {100*result['semantic_cache_saving']:.0f}%, "
+                  + ', '.join(f"recall@{k} {result[f'semantic_cache_recall@{k}']:.2f}" for k in ks)
+                  + f", MRR {result['semantic_cache_mrr']:.3f}")
+    report = {'config':config,'results':results}
+    if compare_to is not None:
+        with open(compare_to,'r') as f:
+            baseline = json.load(f)
+        report['comparison'] = compare(results,baseline['results'])
+        for row in report['comparison']:
+            if row['improved'] is None:
+                continue
+            change = '' if row['change'] is None else f" ({100*row['change']:+.1f}%)"
+            print(f"{row['dataset']} {row['metric']}: {row['baseline']:.4g} -> {row['current']:.4g}{change} "
+                  f"{'better' if row['improved'] else 'worse'}")
+    if output is not None:
+        with open(output,'w') as f:
+            json.dump(report,f,indent=2)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gold_labels',default=GOLD_LABELS_PATH,type=str,help=f"gold labels of the query sets. Default {GOLD_LABELS_PATH}")
+    parser.add_argument('--n_copies',default=100,type=int,help="copies of the synthetic document in the scaled corpus, 0 to skip it. Default 100")
+    parser.add_argument('--ks',default='1,3,5',type=str,help="comma separated k of recall@k. Default 1,3,5")
+    parser.add_argument('--first_k',default=5,type=int,help="number of candidates retrieved (and reranked) per query. Default 5")
+    parser.add_argument('--do_rerank',default=False,type=lambda t:t.lower()=='true',help="whether to rerank with the cross-encoder. Default false")
+    parser.add_argument('--backend',default='numpy',choices=['chroma','numpy','ivf'],help="vector store backend. Default numpy")
+    parser.add_argument('--hybrid',action='store_true',default=False,help="fuse dense and BM25 lexical candidates")
+    parser.add_argument('--n_max_table_rows',default=1,type=int,help="maximum number of rows per table chunk. Default 1")
+    parser.add_argument('--max_tokens',default=None,type=int,help="token budget per chunk, larger chunks are split. Default none")
+    parser.add_argument('--overlap_tokens',default=0,type=int,help="tokens repeated between the pieces of a split chunk. Default 0")
+    parser.add_argument('--rerank_engine',default='fp32',choices=['fp32','int8'],help="cross-encoder engine. Default fp32")
+    parser.add_argument('--early_exit_margin',default=None,type=float,help="adaptive reranking margin on the dense distances. Default none")
+    parser.add_argument('--semantic_cache_threshold',default=0.95,type=float,help="cosine threshold of the semantic result cache pass, 0 to skip it. Default 0.95")
+    parser.add_argument('--semantic_cache_repeats',default=2,type=int,help="rounds of near-duplicate queries replayed after the labeled ones. Default 2")
+    parser.add_argument('--semantic_cache_rate',default=0.05,type=float,help="fraction of the words replaced in the near-duplicate queries. Default 0.05")
+    parser.add_argument('--openai',action='store_true',default=False,help="use the (cached) OpenAI embedder instead of the local one")
+    parser.add_argument('--output',default=None,type=str,help="write the report to this JSON file")
+    parser.add_argument('--compare',dest='compare_to',default=None,type=str,help="a previous report to compare against")
+    args = parser.parse_args()
+    main(**vars(args))
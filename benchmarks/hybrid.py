@@ -0,0 +1,68 @@
+'''
+Hit rate and rerank cost of hybrid (dense + BM25) candidate retrieval against dense retrieval alone.
+
+Run from the repository root:
+
+    python -m benchmarks.hybrid --first_ks 1,2,3,4,6,8
+
+Both bundled documents are indexed with their lexical index, and for each query the reference answer is the
+chunk the cross-encoder ranks first among all the chunks of the document (reranking everything is the best
+first_k can do). For each first_k, the fraction of queries whose reference chunk is among the candidates sent to
+the reranker is reported for dense and hybrid retrieval, with the number of cross-encoder pairs scored: the
+smallest first_k at which hybrid retrieval matches the hit rate of a larger dense first_k is the rerank saving.
+The deterministic local embedder is used unless --openai is given.
+'''
+import argparse
+import json
+import tempfile
+import time
+
+import chunking
+import retrieval
+from bm25 import BM25Index
+from local_embeddings import HashingEmbeddings
+
+DATASETS = [('data/document.json','data/queries.json'),
+            ('data/synthetic_document.json','data/queries_for_synthetic.json')]
+
+def reference_chunks(queries: list[str], chunks: list[dict]) -> list[str]:
+    """The text of the chunk the cross-encoder scores highest for each query, out of all the chunks."""
+    pairs = [[query,chunk['text']] for query in queries for chunk in chunks]
+    scores = retrieval.get_cross_encoder().predict(pairs,batch_size=64)
+    return [max(range(len(chunks)),key=lambda i:scores[q*len(chunks)+i]) for q in range(len(queries))]
+
+def main(first_ks: str = '1,2,3,4,6,8', rrf_k: int = retrieval.RRF_K, openai: bool = False) -> list[dict]:
+    results = []
+    for document_fname,queries_fname in DATASETS:
+        lexical_index = BM25Index()
+        with open(document_fname,'r') as f:
+            chunks = chunking.process_document(json.load(f),lexical_index=lexical_index)
+        with open(queries_fname,'r') as f:
+            queries = json.load(f)['queries']
+        references = [chunks[i]['text'] for i in reference_chunks(queries,chunks)]
+        embeddings = retrieval.get_embeddings() if openai else HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=persist_directory,
+                                                        lexical_index=lexical_index)
+            for first_k in map(int,first_ks.split(',')):
+                result = {'queries':queries_fname,'n_chunks':len(chunks),'first_k':first_k}
+                for mode,index in [('dense',None),('hybrid',lexical_index)]:
+                    start = time.perf_counter()
+                    candidates = retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=first_k,first_k=first_k,
+                                                                     do_rerank=False,lexical_index=index,rrf_k=rrf_k)
+                    result[f'{mode}_ms'] = 1000*(time.perf_counter() - start)/len(queries)
+                    result[f'{mode}_hit_rate'] = sum(reference in [r.page_content for r,_ in c]
+                                                     for reference,c in zip(references,candidates))/len(queries)
+                    result[f'{mode}_rerank_pairs'] = sum(len(c) for c in candidates)
+                results.append(result)
+                print(f"{queries_fname} first_k {first_k}: hit rate dense {result['dense_hit_rate']:.2f} / hybrid {result['hybrid_hit_rate']:.2f}, "
+                      f"{result['hybrid_rerank_pairs']} rerank pairs, retrieval {result['dense_ms']:.2f} / {result['hybrid_ms']:.2f} ms/query")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first_ks',default='1,2,3,4,6,8',type=str,help="comma separated numbers of candidates to rerank. Default 1,2,3,4,6,8")
+    parser.add_argument('--rrf_k',default=retrieval.RRF_K,type=int,help="rank offset of reciprocal rank fusion. Default 60")
+    parser.add_argument('--openai',action='store_true',default=False,help="use the (cached) OpenAI embedder instead of the local one")
+    args = parser.parse_args()
+    main(**vars(args))
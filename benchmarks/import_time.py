@@ -0,0 +1,53 @@
+'''
+Import-time guard for the lazily initialized retrieval module.
+
+Run from the repository root:
+
+    python -m benchmarks.import_time
+
+Imports each module in a fresh interpreter a few times and reports the median wall time, and fails (exit code 1)
+if the import pulled in one of the heavy dependencies (langchain, chromadb, sentence_transformers, torch) or
+took longer than --max_seconds. `python demo.py --help` is checked the same way.
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['langchain_community','langchain_core','chromadb','sentence_transformers','torch']
+
+def measure(code: str, repeats: int) -> tuple[float,list[str]]:
+    """Runs code in fresh interpreters, returns the median wall time and the heavy modules it imported."""
+    probe = code + f'\nimport sys,json\nprint(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))'
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable,'-c',probe],capture_output=True,text=True,check=True).stdout
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings),json.loads(output.splitlines()[-1])
+
+def main(repeats: int = 5, max_seconds: float = 1.0) -> bool:
+    baseline,_ = measure('pass',repeats)
+    checks = {'import chunking':'import chunking',
+              'import retrieval':'import retrieval',
+              'python demo.py --help':"import sys,runpy,contextlib,io\nsys.argv=['demo.py','--help']\n"
+                                      "with contextlib.redirect_stdout(io.StringIO()):\n"
+                                      "    try: runpy.run_path('demo.py',run_name='__main__')\n"
+                                      "    except SystemExit: pass"}
+    ok = True
+    for name,code in checks.items():
+        seconds,heavy = measure(code,repeats)
+        passed = not heavy and seconds - baseline <= max_seconds
+        ok = ok and passed
+        print(f"{name:>22}: {seconds*1000:7.1f} ms ({(seconds-baseline)*1000:7.1f} ms over a bare interpreter), "
+              f"heavy modules: {heavy or 'none'} {'OK' if passed else 'FAIL'}")
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats',default=5,type=int,help="fresh interpreters per measurement. Default 5")
+    parser.add_argument('--max_seconds',default=1.0,type=float,help="allowed import time over a bare interpreter. Default 1.0")
+    args = parser.parse_args()
+    sys.exit(0 if main(**vars(args)) else 1)
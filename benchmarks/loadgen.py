@@ -0,0 +1,103 @@
+'''
+Load generator for the retrieval service (service.py).
+
+Start the service, then run from the repository root:
+
+    python -m benchmarks.loadgen --qps 50 --duration 10
+
+Replays the queries of data/queries.json and data/queries_for_synthetic.json round robin at a fixed rate
+(open loop: requests are sent on schedule whether or not earlier ones have completed), then reports the
+achieved throughput, client side latency percentiles, errors, and the service's own /metrics.
+'''
+import argparse
+import asyncio
+import json
+import time
+from typing import Union
+
+QUERY_FILES = ['data/queries.json','data/queries_for_synthetic.json']
+
+async def request(method: str, path: str, payload: Union[None,dict] = None,
+                  host: str = '127.0.0.1', port: int = 8080, unix_socket: Union[None,str] = None) -> tuple[int,dict]:
+    """Sends one HTTP request to the service and returns the status and decoded JSON body."""
+    if unix_socket is not None:
+        reader,writer = await asyncio.open_unix_connection(unix_socket)
+    else:
+        reader,writer = await asyncio.open_connection(host,port)
+    body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n',b'\n',b''):
+            break
+        name,_,value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers['content-length']))
+    writer.close()
+    return status,json.loads(data)
+
+def percentile(values: list[float], p: float) -> Union[None,float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values)-1,int(p/100*len(values)))]
+
+async def run(qps: float = 20.0,
+              duration: float = 10.0,
+              k: int = 1,
+              host: str = '127.0.0.1',
+              port: int = 8080,
+              unix_socket: Union[None,str] = None) -> dict:
+    queries = []
+    for fname in QUERY_FILES:
+        with open(fname,'r') as f:
+            queries += json.load(f)['queries']
+    latencies = []
+    errors = 0
+
+    async def one(query):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status,_ = await request('POST','/query',{'query':query,'k':k},host=host,port=port,unix_socket=unix_socket)
+        except (OSError,asyncio.IncompleteReadError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+
+    n_requests = int(qps*duration)
+    start = time.perf_counter()
+    tasks = []
+    for i in range(n_requests):
+        delay = start + i/qps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(queries[i % len(queries)])))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    _,service_metrics = await request('GET','/metrics',host=host,port=port,unix_socket=unix_socket)
+    report = {'requests':n_requests,
+              'errors':errors,
+              'achieved_qps':len(latencies)/elapsed,
+              'p50_ms':None if not latencies else percentile(latencies,50)*1000,
+              'p99_ms':None if not latencies else percentile(latencies,99)*1000,
+              'service':service_metrics}
+    print(json.dumps(report,indent=4))
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--qps',default=20.0,type=float,help="requests per second to send. Default 20")
+    parser.add_argument('--duration',default=10.0,type=float,help="seconds to send requests for. Default 10")
+    parser.add_argument('--k',default=1,type=int,help="number of documents to retrieve per query. Default 1")
+    parser.add_argument('--host',default='127.0.0.1',type=str,help="service host. Default 127.0.0.1")
+    parser.add_argument('--port',default=8080,type=int,help="service port. Default 8080")
+    parser.add_argument('--unix_socket',default=None,type=str,help="connect to the service on this unix socket instead")
+    args = parser.parse_args()
+    asyncio.run(run(**vars(args)))
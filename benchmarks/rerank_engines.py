@@ -0,0 +1,112 @@
+'''
+CPU latency and ranking agreement of the reranking engines (fp32 and int8-quantized cross-encoder), and of
+adaptive early exit.
+
+Run from the repository root:
+
+    python -m benchmarks.rerank_engines --threads 1,2,4 --margins 0.05,0.1,0.2
+
+Both bundled query sets retrieve first_k candidates each from their document (deterministic local embedder).
+For every engine and thread count, each query's candidates are scored in one predict call, and the per-query
+latency percentiles are reported along with the agreement of the int8 ranking with the fp32 one: the fraction
+of queries with the same top-1, the mean overlap of the top-k, and the largest absolute score difference. For
+each early exit margin, the fraction of cross-encoder pairs skipped, the fraction of queries left with a single
+candidate and the top-1 agreement with a full rerank are reported.
+'''
+import argparse
+import json
+import tempfile
+import time
+
+import chunking
+import reranker
+import retrieval
+from local_embeddings import HashingEmbeddings
+
+DATASETS = [('data/document.json','data/queries.json'),
+            ('data/synthetic_document.json','data/queries_for_synthetic.json')]
+
+def candidates(first_k: int) -> list[tuple[str,list]]:
+    """(query, [(Document, distance), ...]) for every query of both query sets."""
+    pairs = []
+    for document_fname,queries_fname in DATASETS:
+        with open(document_fname,'r') as f:
+            chunks = chunking.process_document(json.load(f))
+        with open(queries_fname,'r') as f:
+            queries = json.load(f)['queries']
+        embeddings = HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=persist_directory,backend='numpy')
+            results = retrieval.similarity_search_by_vectors(vectorstore,embeddings.embed_documents(queries),first_k)
+        pairs.extend(zip(queries,results))
+    return pairs
+
+def score(cross_encoder, query_candidates: list[tuple[str,list]], repeats: int = 3) -> tuple[list[list[float]],list[float]]:
+    """Cross-encoder scores of every query's candidates, and the best per-query latency over repeats."""
+    scores,latencies = [],[]
+    for query,results in query_candidates:
+        pairs = [[query,r.page_content] for r,_ in results]
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            query_scores = [float(s) for s in cross_encoder.predict(pairs,batch_size=len(pairs))]
+            best = min(best,time.perf_counter() - start)
+        scores.append(query_scores)
+        latencies.append(best)
+    return scores,latencies
+
+def top(scores: list[float], k: int) -> list[int]:
+    return sorted(range(len(scores)),key=lambda i:-scores[i])[:k]
+
+def agreement(reference: list[list[float]], scores: list[list[float]], k: int) -> dict:
+    return {'top1_agreement':sum(top(r,1) == top(s,1) for r,s in zip(reference,scores))/len(reference),
+            f'top{k}_overlap':sum(len(set(top(r,k)) & set(top(s,k)))/k for r,s in zip(reference,scores))/len(reference),
+            'max_score_diff':max(abs(a - b) for r,s in zip(reference,scores) for a,b in zip(r,s))}
+
+def percentile(latencies: list[float], p: float) -> float:
+    latencies = sorted(latencies)
+    return 1000*latencies[min(len(latencies)-1,int(p/100*len(latencies)))]
+
+def main(first_k: int = 8, k: int = 3, threads: str = '1,2,4', margins: str = '0.05,0.1,0.2',
+         model: str = retrieval.CROSS_ENCODER_MODEL, repeats: int = 3) -> dict:
+    query_candidates = candidates(first_k)
+    engines = []
+    reference = None
+    for engine in reranker.ENGINES:
+        for n_threads in map(int,threads.split(',')):
+            cross_encoder = reranker.load_cross_encoder(model,engine=engine,num_threads=n_threads)
+            score(cross_encoder,query_candidates[:1],repeats=1)
+            scores,latencies = score(cross_encoder,query_candidates,repeats=repeats)
+            if reference is None:
+                reference = scores
+            result = {'engine':engine,'threads':n_threads,'p50_ms':percentile(latencies,50),'p99_ms':percentile(latencies,99)}
+            result.update(agreement(reference,scores,k))
+            engines.append(result)
+            print(f"{engine} x{n_threads} threads: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms per query "
+                  f"(up to {first_k} pairs), top-1 agreement with fp32 {result['top1_agreement']:.2f}, "
+                  f"top-{k} overlap {result[f'top{k}_overlap']:.2f}, max score diff {result['max_score_diff']:.4f}")
+
+    early_exit = []
+    for margin in map(float,margins.split(',')):
+        kept = [reranker.prune_candidates(results,1,margin) for _,results in query_candidates]
+        # a query pruned down to one candidate keeps it (its single pair is still scored)
+        top1 = [0 if len(results) == 1 else top(scores[:len(results)],1)[0] for results,scores in zip(kept,reference)]
+        result = {'margin':margin,
+                  'pairs_skipped':1 - sum(len(r) for r in kept)/sum(len(r) for _,r in query_candidates),
+                  'queries_single':sum(len(r) == 1 for r in kept)/len(kept),
+                  'top1_agreement':sum(t == top(s,1)[0] for t,s in zip(top1,reference))/len(reference)}
+        early_exit.append(result)
+        print(f"early exit margin {margin}: {100*result['pairs_skipped']:.0f}% of pairs skipped, {100*result['queries_single']:.0f}% "
+              f"of queries left with one candidate, top-1 agreement with a full rerank {result['top1_agreement']:.2f}")
+    return {'engines':engines,'early_exit':early_exit}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--first_k',default=8,type=int,help="number of candidates reranked per query. Default 8")
+    parser.add_argument('--k',default=3,type=int,help="k of the top-k overlap. Default 3")
+    parser.add_argument('--threads',default='1,2,4',type=str,help="comma separated CPU thread counts. Default 1,2,4")
+    parser.add_argument('--margins',default='0.05,0.1,0.2',type=str,help="comma separated early exit margins. Default 0.05,0.1,0.2")
+    parser.add_argument('--model',default=retrieval.CROSS_ENCODER_MODEL,type=str,help="cross-encoder model name or path")
+    parser.add_argument('--repeats',default=3,type=int,help="timed repeats per query, the best is kept. Default 3")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,72 @@
+'''
+Chunking throughput and chunk sizes with token-budgeted splitting (chunking.standardize_chunks(max_tokens=...)).
+
+Run from the repository root:
+
+    python -m benchmarks.splitting --n_copies 200 --max_tokens 128,256,512
+
+Besides the scaled synthetic document (--n_copies perturbed copies of data/synthetic_document.json, see
+benchmarks.synthetic), whose blocks are small, a document with oversized blocks is built from it: every
+section's content, code block and table rows are concatenated into one huge content, code block and table. Both
+are chunked without a budget and with each max_tokens, and the chunking throughput (MB of block text per second),
+the number of chunks and the largest and mean chunk size in estimated tokens are reported.
+'''
+import argparse
+import time
+
+import chunking
+from benchmarks import synthetic
+
+def oversized_document(document: dict) -> dict:
+    """One section holding all the content, code and table rows of document."""
+    contents,code_blocks,rows = [],[],[]
+    headers = None
+    def collect(node):
+        if 'content' in node:
+            contents.append(node['content'])
+        if 'code_block' in node:
+            code_blocks.append(node['code_block'])
+        if 'table' in node:
+            nonlocal headers
+            headers = headers or node['table']['headers']
+            rows.extend(row for row in node['table']['rows'] if len(row) == len(headers))
+        for key,value in node.items():
+            if key.endswith('sections'):
+                for inner in value:
+                    collect(inner)
+    collect(document)
+    return {'title':document['title'],
+            'sections':[{'title':'Everything','content':'\n\n'.join(contents),'code_block':'\n\n'.join(code_blocks),
+                         'table':{'headers':headers,'rows':rows}}]}
+
+def block_size(document: dict) -> int:
+    """Characters of block text (content, code and table cells) in document."""
+    return sum(len(chunk['metadata']['raw_content']) for chunk in chunking.flatten_chunks(document,metadata={},titles=[]))
+
+def main(n_copies: int = 200, max_tokens: str = '128,256,512', overlap_tokens: int = 16, repeats: int = 3) -> list[dict]:
+    scaled = synthetic.scale_document(n_copies)
+    results = []
+    for name,document in [(f'scaled_synthetic_x{n_copies}',scaled),('oversized_blocks',oversized_document(scaled))]:
+        size = block_size(document)
+        for budget in [None] + [int(t) for t in max_tokens.split(',')]:
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                chunks = chunking.process_document(document,max_tokens=budget,overlap_tokens=overlap_tokens if budget else 0)
+                best = min(best,time.perf_counter() - start)
+            tokens = [chunking.estimate_tokens(chunk['text']) for chunk in chunks]
+            result = {'document':name,'max_tokens':budget,'n_chunks':len(chunks),'max_chunk_tokens':max(tokens),
+                      'mean_chunk_tokens':sum(tokens)/len(tokens),'seconds':best,'mb_per_s':size/best/1e6}
+            results.append(result)
+            print(f"{name} max_tokens {budget}: {len(chunks)} chunks, largest {result['max_chunk_tokens']} tokens, "
+                  f"mean {result['mean_chunk_tokens']:.0f} tokens, {result['mb_per_s']:.1f} MB/s")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_copies',default=200,type=int,help="copies of the synthetic document. Default 200")
+    parser.add_argument('--max_tokens',default='128,256,512',type=str,help="comma separated token budgets. Default 128,256,512")
+    parser.add_argument('--overlap_tokens',default=16,type=int,help="tokens repeated between the pieces of a split block. Default 16")
+    parser.add_argument('--repeats',default=3,type=int,help="timed repeats, the best is kept. Default 3")
+    args = parser.parse_args()
+    main(**vars(args))
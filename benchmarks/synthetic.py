@@ -0,0 +1,72 @@
+'''
+Scaled synthetic corpora, generated from data/synthetic_document.json.
+
+The document's sections are replicated n_copies times. Each copy is tagged with its own product name in the
+section titles and has a fraction of its words replaced by random words from the document's vocabulary, so the
+copies embed close to, but not on top of, each other, like the many near-duplicate sections of a large manual
+collection.
+'''
+import copy
+import json
+import random
+import re
+
+WORD_PATTERN = re.compile(r'[A-Za-z]+')
+
+def vocabulary(document) -> list[str]:
+    return sorted(set(WORD_PATTERN.findall(json.dumps(document))))
+
+def perturb(text: str, rng: random.Random, words: list[str], rate: float) -> str:
+    """Replaces each word of text by a random vocabulary word with probability rate."""
+    return WORD_PATTERN.sub(lambda m:rng.choice(words) if rng.random() < rate else m.group(0),text)
+
+def _perturb_values(node, rng, words, rate, suffix):
+    if isinstance(node,dict):
+        return {k:(v + suffix if k == 'title' and isinstance(v,str) else _perturb_values(v,rng,words,rate,suffix))
+                for k,v in node.items()}
+    if isinstance(node,list):
+        return [_perturb_values(v,rng,words,rate,suffix) for v in node]
+    if isinstance(node,str):
+        return perturb(node,rng,words,rate)
+    return node
+
+def scale_document(n_copies: int,
+                   document_fname: str = 'data/synthetic_document.json',
+                   rate: float = 0.2,
+                   seed: int = 0) -> dict:
+    """
+    Builds a document with n_copies perturbed copies of the sections of document_fname.
+
+    Args:
+        n_copies (int): Number of copies of the document's sections.
+        document_fname (str, optional): The document to scale. Defaults to data/synthetic_document.json.
+        rate (float, optional): Fraction of the words replaced in each copy. Defaults to 0.2.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        dict: The scaled document, in the same format as the input.
+    """
+    with open(document_fname,'r') as f:
+        document = json.load(f)
+    rng = random.Random(seed)
+    words = vocabulary(document)
+    scaled = {k:v for k,v in document.items() if k != 'sections'}
+    scaled['sections'] = [_perturb_values(copy.deepcopy(section),rng,words,rate if i else 0.0,f' (model {i})' if i else '')
+                          for i in range(n_copies) for section in document['sections']]
+    return scaled
+
+def perturbed_queries(queries: list[str], n_queries: int, rate: float = 0.2, seed: int = 0) -> list[str]:
+    """Paraphrase-like variants of the given queries, n_queries in total."""
+    rng = random.Random(seed)
+    words = sorted({w for q in queries for w in WORD_PATTERN.findall(q)})
+    return [perturb(queries[i % len(queries)],rng,words,rate if i >= len(queries) else 0.0) for i in range(n_queries)]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_copies',default=100,type=int,help="number of copies of the document's sections. Default 100")
+    parser.add_argument('--rate',default=0.2,type=float,help="fraction of words replaced in each copy. Default 0.2")
+    parser.add_argument('--output',default='data/scaled_synthetic_document.json',type=str,help="where to write the scaled document")
+    args = parser.parse_args()
+    with open(args.output,'w') as f:
+        json.dump(scale_document(args.n_copies,rate=args.rate),f)
@@ -0,0 +1,77 @@
+'''
+Query latency of the NumPy vector store backend against Chroma.
+
+Run from the repository root:
+
+    python -m benchmarks.vector_store --sizes 1000,10000,100000
+
+For each corpus size, random unit vectors are inserted into both stores (with precomputed embeddings, so the
+embedder is not part of the measurement), then single-query latency percentiles, batched query throughput and
+the top-k overlap of Chroma's (approximate, HNSW) results with the exact NumPy results are reported.
+'''
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import ingest
+import retrieval
+from numpy_store import NumpyVectorStore
+
+def percentiles(timings: list[float]) -> dict:
+    timings = sorted(timings)
+    return {'p50_ms':1000*timings[len(timings)//2],'p99_ms':1000*timings[min(len(timings)-1,int(0.99*len(timings)))]}
+
+def main(sizes: str = '1000,10000,100000', dim: int = 256, n_queries: int = 200, k: int = 4, seed: int = 0) -> list[dict]:
+    from langchain_community.vectorstores import Chroma
+    rng = np.random.default_rng(seed)
+    results = []
+    for size in map(int,sizes.split(',')):
+        vectors = rng.standard_normal((size,dim),dtype=np.float32)
+        vectors /= np.linalg.norm(vectors,axis=1,keepdims=True)
+        queries = rng.standard_normal((n_queries,dim),dtype=np.float32)
+        queries /= np.linalg.norm(queries,axis=1,keepdims=True)
+        ids = [str(i) for i in range(size)]
+        texts = [f'chunk {i}' for i in range(size)]
+        metadatas = [{'raw_content':t} for t in texts]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            stores = {'chroma':Chroma(collection_name=retrieval.COLLECTION_NAME,client=retrieval.get_chroma_client(tmpdir+'/chroma')),
+                      'numpy':NumpyVectorStore(None,persist_directory=tmpdir+'/numpy')}
+            result = {'size':size,'dim':dim}
+            top_ids = {}
+            for name,store in stores.items():
+                start = time.perf_counter()
+                for i in range(0,size,ingest.MAX_BATCH_SIZE*16):
+                    batch = slice(i,i+ingest.MAX_BATCH_SIZE*16)
+                    ingest.add_embeddings(store,ids[batch],texts[batch],metadatas[batch],vectors[batch].tolist())
+                if name == 'numpy':
+                    store.save()
+                result[f'{name}_ingest_s'] = time.perf_counter() - start
+                timings = []
+                for q in queries:
+                    start = time.perf_counter()
+                    retrieval.similarity_search_by_vectors(store,[q.tolist()],k)
+                    timings.append(time.perf_counter() - start)
+                result.update({f'{name}_{key}':value for key,value in percentiles(timings).items()})
+                start = time.perf_counter()
+                batched = retrieval.similarity_search_by_vectors(store,queries.tolist(),k)
+                result[f'{name}_batched_qps'] = n_queries/(time.perf_counter() - start)
+                top_ids[name] = [[r.page_content for r,_ in rs] for rs in batched]
+            result['chroma_recall'] = statistics.mean(len(set(c) & set(n))/k for c,n in zip(top_ids['chroma'],top_ids['numpy']))
+        results.append(result)
+        print(f"{size:>7} chunks: single query p50 chroma {result['chroma_p50_ms']:.2f} ms / numpy {result['numpy_p50_ms']:.2f} ms, "
+              f"batched chroma {result['chroma_batched_qps']:.0f} q/s / numpy {result['numpy_batched_qps']:.0f} q/s, "
+              f"ingest chroma {result['chroma_ingest_s']:.1f} s / numpy {result['numpy_ingest_s']:.1f} s, "
+              f"chroma recall@{k} {result['chroma_recall']:.3f}")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes',default='1000,10000,100000',type=str,help="comma separated corpus sizes. Default 1000,10000,100000")
+    parser.add_argument('--dim',default=256,type=int,help="embedding dimension. Default 256")
+    parser.add_argument('--n_queries',default=200,type=int,help="number of queries. Default 200")
+    parser.add_argument('--k',default=4,type=int,help="number of results per query. Default 4")
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,139 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Iterable
+
+# identifiers such as config.set_ip, AES-256 or 192.168.1.1 are kept whole (and also split into their parts)
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[._\-:/@][A-Za-z0-9]+)*")
+PART_PATTERN = re.compile(r"[A-Za-z0-9]+")
+STOPWORDS = frozenset('''a an and are as at be by can do does for from how i in is it of on or that the this to what
+when where which who why with you your'''.split())
+
+def tokenize(text: str) -> list[str]:
+    """
+    Splits text into lowercase terms for lexical search.
+
+    Compound identifiers are kept as one term and their alphanumeric parts are added as separate terms, so
+    "config.set_ip" matches both the exact identifier and a query mentioning "config". Stopwords are dropped.
+    """
+    terms = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+class BM25Index:
+    """
+    Inverted index over chunk texts, scored with Okapi BM25, for lexical retrieval next to the dense vector search.
+
+    Exact identifiers, version strings and table values are matched by their terms rather than by embedding
+    similarity. Postings map each term to the chunk rows containing it and their term frequencies, and the index
+    is persisted as one JSON file.
+
+    Args:
+        k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+        b (float, optional): Document length normalization. Defaults to 0.75.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self._rows = {}
+        self._lengths = []
+        self._terms = []
+        self._postings = {}
+        self._total_length = 0
+        # bumped on every add and delete, caches of search results compare it (see retrieval.cache_state)
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, id_: str) -> bool:
+        return id_ in self._rows
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        """Indexes (or re-indexes) chunks by id."""
+        for id_,text in zip(ids,texts):
+            if id_ in self._rows:
+                self.delete([id_])
+            counts = Counter(tokenize(text))
+            row = len(self.ids)
+            self._rows[id_] = row
+            self.ids.append(id_)
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._terms.append(list(counts))
+            self._total_length += length
+            for term,count in counts.items():
+                self._postings.setdefault(term,{})[row] = count
+        self.version += 1
+
+    def delete(self, ids: Iterable[str]) -> None:
+        for id_ in ids:
+            row = self._rows.pop(id_,None)
+            if row is None:
+                continue
+            for term in self._terms[row]:
+                postings = self._postings[term]
+                del postings[row]
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths[row]
+            # the row is left empty, rows are renumbered when the index is saved
+            self.ids[row],self._lengths[row],self._terms[row] = None,0,[]
+            self.version += 1
+
+    def search(self, query: str, k: int) -> list[tuple[str,float]]:
+        """
+        Returns the (id, score) of the top-k chunks for query, best first. Chunks sharing no term with the query
+        are not returned, so there can be fewer than k results.
+        """
+        n = len(self._rows)
+        if n == 0:
+            return []
+        average_length = self._total_length/n
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5)/(len(postings) + 0.5))
+            for row,count in postings.items():
+                norm = self.k1*(1 - self.b + self.b*self._lengths[row]/average_length)
+                scores[row] = scores.get(row,0.0) + idf*count*(self.k1 + 1)/(count + norm)
+        top = sorted(scores.items(),key=lambda item:(-item[1],item[0]))[:k]
+        return [(self.ids[row],score) for row,score in top]
+
+    def save(self, path: str) -> None:
+        rows = [row for row,id_ in enumerate(self.ids) if id_ is not None]
+        renumber = {row:i for i,row in enumerate(rows)}
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        with open(path,'w') as f:
+            json.dump({'k1':self.k1,
+                       'b':self.b,
+                       'ids':[self.ids[row] for row in rows],
+                       'lengths':[self._lengths[row] for row in rows],
+                       'postings':{term:[[renumber[row],count] for row,count in postings.items()]
+                                   for term,postings in self._postings.items()}},f)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        with open(path,'r') as f:
+            data = json.load(f)
+        index = cls(k1=data['k1'],b=data['b'])
+        index.ids = data['ids']
+        index._rows = {id_:row for row,id_ in enumerate(index.ids)}
+        index._lengths = data['lengths']
+        index._total_length = sum(index._lengths)
+        index._terms = [[] for _ in index.ids]
+        for term,postings in data['postings'].items():
+            index._postings[term] = {row:count for row,count in postings}
+            for row,_ in postings:
+                index._terms[row].append(term)
+        return index
@@ -0,0 +1,247 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, Union
+
+import chunking
+import ingest
+import retrieval
+import tracing
+
+MANIFEST_FNAME = 'ingest_manifest.json'
+# metadata key holding the ID of the document a chunk comes from
+SOURCE_KEY = 'source'
+
+def discover(source: str) -> list[tuple[str,str]]:
+    """
+    Lists the JSON documents to ingest, with their source document IDs.
+
+    Args:
+        source (str): A directory, searched recursively for *.json files, or a glob pattern (** is recursive).
+
+    Returns:
+        list[tuple[str, str]]: (path, source ID) pairs, sorted by path. The source ID is the path relative to the
+            directory, or the path as matched by the glob pattern.
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source,'**','*.json'),recursive=True)
+        return [(path,os.path.relpath(path,source)) for path in sorted(paths)]
+    return [(path,path) for path in sorted(glob.glob(source,recursive=True)) if os.path.isfile(path)]
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda:f.read(1 << 20),b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_file(path: str, source: str, N_MAX_TABLE_ROWS: int = 1, max_tokens: Union[None,int] = None, overlap_tokens: int = 0) -> list[dict]:
+    """
+    Chunks one document, tagging every chunk with its source ID. Runs in the worker processes.
+
+    The source ID is part of the metadata, and so of the chunk IDs: identical chunks of different documents are
+    kept apart.
+    """
+    with open(path,'r') as f:
+        document = json.load(f)
+    chunks = chunking.process_document(document,N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,max_tokens=max_tokens,overlap_tokens=overlap_tokens)
+    for chunk in chunks:
+        chunk['metadata'] = dict(chunk['metadata'],**{SOURCE_KEY:source})
+        chunk['id'] = chunking.chunk_id(chunk)
+    return chunks
+
+class Manifest:
+    """
+    The documents already ingested into a store: for each source ID, the digest of the file that was ingested and
+    the IDs of its chunks. A document is only recorded once all of its chunks are written, so an interrupted run
+    resumes with the documents that were not finished, and a document whose file changed is ingested again (its
+    stale chunks are then deleted).
+
+    Args:
+        path (str): The JSON file the manifest is kept in.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path,'r') as f:
+                self.files = json.load(f)['files']
+
+    def is_done(self, source: str, digest: str) -> bool:
+        return self.files.get(source,{}).get('sha256') == digest
+
+    def ids(self, source: str) -> list[str]:
+        return self.files.get(source,{}).get('ids',[])
+
+    def mark_done(self, source: str, digest: str, ids: list[str]) -> None:
+        self.files[source] = {'sha256':digest,'ids':ids}
+
+    def remove(self, source: str) -> None:
+        self.files.pop(source,None)
+
+    def clear(self) -> None:
+        self.files = {}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok=True)
+        # write then rename, so an interruption never leaves a truncated manifest
+        with open(self.path + '.tmp','w') as f:
+            json.dump({'files':self.files},f)
+        os.replace(self.path + '.tmp',self.path)
+
+def bulk_ingest(source: str,
+                embeddings=None,
+                persist_directory: Union[None,str] = None,
+                backend: str = 'chroma',
+                n_workers: Union[None,int] = None,
+                max_workers: int = ingest.MAX_WORKERS,
+                manifest_path: Union[None,str] = None,
+                overwrite: bool = False,
+                prune: bool = False,
+                N_MAX_TABLE_ROWS: int = 1,
+                max_tokens: Union[None,int] = None,
+                overlap_tokens: int = 0,
+                checkpoint_every: float = 10.0) -> dict:
+    """
+    Ingests every JSON document of a directory (or glob pattern) into one vector store.
+
+    Documents are chunked in parallel on a pool of n_workers processes, and their chunks (tagged with the source ID
+    under SOURCE_KEY in the metadata) feed a single writer: ingest.ingest_chunks, which embeds them in token-budgeted
+    batches spanning documents and writes each batch to the store. Only 2*n_workers documents are chunked ahead of
+    the writer, so memory stays bounded however many documents there are.
+
+    Progress is recorded in a Manifest, saved every checkpoint_every seconds (after persisting the store) and at the
+    end: re-running skips the documents already ingested and unchanged, chunks already in the store are not
+    embedded again, and the stale chunks of changed documents are deleted. Several sources can be ingested into the
+    same store one after the other: with prune, the chunks of every document listed in the manifest but not found in
+    source are deleted, so only prune when source names all the documents the store should keep.
+
+    Args:
+        source (str): A directory or glob pattern, see discover.
+        embeddings (optional): The embedder to use. Defaults to the cached OpenAI embedder from retrieval.get_embeddings().
+        persist_directory (str, optional): Where the store is persisted, see retrieval.create_vector_store.
+        backend (str, optional): 'chroma', 'numpy' or 'ivf', see retrieval.create_vector_store. Defaults to 'chroma'.
+        n_workers (int, optional): Number of chunking processes. Defaults to os.cpu_count().
+        max_workers (int, optional): Number of concurrent embedding requests. Defaults to 4.
+        manifest_path (str, optional): The manifest file. Defaults to MANIFEST_FNAME in the persist directory.
+        overwrite (bool, optional): Empty the store and the manifest first. Defaults to False.
+        prune (bool, optional): Delete the documents of the manifest that are not in source. Defaults to False.
+        N_MAX_TABLE_ROWS (int, optional): Maximum number of rows per table chunk. Defaults to 1.
+        max_tokens (int, optional): Token budget per chunk, see chunking.standardize_chunks. Defaults to None.
+        overlap_tokens (int, optional): Tokens repeated between the pieces of a split block. Defaults to 0.
+        checkpoint_every (float, optional): Seconds between manifest checkpoints. Defaults to 10.
+
+    Returns:
+        dict: Stats: files (found), skipped (already ingested), ingested, removed (documents pruned),
+            chunks (written), deleted (stale chunks), seconds, and the ingest.ingest_chunks stats under 'ingest'.
+    """
+    start = time.perf_counter()
+    if embeddings is None:
+        embeddings = retrieval.get_embeddings()
+    if persist_directory is None:
+        persist_directory = retrieval.default_persist_directory(backend)
+    n_workers = n_workers or os.cpu_count() or 1
+    manifest = Manifest(manifest_path or os.path.join(persist_directory,MANIFEST_FNAME))
+    if overwrite:
+        manifest.clear()
+    vectorstore = retrieval.open_vector_store(embeddings,persist_directory=persist_directory,backend=backend,overwrite=overwrite)
+    files = discover(source)
+    todo = []
+    for path,source_id in files:
+        digest = file_digest(path)
+        if not manifest.is_done(source_id,digest):
+            todo.append((path,source_id,digest))
+    stats = {'files':len(files),'skipped':len(files) - len(todo),'ingested':0,'removed':0,'chunks':0,'deleted':0}
+    removed = set(manifest.files) - {source_id for _,source_id in files} if prune else set()
+    if removed:
+        stale_ids = [chunk_id for source_id in removed for chunk_id in manifest.ids(source_id)]
+        if stale_ids:
+            with tracing.span('vectorstore.delete'):
+                vectorstore.delete(ids=stale_ids)
+        for source_id in removed:
+            manifest.remove(source_id)
+        stats['removed'] = len(removed)
+        stats['deleted'] += len(stale_ids)
+    existing_ids = set(vectorstore.get(include=[])['ids'])
+    # documents being written: source ID -> [digest, chunk IDs, number of chunks not written yet]
+    pending = {}
+    last_checkpoint = time.monotonic()
+
+    def checkpoint():
+        retrieval.save_vector_store(vectorstore,backend)
+        manifest.save()
+
+    def complete(source_id):
+        nonlocal last_checkpoint
+        digest,ids,_ = pending.pop(source_id)
+        stale_ids = list(set(manifest.ids(source_id)) - set(ids))
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            stats['deleted'] += len(stale_ids)
+        manifest.mark_done(source_id,digest,ids)
+        stats['ingested'] += 1
+        tracing.count('documents_ingested')
+        if time.monotonic() - last_checkpoint >= checkpoint_every:
+            checkpoint()
+            last_checkpoint = time.monotonic()
+
+    def on_write(batch):
+        for chunk in batch:
+            source_id = chunk['metadata'][SOURCE_KEY]
+            pending[source_id][2] -= 1
+            if pending[source_id][2] == 0:
+                complete(source_id)
+        stats['chunks'] += len(batch)
+
+    def new_chunks() -> Iterator[dict]:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            queue = iter(todo)
+            in_flight = {}
+            exhausted = False
+            while not exhausted or in_flight:
+                while not exhausted and len(in_flight) < 2*n_workers:
+                    item = next(queue,None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    path,source_id,digest = item
+                    in_flight[executor.submit(chunk_file,path,source_id,N_MAX_TABLE_ROWS,max_tokens,overlap_tokens)] = (source_id,digest)
+                if not in_flight:
+                    break
+                done,_ = wait(in_flight,return_when=FIRST_COMPLETED)
+                for future in done:
+                    source_id,digest = in_flight.pop(future)
+                    chunks = list({c['id']:c for c in future.result()}.values())
+                    to_write = [c for c in chunks if c['id'] not in existing_ids]
+                    pending[source_id] = [digest,[c['id'] for c in chunks],len(to_write)]
+                    if not to_write:
+                        complete(source_id)
+                    yield from to_write
+
+    try:
+        with tracing.span('bulk_ingest'):
+            stats['ingest'] = ingest.ingest_chunks(new_chunks(),vectorstore,embeddings,max_workers=max_workers,on_write=on_write)
+    finally:
+        # the manifest only lists documents whose chunks are all written, so it is consistent even after an error
+        checkpoint()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source',type=str,help="directory of JSON documents (searched recursively) or glob pattern, e.g. 'manuals/**/*.json'")
+    parser.add_argument('--backend',default='chroma',choices=['chroma','numpy','ivf'],help="vector store backend. Default chroma")
+    parser.add_argument('--persist_directory',default=None,type=str,help="where the store is persisted. Default is the backend's default directory")
+    parser.add_argument('--n_workers',default=None,type=int,help="number of chunking processes. Default one per core")
+    parser.add_argument('--max_workers',default=ingest.MAX_WORKERS,type=int,help="number of concurrent embedding requests. Default 4")
+    parser.add_argument('--overwrite',action='store_true',default=False,help="wipe the store and the manifest before ingesting. Default is to resume")
+    parser.add_argument('--delete_missing',dest='prune',action='store_true',default=False,help="delete the documents ingested before that are no longer in source. Default is to keep them")
+    parser.add_argument('--n_max_table_rows',dest='N_MAX_TABLE_ROWS',default=1,type=int,help="maximum number of rows per table chunk. Default 1")
+    parser.add_argument('--max_tokens',default=None,type=int,help="token budget per chunk, larger text, code and tables are split. Default no budget")
+    parser.add_argument('--overlap_tokens',default=0,type=int,help="tokens repeated between the pieces of a split text or code block. Default 0")
+    args = parser.parse_args()
+    print(json.dumps(bulk_ingest(**vars(args)),indent=4))
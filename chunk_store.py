@@ -0,0 +1,237 @@
+import copy
+import hashlib
+import json
+from array import array
+from typing import Iterator, Union
+
+import chunking
+
+CHUNK_ANCHOR_KEYS = ["content","code_block","table"]
+# metadata key under which slim chunks carry their ID, see ChunkStore.iter_chunks
+CHUNK_ID_KEY = 'chunk_id'
+
+class ChunkStore:
+    """
+    Compact, column-oriented storage of the standardized chunks of a document.
+
+    process_document returns one dict per chunk, each with its own metadata dict and a stringified copy of its
+    raw content, which for table pieces repeats the headers in every piece. A ChunkStore instead keeps:
+
+    - the texts of all the chunks in a single UTF-8 buffer, with their start offsets in an array,
+    - the title paths as nodes of a section tree (parent node and title), shared by all the chunks of a section,
+    - the section metadata (section, subsection, ... titles) interned, one tuple per distinct metadata,
+    - the raw content as a reference into the source document: the node holding the anchor value ('content',
+      'code_block' or 'table'), as a node of a tree of (*sections key, index) steps, and for the pieces of a
+      split block the range of characters or table rows they hold,
+    - the chunk IDs as 32-byte digests in one buffer.
+
+    The per-chunk dicts of process_document (identical, including raw_content and IDs) are rebuilt on demand by
+    chunk(i) or iteration, so a retriever only rehydrates the top-k results. The source document is referenced,
+    not copied, and must not be modified while the store is in use.
+
+    Build one with ChunkStore.from_document or chunking.process_document(document, as_store=True).
+    """
+    def __init__(self, document: dict):
+        self.document = document
+        self._text = b''
+        self._offsets = array('q',[0])
+        self._digests = bytearray()
+        self._chunk_node = array('i')
+        self._chunk_metadata = array('i')
+        self._chunk_path = array('i')
+        self._chunk_key = array('b')
+        self._span_start = array('i')
+        self._span_stop = array('i')
+        # title tree: node -> parent node (-1 for the root) and title
+        self._node_parent = array('i')
+        self._node_title = []
+        self._metadatas = []
+        # document tree: path node -> parent path node (-1 for the document itself), *sections key and index
+        self._path_parent = array('i')
+        self._path_key = array('i')
+        self._path_index = array('i')
+        # interned strings: *sections keys and anchor keys
+        self._keys = []
+        # lookup tables of the interning, only kept while building
+        self._interned = {}
+        self._rows_by_id = None
+
+    @classmethod
+    def from_document(cls, document: dict, N_MAX_TABLE_ROWS: int = 1, max_tokens: Union[None,int] = None, overlap_tokens: int = 0) -> 'ChunkStore':
+        """
+        Chunks a document straight into a store, in the order and with the content of chunking.process_document.
+
+        Args:
+            document (dict): The document, kept by reference.
+            N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk (default is 1).
+            max_tokens (int, optional): Token budget per chunk, see chunking.standardize_chunks (default is None).
+            overlap_tokens (int): Tokens repeated between the pieces of a split block (default is 0).
+        """
+        store = cls(document)
+        texts = []
+        offset = 0
+        for key,value,titles,metadata,path in _iter_anchors(document,metadata={},titles=[],path=()):
+            node = store._intern_titles(titles)
+            metadata_id = store._intern_metadata(metadata)
+            path_node = store._intern_path(path)
+            key_id = store._intern_key(key)
+            for _,text,span in chunking.standardize_chunk({key:value,'titles':titles},N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,
+                                                          max_tokens=max_tokens,overlap_tokens=overlap_tokens):
+                raw_content = chunking.raw_content(key,value,span)
+                payload = json.dumps({'text':text,'metadata':dict(metadata,raw_content=raw_content)},sort_keys=True)
+                store._digests += hashlib.sha256(payload.encode('utf-8')).digest()
+                text = text.encode('utf-8')
+                texts.append(text)
+                offset += len(text)
+                store._offsets.append(offset)
+                store._chunk_node.append(node)
+                store._chunk_metadata.append(metadata_id)
+                store._chunk_path.append(path_node)
+                store._chunk_key.append(key_id)
+                start,stop = span if span is not None else (-1,-1)
+                store._span_start.append(start)
+                store._span_stop.append(stop)
+        store._text = b''.join(texts)
+        store._interned = {}
+        return store
+
+    def _intern_titles(self, titles: list[str]) -> int:
+        node = -1
+        for title in titles:
+            child = self._interned.get(('title',node,title))
+            if child is None:
+                child = len(self._node_title)
+                self._interned[('title',node,title)] = child
+                self._node_parent.append(node)
+                self._node_title.append(title)
+            node = child
+        return node
+
+    def _intern_metadata(self, metadata: dict) -> int:
+        items = tuple(metadata.items())
+        metadata_id = self._interned.get(('metadata',items))
+        if metadata_id is None:
+            metadata_id = len(self._metadatas)
+            self._interned[('metadata',items)] = metadata_id
+            self._metadatas.append(items)
+        return metadata_id
+
+    def _intern_key(self, key: str) -> int:
+        key_id = self._interned.get(('key',key))
+        if key_id is None:
+            key_id = len(self._keys)
+            self._interned[('key',key)] = key_id
+            self._keys.append(key)
+        return key_id
+
+    def _intern_path(self, path: tuple) -> int:
+        node = -1
+        for j in range(0,len(path),2):
+            key,index = path[j],path[j+1]
+            child = self._interned.get(('path',node,key,index))
+            if child is None:
+                child = len(self._path_parent)
+                self._interned[('path',node,key,index)] = child
+                self._path_parent.append(node)
+                self._path_key.append(self._intern_key(key))
+                self._path_index.append(index)
+            node = child
+        return node
+
+    def __len__(self) -> int:
+        return len(self._chunk_node)
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.iter_chunks()
+
+    def __getitem__(self, i: int) -> dict:
+        return self.chunk(i)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return self.index(chunk_id) is not None
+
+    def text(self, i: int) -> str:
+        return self._text[self._offsets[i]:self._offsets[i+1]].decode('utf-8')
+
+    def id(self, i: int) -> str:
+        return self._digests[32*i:32*(i+1)].hex()
+
+    def titles(self, i: int) -> list[str]:
+        titles = []
+        node = self._chunk_node[i]
+        while node != -1:
+            titles.append(self._node_title[node])
+            node = self._node_parent[node]
+        return titles[::-1]
+
+    def raw_content(self, i: int) -> str:
+        steps = []
+        path_node = self._chunk_path[i]
+        while path_node != -1:
+            steps.append((self._keys[self._path_key[path_node]],self._path_index[path_node]))
+            path_node = self._path_parent[path_node]
+        node = self.document
+        for key,index in reversed(steps):
+            node = node[key][index]
+        key = self._keys[self._chunk_key[i]]
+        span = None if self._span_start[i] == -1 else (self._span_start[i],self._span_stop[i])
+        return chunking.raw_content(key,node[key],span)
+
+    def metadata(self, i: int, raw_content: bool = True) -> dict:
+        """The metadata dict of chunk i, with its raw_content unless raw_content is False."""
+        metadata = dict(self._metadatas[self._chunk_metadata[i]])
+        if raw_content:
+            metadata['raw_content'] = self.raw_content(i)
+        return metadata
+
+    def chunk(self, i: int) -> dict:
+        """Rehydrates chunk i into the dict process_document returns for it."""
+        return {'text':self.text(i),'metadata':self.metadata(i),'id':self.id(i)}
+
+    def index(self, chunk_id: str) -> Union[None,int]:
+        """The position of the chunk with this ID (the first one for duplicated chunks), or None."""
+        if self._rows_by_id is None:
+            # built on first lookup only
+            self._rows_by_id = {}
+            for i in range(len(self)-1,-1,-1):
+                self._rows_by_id[bytes(self._digests[32*i:32*(i+1)])] = i
+        try:
+            return self._rows_by_id.get(bytes.fromhex(chunk_id))
+        except ValueError:
+            return None
+
+    def iter_chunks(self, slim: bool = False) -> Iterator[dict]:
+        """
+        Yields the chunks as dicts, one at a time.
+
+        With slim=True, the metadata holds the section titles and the chunk ID (under CHUNK_ID_KEY) but not the
+        raw_content, which is what retrieval.create_vector_store stores for a ChunkStore: results are then
+        rehydrated from the store (see retrieval.rehydrate) instead of the vector store keeping a copy of every
+        raw content.
+        """
+        for i in range(len(self)):
+            if slim:
+                chunk_id = self.id(i)
+                metadata = self.metadata(i,raw_content=False)
+                metadata[CHUNK_ID_KEY] = chunk_id
+                yield {'text':self.text(i),'metadata':metadata,'id':chunk_id}
+            else:
+                yield self.chunk(i)
+
+    def to_dicts(self) -> list[dict]:
+        return list(self.iter_chunks())
+
+def _iter_anchors(document: dict, metadata: dict, titles: list, path: tuple) -> Iterator[tuple]:
+    # the traversal of chunking.flatten_chunks, yielding (key, value, titles, metadata, path) for every anchor
+    # instead of building the chunk dicts. metadata is the live dict of the traversal: read it before resuming
+    if 'title' in document:
+        titles.append(document['title'])
+    for k in CHUNK_ANCHOR_KEYS:
+        if k in document:
+            yield k,document[k],titles,metadata,path
+    for k in document:
+        if k.endswith('sections'):
+            for i,inner_document in enumerate(document[k]):
+                if 'title' in inner_document:
+                    metadata[k[:-1]] = inner_document['title']
+                yield from _iter_anchors(inner_document,metadata=copy.copy(metadata),titles=copy.copy(titles),path=path+(k,i))
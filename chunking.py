@@ -1,7 +1,18 @@
+import ast
 import json
 import copy
+import hashlib
+import re
+from typing import Iterator, Union
+import tracing
+
+# estimate_tokens counts one token per CHARS_PER_TOKEN characters
+CHARS_PER_TOKEN = 4
+PARAGRAPH_PATTERN = re.compile(r'\n[ \t]*\n\s*')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?;:])\s+|\n')
+LINE_PATTERN = re.compile(r'\n')
+WORD_PATTERN = re.compile(r'\s+')
 
-# TODO: recursive splitting on simple text and tables
 # dprint = print
 dprint = lambda *args,**kwargs:None
 def flatten_chunks(document: dict,
@@ -70,6 +81,8 @@ def flatten_chunks(document: dict,
 def standardize_chunks(
                         chunks: list[dict],
                         N_MAX_TABLE_ROWS: int = 1,
+                        max_tokens: Union[None,int] = None,
+                        overlap_tokens: int = 0,
                        ) -> list[dict]:
     '''
     Standardizes a list of chunks by collapsing different types (text, code, table) into a unified text format.
@@ -77,89 +90,412 @@ def standardize_chunks(
     - For code chunks, titles are added as comments to the code.
     - For table chunks, the titles are added and the table is flattened into smaller chunks if necessary.
 
+    With max_tokens, oversized chunks are split so that every piece (title prefix included) stays within
+    max_tokens estimated tokens, see split_text: text on paragraphs then sentences, code on top-level statements
+    then lines, and tables by token budget instead of N_MAX_TABLE_ROWS. Every piece keeps the title prefix, and
+    its raw_content is the part of the block it holds (see raw_content).
+
     Args:
         chunks (list[dict]): A list of chunks where each chunk is a dictionary that may contain 'content', 
                               'code_block', or 'table' along with corresponding 'titles'.
-        N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk (default is 1).
+        N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk (default is 1). Ignored with max_tokens.
+        max_tokens (int, optional): Token budget per chunk (default is None, no splitting of text and code).
+        overlap_tokens (int): With max_tokens, number of tokens of text or code repeated from the end of a piece
+            at the start of the next one (default is 0).
 
     Returns:
         list[dict]: A list of processed chunks where each chunk is a dictionary with 'text' and 'metadata' keys.
     '''
-
-    to_remove = []
     new_chunks = []
-    for ic,chunk in enumerate(chunks):
-        '''
-        # content
-        '''
-        if 'content' in chunk and 'titles' in chunk:
-            # assert False
-            titles = chunk['titles']
-            new_title = f"Title: {','.join(titles)}"
-
-            new_content = new_title + '\n\n' + chunk['content']
-            # new_chunk = {'content':new_content}
-            new_chunk = new_content
-            # chunks[ic] = new_chunk
-            # chunks[ic] = dict(text=new_chunk,metadata=chunk['metadata'])
-            new_chunks.append(dict(text=new_chunk,metadata=chunk['metadata']))
-        '''
-        # code. NOTE/ASSUMPTION: we have python code
-        '''
-        if 'code_block' in chunk and 'titles' in chunk:
-            titles = chunk['titles']
-            new_title = f"# Code Block for: {','.join(titles)}"
-            new_code_block = new_title + '\n\n' + chunk['code_block']
-            # new_chunk = {'code_block':new_code_block}
-            new_chunk = new_code_block
-            # chunks[ic] = new_chunk
-            # chunks[ic] = dict(text=new_chunk,metadata=chunk['metadata'])
-            new_chunks.append( dict(text=new_chunk,metadata=chunk['metadata']))
-        '''
-        # table
-        '''
-        #========================================================
-        # flatten table
-        if 'table' in chunk and 'titles' in chunk:
-            # to_remove.append(ic)
-            titles = chunk['titles']
-            new_title = f"# Table for: {','.join(titles)}"
-            headers = chunk['table']['headers']
-            rows = chunk['table']['rows']
-
-            new_table = []
-            for row in rows:
-                new_row = {}
-                for h,el in zip(headers,row):
-                    new_row[h] = el
-                new_table.append(new_row)
-            #-------------------------------------------------------------------
-            # split the rows by  N_MAX_TABLE_ROWS
-            n_chunks = (len(rows) + N_MAX_TABLE_ROWS - 1)//N_MAX_TABLE_ROWS
-            metadata = chunk['metadata']
-            for j in range(n_chunks):
-
-                table_chunk = new_table[j*N_MAX_TABLE_ROWS:(j+1)*N_MAX_TABLE_ROWS]
-                table_as_text = json.dumps(table_chunk)
-                table_as_text = f'{new_title}\n{table_as_text}'
-                new_raw_content = {'headers':headers,'rows':rows}
-                new_raw_content['rows'] = new_raw_content['rows'][j*N_MAX_TABLE_ROWS:(j+1)*N_MAX_TABLE_ROWS]
-                new_metadata = metadata.copy()
-                new_metadata['raw_content'] = str(new_raw_content)
-                new_chunks.append(dict(text=table_as_text,metadata=new_metadata))
-    new_chunks = [ c for ic,c in enumerate(new_chunks) if ic not in to_remove ]
+    for chunk in chunks:
+        for key,text,span in standardize_chunk(chunk,N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,max_tokens=max_tokens,overlap_tokens=overlap_tokens):
+            if span is None:
+                new_chunks.append(dict(text=text,metadata=chunk['metadata']))
+                continue
+            new_metadata = chunk['metadata'].copy()
+            new_metadata['raw_content'] = raw_content(key,chunk[key],span)
+            new_chunks.append(dict(text=text,metadata=new_metadata))
     return new_chunks
-def process_document(document: dict) -> list[dict]:
+
+def standardize_chunk(chunk: dict,
+                      N_MAX_TABLE_ROWS: int = 1,
+                      max_tokens: Union[None,int] = None,
+                      overlap_tokens: int = 0) -> Iterator[tuple[str,str,Union[None,tuple[int,int]]]]:
+    '''
+    Yields the standardized texts of a single flattened chunk, see standardize_chunks.
+
+    Only 'titles' and the anchor keys ('content', 'code_block', 'table') of the chunk are used, its metadata is
+    left to the caller.
+
+    Args:
+        chunk (dict): A flattened chunk.
+        N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk (default is 1).
+        max_tokens (int, optional): Token budget per piece, see standardize_chunks (default is None).
+        overlap_tokens (int): Tokens repeated between consecutive text or code pieces (default is 0).
+
+    Yields:
+        tuple[str, str, Union[None, tuple[int, int]]]: The anchor key the text comes from, the text, and the span
+            of the block it holds, see raw_content: None for a whole content or code block, the (start, stop)
+            character range of a piece of a split one, or the (start, stop) range of the rows of a table piece.
+    '''
+    if 'titles' not in chunk:
+        return
+    titles = ','.join(chunk['titles'])
+    # content
+    if 'content' in chunk:
+        new_title = f"Title: {titles}"
+        for span in _split_block(chunk['content'],new_title + '\n\n','text',max_tokens,overlap_tokens):
+            piece = chunk['content'] if span is None else chunk['content'][span[0]:span[1]]
+            yield 'content',new_title + '\n\n' + piece,span
+    # code. NOTE/ASSUMPTION: we have python code
+    if 'code_block' in chunk:
+        new_title = f"# Code Block for: {titles}"
+        for span in _split_block(chunk['code_block'],new_title + '\n\n','code',max_tokens,overlap_tokens):
+            piece = chunk['code_block'] if span is None else chunk['code_block'][span[0]:span[1]]
+            yield 'code_block',new_title + '\n\n' + piece,span
+    # table, split by N_MAX_TABLE_ROWS rows, or by token budget
+    if 'table' in chunk:
+        new_title = f"# Table for: {titles}"
+        headers = chunk['table']['headers']
+        rows = chunk['table']['rows']
+        if max_tokens is not None:
+            for text,span in _split_table(new_title,headers,rows,max_tokens):
+                yield 'table',text,span
+            return
+        n_chunks = (len(rows) + N_MAX_TABLE_ROWS - 1)//N_MAX_TABLE_ROWS
+        for j in range(n_chunks):
+            start,stop = j*N_MAX_TABLE_ROWS,min((j+1)*N_MAX_TABLE_ROWS,len(rows))
+            table_chunk = [dict(zip(headers,row)) for row in rows[start:stop]]
+            yield 'table',f'{new_title}\n{json.dumps(table_chunk)}',(start,stop)
+
+def raw_content(key: str, value, span: Union[None,tuple[int,int]] = None) -> str:
+    """
+    The raw_content metadata of a standardized chunk: the anchor value it comes from, or for a piece of a split
+    text or code block its characters start to stop, or for a table piece the headers and rows start to stop.
+    """
+    if key == 'table' and span is not None:
+        return str({'headers':value['headers'],'rows':value['rows'][span[0]:span[1]]})
+    if span is not None:
+        return value[span[0]:span[1]]
+    return str(value)
+
+def _split_block(text: str, prefix: str, kind: str, max_tokens: Union[None,int], overlap_tokens: int) -> list[Union[None,tuple[int,int]]]:
+    # the spans of the pieces of a content or code block, [None] when it fits next to its title prefix
+    if max_tokens is None:
+        return [None]
+    budget = max(1,max_tokens - estimate_tokens(prefix))
+    if estimate_tokens(text) <= budget:
+        return [None]
+    return split_spans(text,budget,overlap_tokens=min(overlap_tokens,budget//2),kind=kind)
+
+def _split_table(title: str, headers: list, rows: list, max_tokens: int) -> Iterator[tuple[str,tuple[int,int]]]:
+    # packs consecutive rows while the piece stays within budget, a row larger than the budget gets its own piece
+    max_chars = CHARS_PER_TOKEN*max_tokens - 1 - len(title + '\n[]')
+    # json.dumps of a list joins the JSON of its items with ', ', so each row is serialized once
+    row_texts = [json.dumps(dict(zip(headers,row))) for row in rows]
+    start,n_chars = 0,0
+    for i,row_text in enumerate(row_texts):
+        if i > start and n_chars + 2 + len(row_text) > max_chars:
+            yield f"{title}\n[{', '.join(row_texts[start:i])}]",(start,i)
+            start,n_chars = i,0
+        n_chars += len(row_text) + (2 if i > start else 0)
+    if row_texts:
+        yield f"{title}\n[{', '.join(row_texts[start:])}]",(start,len(row_texts))
+
+def split_text(text: str, max_tokens: int, overlap_tokens: int = 0, kind: str = 'text') -> list[str]:
+    """Splits a text into pieces of at most max_tokens estimated tokens, see split_spans."""
+    return [text[start:stop] for start,stop in split_spans(text,max_tokens,overlap_tokens=overlap_tokens,kind=kind)]
+
+def split_spans(text: str, max_tokens: int, overlap_tokens: int = 0, kind: str = 'text') -> list[tuple[int,int]]:
+    '''
+    Splits a text into pieces of at most max_tokens estimated tokens, on the coarsest boundaries that fit.
+
+    The text is cut into units: paragraphs for prose ('text'), top-level statements (found with ast, with their
+    decorators and leading comments) or blank-line separated blocks if the code does not parse for 'code'. Units
+    over budget are cut again into sentences (lines for code), then words, then characters. Consecutive units are
+    then packed greedily into pieces. Pieces are slices of the original text, so whitespace and indentation are
+    kept. As estimate_tokens only depends on the length of a text, the budget is applied to lengths, and the whole
+    split is linear in the length of the text.
+
+    Args:
+        text (str): The text to split.
+        max_tokens (int): Token budget per piece (see estimate_tokens).
+        overlap_tokens (int): Up to this many tokens of whole units from the end of a piece are repeated at the
+            start of the next one (default is 0).
+        kind (str): 'text' or 'code' (default is 'text').
+
+    Returns:
+        list[tuple[int, int]]: The (start, stop) character ranges of the pieces, without leading blank lines and
+            trailing whitespace.
+    '''
+    # the longest text estimate_tokens counts as max_tokens tokens
+    max_chars = CHARS_PER_TOKEN*max_tokens - 1
+    overlap_chars = CHARS_PER_TOKEN*overlap_tokens
+    if kind == 'code':
+        spans = _statement_spans(text)
+        finer = [LINE_PATTERN,WORD_PATTERN]
+    else:
+        spans = _pattern_spans(text,0,len(text),PARAGRAPH_PATTERN)
+        finer = [SENTENCE_PATTERN,WORD_PATTERN]
+    units = []
+    _refine(text,spans,finer,max_chars,units)
+
+    pieces = []
+    first = 0
+    for i,(start,end) in enumerate(units):
+        if i > first and end - units[first][0] > max_chars:
+            pieces.append((units[first][0],units[i-1][1]))
+            # carry over the last units of the piece, within the overlap and leaving room for unit i
+            j = i
+            while j - 1 > first and end - units[j-1][0] <= max_chars and units[i-1][1] - units[j-1][0] <= overlap_chars:
+                j -= 1
+            first = j
+    if units:
+        pieces.append((units[first][0],units[-1][1]))
+    spans = []
+    for start,stop in pieces:
+        while start < stop and text[start] == '\n':
+            start += 1
+        while stop > start and text[stop-1].isspace():
+            stop -= 1
+        if start < stop:
+            spans.append((start,stop))
+    return spans
+
+def _refine(text: str, spans: list[tuple[int,int]], finer: list[re.Pattern], max_chars: int, units: list) -> None:
+    # appends the (start, end) units within budget, cutting the spans over budget on the next finer boundaries
+    for start,end in spans:
+        if end - start <= max_chars:
+            units.append((start,end))
+        elif finer:
+            _refine(text,_pattern_spans(text,start,end,finer[0]),finer[1:],max_chars,units)
+        else:
+            # a single word over budget
+            units.extend((i,min(i+max_chars,end)) for i in range(start,end,max_chars))
+
+def _pattern_spans(text: str, start: int, end: int, pattern: re.Pattern) -> list[tuple[int,int]]:
+    # contiguous spans covering text[start:end], each ending after a separator matched by pattern
+    spans = []
+    for match in pattern.finditer(text,start,end):
+        if match.end() > start and match.start() > start:
+            spans.append((start,match.end()))
+            start = match.end()
+    if start < end:
+        spans.append((start,end))
+    return spans
+
+def _statement_spans(code: str) -> list[tuple[int,int]]:
+    # spans starting at each top-level statement (or at the decorators and comment lines right above it)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError,ValueError):
+        return _pattern_spans(code,0,len(code),PARAGRAPH_PATTERN)
+    line_starts = [0] + [match.end() for match in LINE_PATTERN.finditer(code)]
+    lines = code.split('\n')
+    starts = []
+    previous_end = 0
+    for node in tree.body:
+        line = min([node.lineno] + [d.lineno for d in getattr(node,'decorator_list',[])]) - 1
+        while line > previous_end and lines[line-1].startswith('#'):
+            line -= 1
+        starts.append(line)
+        previous_end = node.end_lineno
+    if not starts:
+        return [(0,len(code))]
+    starts[0] = 0
+    offsets = [line_starts[line] for line in starts] + [len(code)]
+    return [(offsets[i],offsets[i+1]) for i in range(len(starts)) if offsets[i] < offsets[i+1]]
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap estimate of the number of tokens in a text, without loading a tokenizer.
+
+    OpenAI's tokenizers average roughly 4 characters per token on English prose and code, which is accurate
+    enough for budgeting batches and chunk sizes.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated token count (at least 1).
+    """
+    return len(text)//CHARS_PER_TOKEN + 1
+
+def chunk_id(chunk: dict) -> str:
+    """
+    Computes a stable content-hash ID for a standardized chunk.
+
+    The ID only depends on the chunk's text and metadata, so an unchanged chunk keeps its ID across runs
+    while any edit to it (or to the titles/sections it sits under) produces a new one.
+
+    Args:
+        chunk (dict): A standardized chunk with 'text' and 'metadata' keys.
+
+    Returns:
+        str: The hex digest identifying the chunk.
+    """
+    payload = json.dumps({'text':chunk['text'],'metadata':chunk['metadata']},sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def process_document(document: dict, lexical_index=None, N_MAX_TABLE_ROWS: int = 1, as_store: bool = False,
+                     max_tokens: Union[None,int] = None, overlap_tokens: int = 0):
     """
     Processes a document by flattening and standardizing its chunks.
 
     Args:
         document (dict): A dictionary representing the document to be processed. 
+        lexical_index (bm25.BM25Index, optional): If given, the chunks are also added to this lexical index.
+        N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk, see standardize_chunks (default is 1).
+        as_store (bool): If True, the chunks are returned as a chunk_store.ChunkStore, which keeps them in a few
+            compact columns (raw contents as references into the document) instead of one dict per chunk (default is False).
+        max_tokens (int, optional): Token budget per chunk, oversized chunks are split, see standardize_chunks (default is None).
+        overlap_tokens (int): Tokens repeated between consecutive pieces of a split text or code block (default is 0).
 
     Returns:
-        list[dict]: A list of standardized chunks, each represented as a dictionary.
+        list[dict]: A list of standardized chunks, each represented as a dictionary with 'id', 'text' and 'metadata' keys,
+            or the same chunks as a ChunkStore.
     """
-    chunks = flatten_chunks(document,titles=[])
-    chunks = standardize_chunks(chunks)
+    if as_store:
+        from chunk_store import ChunkStore
+        with tracing.span('chunking.store'):
+            store = ChunkStore.from_document(document,N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,max_tokens=max_tokens,overlap_tokens=overlap_tokens)
+        if lexical_index is not None:
+            with tracing.span('chunking.lexical_index'):
+                lexical_index.add([store.id(i) for i in range(len(store))],[store.text(i) for i in range(len(store))])
+        tracing.count('chunks_produced',len(store))
+        return store
+    with tracing.span('chunking.flatten'):
+        chunks = flatten_chunks(document,metadata={},titles=[])
+    with tracing.span('chunking.standardize'):
+        chunks = standardize_chunks(chunks,N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,max_tokens=max_tokens,overlap_tokens=overlap_tokens)
+        for chunk in chunks:
+            chunk['id'] = chunk_id(chunk)
+    if lexical_index is not None:
+        with tracing.span('chunking.lexical_index'):
+            lexical_index.add([chunk['id'] for chunk in chunks],[chunk['text'] for chunk in chunks])
+    tracing.count('chunks_produced',len(chunks))
     return chunks
 
+
+def iter_flatten_chunks(fp) -> Iterator[dict]:
+    """
+    Streaming counterpart of flatten_chunks: parses a JSON document incrementally and yields its chunks one at a time.
+
+    Only the node currently being parsed and its ancestors are held in memory (their titles, metadata and anchor
+    values), so memory is bounded by the depth of the section tree and the size of the largest chunkable block,
+    not by the size of the document. The chunks (texts, metadata and IDs) are the same as flatten_chunks would
+    produce, as long as a node's 'title' comes before its (sub)sections in the JSON, which is how documents are
+    normally written. Only their order can differ: a node's chunks are yielded when its first *sections key is
+    reached (or when the node ends), so anchors written after the sections come after the children's chunks.
+
+    Args:
+        fp: A binary file object (or a path) of the JSON document.
+
+    Yields:
+        dict: Chunks in the format returned by flatten_chunks.
+    """
+    import ijson
+    if isinstance(fp,str):
+        with open(fp,'rb') as f:
+            yield from iter_flatten_chunks(f)
+        return
+    CHUNK_ANCHOR_KEYS = ["content","code_block","table"]
+
+    def new_node(titles,metadata,section_key=None,parent=None):
+        # metadata is the node's own, as of entering it (what flatten_chunks copies into its chunks), running is
+        # what its children inherit, updated with each child's title as flatten_chunks does
+        return dict(kind='node',titles=titles,metadata=metadata,running=metadata.copy(),section_key=section_key,
+                    anchors={},parent=parent)
+
+    def set_value(node,key,value):
+        if key == 'title':
+            node['titles'].append(value)
+            if node['section_key'] is not None:
+                node['metadata'][node['section_key']] = value
+                node['running'][node['section_key']] = value
+                node['parent']['running'][node['section_key']] = value
+        else:
+            node['anchors'][key] = value
+
+    def flush(node):
+        for k in CHUNK_ANCHOR_KEYS:
+            if k in node['anchors']:
+                value = node['anchors'].pop(k)
+                metadata = node['metadata'].copy()
+                metadata['raw_content'] = str(value)
+                yield {k:value,'titles':node['titles'],'metadata':metadata}
+
+    stack = []
+    pending_key = None
+    # value of a title/anchor key being built, or a value being skipped over
+    builder,building_key,depth = None,None,0
+    skipping = 0
+    for prefix,event,value in ijson.parse(fp,use_float=True):
+        if builder is not None:
+            builder.event(event,value)
+            depth += {'start_map':1,'start_array':1,'end_map':-1,'end_array':-1}.get(event,0)
+            if depth > 0:
+                continue
+            set_value(stack[-1],building_key,builder.value)
+            builder = None
+            continue
+        if skipping:
+            skipping += {'start_map':1,'start_array':1,'end_map':-1,'end_array':-1}.get(event,0)
+            continue
+        if not stack:
+            if event == 'start_map':
+                stack.append(new_node([],{}))
+            continue
+        top = stack[-1]
+        if top['kind'] == 'sections':
+            if event == 'start_map':
+                parent = top['parent']
+                stack.append(new_node(copy.copy(parent['titles']),parent['running'].copy(),section_key=top['key'][:-1],parent=parent))
+            elif event == 'end_array':
+                stack.pop()
+            elif event == 'start_array':
+                skipping = 1
+            continue
+        # inside a node
+        if event == 'map_key':
+            pending_key = value
+            continue
+        if event == 'end_map':
+            yield from flush(top)
+            stack.pop()
+            continue
+        key,pending_key = pending_key,None
+        if key == 'title' or key in CHUNK_ANCHOR_KEYS:
+            if event in ('start_map','start_array'):
+                builder,building_key,depth = ijson.ObjectBuilder(),key,1
+                builder.event(event,value)
+            else:
+                set_value(top,key,value)
+        elif key.endswith('sections') and event == 'start_array':
+            yield from flush(top)
+            stack.append(dict(kind='sections',key=key,parent=top))
+        elif event in ('start_map','start_array'):
+            skipping = 1
+
+def iter_process_document(fp, lexical_index=None, N_MAX_TABLE_ROWS: int = 1, max_tokens: Union[None,int] = None, overlap_tokens: int = 0) -> Iterator[dict]:
+    """
+    Streaming counterpart of process_document: yields standardized chunks (with their IDs) one at a time while
+    the document is being parsed, so ingestion can start on the first chunk. See iter_flatten_chunks.
+
+    Args:
+        fp: A binary file object (or a path) of the JSON document.
+        lexical_index (bm25.BM25Index, optional): If given, each chunk is also added to this lexical index as it is yielded.
+        N_MAX_TABLE_ROWS (int): Maximum number of rows per table chunk, see standardize_chunks (default is 1).
+        max_tokens (int, optional): Token budget per chunk, see standardize_chunks.
+        overlap_tokens (int): Tokens repeated between consecutive pieces of a split block, see standardize_chunks.
+
+    Yields:
+        dict: Standardized chunks with 'id', 'text' and 'metadata' keys.
+    """
+    for flat_chunk in iter_flatten_chunks(fp):
+        for chunk in standardize_chunks([flat_chunk],N_MAX_TABLE_ROWS=N_MAX_TABLE_ROWS,max_tokens=max_tokens,overlap_tokens=overlap_tokens):
+            chunk['id'] = chunk_id(chunk)
+            if lexical_index is not None:
+                lexical_index.add([chunk['id']],[chunk['text']])
+            tracing.count('chunks_produced')
+            yield chunk
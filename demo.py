@@ -1,8 +1,10 @@
 import chunking
 import retrieval
+import tracing
 import json
 import colorful
 import argparse
+from bm25 import BM25Index
 from typing import Union
 import warnings
 warnings.simplefilter('ignore')
@@ -11,6 +13,13 @@ def main(
         k :int = 1,
         query :Union[str,None] = None,
         do_rerank: bool = True,
+        overwrite: bool = False,
+        stream: bool = False,
+        backend: str = 'chroma',
+        hybrid: bool = False,
+        profile: bool = False,
+        rerank_engine: str = 'fp32',
+        early_exit_margin: Union[float,None] = None,
         ) -> None:
     """
     Demonstrates document retrieval based on provided or default queries.
@@ -26,18 +35,37 @@ def main(
         k: Specifies the number of retrieval results to return for each query.
         query: A single query string to search or None to load a set of queries from a file.
         do_rerank: Whether to do reranking. True by default
+        overwrite: Whether to wipe and re-embed the whole vector store. By default the existing store is
+            updated incrementally, embedding only the chunks that changed since the last run.
+        stream: Whether to parse and chunk the document incrementally, feeding chunks to the vector store as they
+            are produced instead of loading the whole document first. The document is not printed in this mode.
+        backend: The vector store backend, 'chroma' (default), 'numpy' for the in-memory NumPy index or 'ivf' for the approximate index.
+        hybrid: Whether to fuse the dense candidates with those of a BM25 lexical index built while chunking, before reranking.
+        profile: Whether to trace the pipeline stages and print a per-stage time breakdown at the end.
+        rerank_engine: The cross-encoder engine, 'fp32' (default) or 'int8' for the dynamically quantized CPU model.
+        early_exit_margin: If given, candidates farther than this (in distance) from the closest one are not reranked.
     Returns:
         None. Prints the document and retrieval results for each query, showing matching 
         chunks with their associated context and similarity scores.
     """
 
+    if profile:
+        tracing.enable()
+    retrieval.configure_reranker(rerank_engine)
     document_fname = 'data/document.json'
     if synthetic:
         document_fname = 'data/synthetic_document.json'
-    with open(document_fname,'r') as f:
-        document = json.load(f)
-    chunks = chunking.process_document(document)
-    vectorstore = retrieval.create_vector_store(chunks,overwrite=True)
+    lexical_index = BM25Index() if hybrid else None
+    if stream:
+        document = None
+        with open(document_fname,'rb') as f:
+            chunks = chunking.iter_process_document(f,lexical_index=lexical_index)
+            vectorstore = retrieval.create_vector_store(chunks,overwrite=overwrite,incremental=not overwrite,backend=backend,lexical_index=lexical_index)
+    else:
+        with open(document_fname,'r') as f:
+            document = json.load(f)
+        chunks = chunking.process_document(document,lexical_index=lexical_index)
+        vectorstore = retrieval.create_vector_store(chunks,overwrite=overwrite,incremental=not overwrite,backend=backend,lexical_index=lexical_index)
     #=========================================================
     if query is None:
         queries_fname = 'data/queries.json'
@@ -50,14 +78,16 @@ def main(
         queries = [query]
     break_ = False
     print('='*60)
-    print(colorful.blue('DOCUMENT'))
-    print(colorful.pink(json.dumps(document,indent=4)))
+    if document is not None:
+        print(colorful.blue('DOCUMENT'))
+        print(colorful.pink(json.dumps(document,indent=4)))
 
     for iq,query in enumerate(queries):
         iq += 1
         # results = vectorstore.similarity_search(query, k=1)
         #results_and_scores = vectorstore.similarity_search_with_score(query, k=k)
-        results_and_scores = retrieval.retrieve_and_rerank(query,vectorstore,k=k,first_k=4, do_rerank=do_rerank)
+        results_and_scores = retrieval.retrieve_and_rerank(query,vectorstore,k=k,first_k=4, do_rerank=do_rerank,lexical_index=lexical_index,
+                                                           early_exit_margin=early_exit_margin)
         #=======================================================
         print(colorful.blue(f'QUERY {iq}'))
         print(colorful.green(query))
@@ -88,6 +118,13 @@ def main(
             if choice == '':
                 break
         if break_: break
+    if hasattr(vectorstore.embeddings,'stats'):
+        print(colorful.blue('EMBEDDING CACHE'),vectorstore.embeddings.stats())
+    if do_rerank:
+        print(colorful.blue('RERANK CACHE'),retrieval.rerank_cache.stats())
+    if profile:
+        print(colorful.blue('PROFILE'))
+        print(tracing.tracer.report())
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -95,5 +132,12 @@ if __name__ == '__main__':
     parser.add_argument('--k',default=1,type=int,help="number of documents to retrieve. Default 1")
     parser.add_argument('--query',default=None,type=str,help="your query. default is to pick up queries from data/queries*.json")
     parser.add_argument('--do_rerank',default=True,type=lambda t:t.lower()=='true',help="whether to do reranking. default is True, use --do_rerank false to disable")
+    parser.add_argument('--overwrite',action='store_true',default=False,help="wipe the vector store and re-embed every chunk. default is to only embed new or changed chunks")
+    parser.add_argument('--stream',action='store_true',default=False,help="parse and chunk the document incrementally, for documents too large to load at once")
+    parser.add_argument('--backend',default='chroma',choices=['chroma','numpy','ivf'],help="vector store backend. default is chroma, numpy keeps the embeddings in one in-memory matrix, ivf adds an approximate nearest neighbor index on top")
+    parser.add_argument('--hybrid',action='store_true',default=False,help="fuse dense and BM25 lexical candidates before reranking, for queries with exact identifiers")
+    parser.add_argument('--rerank_engine',default='fp32',choices=['fp32','int8'],help="cross-encoder engine. default is fp32, int8 runs a dynamically quantized model on CPU")
+    parser.add_argument('--early_exit_margin',default=None,type=float,help="skip reranking candidates farther than this distance from the closest one. default is to rerank all")
+    parser.add_argument('--profile',action='store_true',default=False,help="print a per-stage breakdown of where the time went")
     args = parser.parse_args()
     main(**vars(args))
@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+
+# sqlite caps the number of bound parameters per statement
+SQLITE_MAX_VARIABLES = 900
+
+class CachedEmbeddings:
+    """
+    Disk-backed cache in front of an embedder, so a text is only ever sent to the embedding model once.
+
+    Vectors are stored as float32 blobs in a SQLite table keyed on (model name, sha256 of the text). Every
+    lookup refreshes the entry's position in the LRU order, and once the table grows past max_entries the
+    least recently used entries are evicted. Hits and misses are counted for reporting. Vectors are always
+    returned as their stored float32 values, so results do not depend on whether they came from the cache.
+
+    Args:
+        embeddings: The wrapped embedder, anything with embed_documents/embed_query (e.g. OpenAIEmbeddings).
+        model_name (str): Name of the embedding model, part of the cache key.
+        path (str, optional): Path to the SQLite file. Defaults to "./embedding_cache.sqlite".
+        max_entries (int, optional): Maximum number of cached vectors. Defaults to 100000.
+    """
+    def __init__(self,
+                 embeddings,
+                 model_name: str,
+                 path: str = './embedding_cache.sqlite',
+                 max_entries: int = 100_000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path,check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS embeddings (
+                                model TEXT NOT NULL,
+                                text_hash TEXT NOT NULL,
+                                vector BLOB NOT NULL,
+                                last_used INTEGER NOT NULL,
+                                PRIMARY KEY (model, text_hash))''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+        self._clock = self._conn.execute('SELECT COALESCE(MAX(last_used),0) FROM embeddings').fetchone()[0]
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _lookup(self, hashes: list[str]) -> dict[str,list[float]]:
+        found = {}
+        for i in range(0,len(hashes),SQLITE_MAX_VARIABLES):
+            batch = hashes[i:i+SQLITE_MAX_VARIABLES]
+            rows = self._conn.execute(
+                f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({",".join("?"*len(batch))})',
+                [self.model_name,*batch])
+            for text_hash,blob in rows:
+                found[text_hash] = array('f',blob).tolist()
+        if found:
+            tick = self._tick()
+            self._conn.executemany('UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                                   [(tick,self.model_name,h) for h in found])
+        return found
+
+    def _store(self, vectors: dict[str,list[float]]) -> dict[str,list[float]]:
+        tick = self._tick()
+        stored = {h:array('f',v) for h,v in vectors.items()}
+        self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)',
+                               [(self.model_name,h,v.tobytes(),tick) for h,v in stored.items()])
+        n_excess = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0] - self.max_entries
+        if n_excess > 0:
+            self._conn.execute('''DELETE FROM embeddings WHERE rowid IN
+                                  (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)''',(n_excess,))
+        return {h:v.tolist() for h,v in stored.items()}
+
+    def _embed(self, texts: list[str], embed_missing) -> list[list[float]]:
+        hashes = [self._hash(t) for t in texts]
+        with self._lock:
+            vectors = self._lookup(list(set(hashes)))
+            missing = {}
+            for h,t in zip(hashes,texts):
+                if h not in vectors:
+                    missing.setdefault(h,t)
+            n_missing = sum(1 for h in hashes if h in missing)
+            self.hits += len(texts) - n_missing
+            self.misses += n_missing
+            self._conn.commit()
+        if missing:
+            # the embedding call itself runs outside the lock, so concurrent callers are not serialized on it
+            new_vectors = embed_missing(list(missing.values()))
+            with self._lock:
+                vectors.update(self._store(dict(zip(missing.keys(),new_vectors))))
+                self._conn.commit()
+        return [vectors[h] for h in hashes]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts,self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text],lambda texts:[self.embeddings.embed_query(texts[0])])[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, hit rate and current number of cached vectors."""
+        total = self.hits + self.misses
+        return {'hits':self.hits,
+                'misses':self.misses,
+                'hit_rate':self.hits/total if total else 0.0,
+                'size':len(self)}
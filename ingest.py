@@ -0,0 +1,217 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, Union
+
+import chunking
+import tracing
+
+# OpenAI accepts up to 8191 tokens per input and 300k tokens per request, smaller batches keep more requests in flight
+MAX_BATCH_TOKENS = 8000
+MAX_BATCH_SIZE = 256
+MAX_WORKERS = 4
+MAX_RETRIES = 6
+# guards the stats counters the embedding workers increment concurrently
+_stats_lock = threading.Lock()
+
+class RateLimitError(Exception):
+    """
+    Raised by embedders when the embedding endpoint throttles us (HTTP 429).
+
+    Args:
+        retry_after (float or None): Seconds the server asked us to wait, if it said so.
+    """
+    def __init__(self, message: str = 'rate limited', retry_after: Union[None,float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Recognizes rate limit errors from our own embedders as well as from the openai client."""
+    return (isinstance(error,RateLimitError)
+            or getattr(error,'status_code',None) == 429
+            or type(error).__name__ == 'RateLimitError')
+
+def token_batches(chunks: Iterable[dict],
+                  max_tokens: int = MAX_BATCH_TOKENS,
+                  max_batch_size: int = MAX_BATCH_SIZE) -> Iterator[list[dict]]:
+    '''
+    Lazily groups chunks into batches whose estimated token count stays within budget.
+
+    Chunks are consumed from the iterable one at a time, so this works on generators (e.g. streamed documents)
+    without materializing them. A single chunk larger than the budget gets a batch of its own.
+
+    Args:
+        chunks (Iterable[dict]): Chunks with a 'text' key.
+        max_tokens (int): Token budget per batch.
+        max_batch_size (int): Maximum number of chunks per batch.
+
+    Yields:
+        list[dict]: Consecutive batches of chunks, in input order.
+    '''
+    batch = []
+    n_tokens = 0
+    for chunk in chunks:
+        chunk_tokens = chunking.estimate_tokens(chunk['text'])
+        if batch and (n_tokens + chunk_tokens > max_tokens or len(batch) >= max_batch_size):
+            yield batch
+            batch = []
+            n_tokens = 0
+        batch.append(chunk)
+        n_tokens += chunk_tokens
+    if batch:
+        yield batch
+
+class _Throttle:
+    '''
+    Shared cool-down between the embedding workers. When any request gets rate limited, every worker holds
+    off new requests until the cool-down expires instead of hammering the endpoint in parallel.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, delay: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at,time.monotonic() + delay)
+
+def embed_with_retry(embeddings,
+                     texts: list[str],
+                     max_retries: int = MAX_RETRIES,
+                     base_delay: float = 0.5,
+                     max_delay: float = 30.0,
+                     throttle: Union[None,_Throttle] = None,
+                     stats: Union[None,dict] = None) -> list[list[float]]:
+    '''
+    Embeds a batch of texts, retrying failures with exponential backoff and full jitter.
+
+    Rate limit errors honor the server's retry-after hint when there is one, and pause the shared throttle
+    so that concurrent workers back off together.
+
+    Args:
+        embeddings: Embedder with an embed_documents method.
+        texts (list[str]): The batch to embed.
+        max_retries (int): Number of retries before the last error is raised.
+        base_delay (float): Backoff delay in seconds for the first retry, doubled on every attempt.
+        max_delay (float): Upper bound on a single backoff delay.
+        throttle (_Throttle, optional): Cool-down shared between workers.
+        stats (dict, optional): If given, 'retries' and 'rate_limited' counters are incremented in it (under a
+            lock, the dict can be shared between workers).
+
+    Returns:
+        list[list[float]]: The embeddings, in the order of texts.
+    '''
+    for attempt in range(max_retries + 1):
+        if throttle is not None:
+            throttle.wait()
+        try:
+            with tracing.span('ingest.embed'):
+                return embeddings.embed_documents(texts)
+        except Exception as error:
+            if attempt == max_retries:
+                raise
+            delay = random.uniform(0,min(max_delay,base_delay*2**attempt))
+            if is_rate_limit_error(error):
+                retry_after = getattr(error,'retry_after',None)
+                if retry_after is not None:
+                    delay = max(delay,retry_after)
+                if throttle is not None:
+                    throttle.pause(delay)
+                if stats is not None:
+                    with _stats_lock:
+                        stats['rate_limited'] = stats.get('rate_limited',0) + 1
+            if stats is not None:
+                with _stats_lock:
+                    stats['retries'] = stats.get('retries',0) + 1
+            tracing.count('embedding_retries')
+            time.sleep(delay)
+
+def add_embeddings(vectorstore, ids: list[str], texts: list[str], metadatas: list[dict], vectors: list[list[float]]) -> None:
+    """
+    Writes already computed embeddings into a vector store, without embedding the texts again.
+
+    Stores that implement add_embeddings are used as is, a langchain Chroma store is written to through its
+    collection's upsert.
+    """
+    if hasattr(vectorstore,'add_embeddings'):
+        vectorstore.add_embeddings(ids=ids,texts=texts,metadatas=metadatas,embeddings=vectors)
+    else:
+        vectorstore._collection.upsert(ids=ids,documents=texts,metadatas=metadatas,embeddings=vectors)
+
+def ingest_chunks(chunks: Iterable[dict],
+                  vectorstore,
+                  embeddings,
+                  max_tokens: int = MAX_BATCH_TOKENS,
+                  max_batch_size: int = MAX_BATCH_SIZE,
+                  max_workers: int = MAX_WORKERS,
+                  max_retries: int = MAX_RETRIES,
+                  base_delay: float = 0.5,
+                  on_write: Union[None,Callable[[list[dict]],None]] = None) -> dict:
+    '''
+    Embeds chunks in token-budgeted batches on a bounded thread pool and streams them into the vector store.
+
+    At most 2*max_workers batches are in flight at a time: the chunk iterable is only advanced when a batch
+    completes, so a slow or throttled endpoint applies backpressure all the way up to chunking. Each finished
+    batch is written to the store as soon as it completes (from the calling thread, stores need not be thread
+    safe), so ingestion makes progress and partial results are persisted even if a later batch fails.
+
+    Args:
+        chunks (Iterable[dict]): Chunks with 'id', 'text' and 'metadata' keys, e.g. from chunking.process_document.
+        vectorstore: The store to write to, see add_embeddings.
+        embeddings: Embedder with an embed_documents method.
+        max_tokens (int): Token budget per embedding request.
+        max_batch_size (int): Maximum number of chunks per embedding request.
+        max_workers (int): Number of concurrent embedding requests.
+        max_retries (int): Retries per batch before ingestion fails.
+        base_delay (float): Initial backoff delay in seconds.
+        on_write (callable, optional): Called with each batch of chunks once it is written to the store.
+
+    Returns:
+        dict: Ingestion stats: chunks, batches, tokens, retries, rate_limited and seconds.
+    '''
+    stats = {'chunks':0,'batches':0,'tokens':0,'retries':0,'rate_limited':0}
+    start = time.perf_counter()
+    throttle = _Throttle()
+    batches = token_batches(chunks,max_tokens=max_tokens,max_batch_size=max_batch_size)
+
+    def write(future, batch):
+        vectors = future.result()
+        with tracing.span('ingest.write'):
+            add_embeddings(vectorstore,
+                           ids=[c['id'] for c in batch],
+                           texts=[c['text'] for c in batch],
+                           metadatas=[c['metadata'] for c in batch],
+                           vectors=vectors)
+        tokens = sum(chunking.estimate_tokens(c['text']) for c in batch)
+        stats['chunks'] += len(batch)
+        stats['batches'] += 1
+        stats['tokens'] += tokens
+        tracing.count('chunks_embedded',len(batch))
+        tracing.count('tokens_embedded',tokens)
+        if on_write is not None:
+            on_write(batch)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
+        exhausted = False
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < 2*max_workers:
+                batch = next(batches,None)
+                if batch is None:
+                    exhausted = True
+                    break
+                future = executor.submit(embed_with_retry,embeddings,[c['text'] for c in batch],
+                                         max_retries=max_retries,base_delay=base_delay,throttle=throttle,stats=stats)
+                in_flight[future] = batch
+            if not in_flight:
+                break
+            done,_ = wait(in_flight,return_when=FIRST_COMPLETED)
+            for future in done:
+                write(future,in_flight.pop(future))
+    stats['seconds'] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,228 @@
+import os
+from typing import Tuple, Union
+
+import numpy as np
+
+from numpy_store import NumpyVectorStore
+
+class IVFVectorStore(NumpyVectorStore):
+    """
+    Approximate nearest neighbor search over a NumpyVectorStore with an inverted file (IVF) index, for corpora
+    where exact search over every chunk becomes the latency floor. CPU only, NumPy only.
+
+    The vectors are clustered with k-means into n_lists lists, and a query only scans the nprobe lists whose
+    centroids are closest to it: nprobe trades recall for speed (nprobe = n_lists is exact search). The index is
+    trained on first search once the store holds at least min_train_size vectors (until then searches are exact),
+    or explicitly with train(). Vectors inserted after training are assigned to their nearest centroid without
+    retraining, and deletions keep the assignments of the remaining vectors, so the index is never retrained
+    implicitly. The centroids and list assignments are saved next to the vectors.
+
+    Args:
+        embedding_function: Embedder used for queries and add_texts.
+        persist_directory (str, optional): Directory the store and index are saved to and loaded from.
+        mmap (bool, optional): Whether to memory-map the saved vectors when loading. Defaults to False.
+        n_lists (int, optional): Number of lists. Defaults to sqrt(n) at training time.
+        nprobe (int, optional): Number of lists scanned per query. Defaults to 8.
+        min_train_size (int, optional): Minimum number of vectors before the index is trained. Defaults to 1024.
+        seed (int, optional): Seed of the k-means initialization. Defaults to 0.
+    """
+    INDEX_FNAME = 'ivf.npz'
+    PER_QUERY_SCAN = 8
+
+    def __init__(self,
+                 embedding_function,
+                 persist_directory: Union[None,str] = None,
+                 mmap: bool = False,
+                 n_lists: Union[None,int] = None,
+                 nprobe: int = 8,
+                 min_train_size: int = 1024,
+                 seed: int = 0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.seed = seed
+        self.centroids = None
+        self._assign = np.zeros(0,dtype=np.int32)
+        self._lists = None
+        super().__init__(embedding_function,persist_directory=persist_directory,mmap=mmap)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    #-------------------------------------------------------------------
+    # persistence
+    def _load(self, mmap: bool) -> None:
+        super()._load(mmap)
+        index_fname = os.path.join(self.persist_directory,self.INDEX_FNAME)
+        if os.path.exists(index_fname):
+            index = np.load(index_fname)
+            self.centroids = index['centroids']
+            self.n_lists = len(self.centroids)
+            self._assign = index['assign'].astype(np.int32)
+
+    def save(self) -> None:
+        super().save()
+        index_fname = os.path.join(self.persist_directory,self.INDEX_FNAME)
+        if self.is_trained:
+            np.savez(index_fname,centroids=self.centroids,assign=self._assign[:self._n])
+        elif os.path.exists(index_fname):
+            os.remove(index_fname)
+
+    #-------------------------------------------------------------------
+    # index maintenance
+    def _nearest_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        # nearest by squared L2, |c|^2 - 2 v.c (|v|^2 is the same for every centroid)
+        distances = np.einsum('ij,ij->i',self.centroids,self.centroids)[None,:] - 2*vectors @ self.centroids.T
+        return np.argmin(distances,axis=1).astype(np.int32)
+
+    def train(self, n_lists: Union[None,int] = None, n_iter: int = 10, max_train_size: int = 65536) -> None:
+        """
+        Clusters the stored vectors with k-means (on a sample of at most max_train_size of them) and assigns
+        every vector to its nearest centroid.
+        """
+        if self._n == 0:
+            return
+        rng = np.random.default_rng(self.seed)
+        n_lists = n_lists or self.n_lists or max(1,int(np.sqrt(self._n)))
+        n_lists = min(n_lists,self._n)
+        vectors = self.matrix
+        sample = vectors[rng.choice(self._n,size=min(self._n,max_train_size),replace=False)]
+        centroids = sample[rng.choice(len(sample),size=n_lists,replace=False)].copy()
+        for _ in range(n_iter):
+            self.centroids = centroids
+            assign = self._nearest_centroids(sample)
+            order = np.argsort(assign,kind='stable')
+            counts = np.bincount(assign,minlength=n_lists)
+            nonempty = counts > 0
+            # sum the members of each (nonempty) list in one pass over the sorted sample, empty lists keep their centroid
+            starts = np.concatenate([[0],np.cumsum(counts)[:-1]])[nonempty]
+            centroids[nonempty] = np.add.reduceat(sample[order],starts,axis=0)/counts[nonempty,None]
+        self.centroids = centroids
+        self.n_lists = n_lists
+        self._assign = np.zeros(self._matrix.shape[0],dtype=np.int32)
+        self._assign[:self._n] = self._assign_in_batches(vectors)
+        self._lists = None
+        self.version += 1
+
+    def _assign_in_batches(self, vectors: np.ndarray, batch_size: int = 16384) -> np.ndarray:
+        return np.concatenate([self._nearest_centroids(vectors[i:i+batch_size]) for i in range(0,len(vectors),batch_size)]
+                              or [np.zeros(0,dtype=np.int32)])
+
+    def _build_lists(self) -> None:
+        order = np.argsort(self._assign[:self._n],kind='stable')
+        bounds = np.searchsorted(self._assign[:self._n][order],np.arange(self.n_lists+1))
+        self._lists = [order[bounds[i]:bounds[i+1]] for i in range(self.n_lists)]
+
+    def add_embeddings(self, ids: list[str], texts: list[str], metadatas: list[dict], embeddings: list[list[float]]) -> None:
+        is_new = np.array([id_ not in self._rows for id_ in ids],dtype=bool)
+        super().add_embeddings(ids,texts,metadatas,embeddings)
+        if len(self._assign) < self._matrix.shape[0]:
+            assign = np.zeros(self._matrix.shape[0],dtype=np.int32)
+            assign[:len(self._assign)] = self._assign[:len(assign)]
+            self._assign = assign
+        if not self.is_trained:
+            return
+        # incremental insert: new (and updated) rows join the list of their nearest centroid
+        rows = np.array([self._rows[id_] for id_ in ids],dtype=np.int64)
+        new_assign = self._nearest_centroids(self._matrix[rows])
+        changed = self._assign[rows] != new_assign
+        self._assign[rows] = new_assign
+        if self._lists is not None:
+            if np.any(changed & ~is_new):
+                # an updated vector moved to another list, regroup the rows by their (kept) assignments
+                self._lists = None
+            else:
+                for list_id in np.unique(new_assign[is_new]):
+                    self._lists[list_id] = np.concatenate([self._lists[list_id],rows[is_new & (new_assign == list_id)]])
+
+    def clear(self) -> None:
+        super().clear()
+        self.centroids = None
+        self._assign = np.zeros(0,dtype=np.int32)
+        self._lists = None
+
+    def delete(self, ids: list[str]) -> None:
+        if self.is_trained:
+            deleted = {self._rows[id_] for id_ in ids if id_ in self._rows}
+            keep = np.array([row for row in range(self._n) if row not in deleted],dtype=np.int64)
+            self._assign[:len(keep)] = self._assign[keep]
+        super().delete(ids)
+        self._lists = None
+
+    #-------------------------------------------------------------------
+    # search
+    def search(self, vectors, k: int, nprobe: Union[None,int] = None) -> Tuple[np.ndarray,np.ndarray]:
+        """
+        Approximate top-k search for a batch of query vectors, scanning the nprobe closest lists per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (n_queries, k') row indices and squared L2 distances, sorted by distance,
+                with k' = min(k, len(store)); rows missing when fewer than k vectors were scanned are -1 with an
+                infinite distance.
+        """
+        if not self.is_trained:
+            if self._n < self.min_train_size:
+                return super().search(vectors,k)
+            self.train()
+        if self._lists is None:
+            self._build_lists()
+        nprobe = min(nprobe or self.nprobe,self.n_lists)
+        queries = np.asarray(vectors,dtype=np.float32).reshape(len(vectors),-1)
+        k = min(k,self._n)
+        if k == 0:
+            return super().search(queries,k)
+        centroid_distances = np.einsum('ij,ij->i',self.centroids,self.centroids)[None,:] - 2*queries @ self.centroids.T
+        if nprobe < self.n_lists:
+            probes = np.argpartition(centroid_distances,nprobe-1,axis=1)[:,:nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.n_lists),(len(queries),self.n_lists))
+        if len(queries) < self.PER_QUERY_SCAN:
+            return self._scan_per_query(queries,probes,k)
+        # scan list by list: every query probing a list is scored against it with one matrix product, and keeps
+        # its k best candidates of that list in the slots of that probe
+        candidate_rows = np.full((len(queries),nprobe*k),-1,dtype=np.int64)
+        candidate_distances = np.full((len(queries),nprobe*k),np.inf,dtype=np.float32)
+        sq_queries = np.einsum('ij,ij->i',queries,queries)
+        flat_probes = probes.ravel()
+        order = np.argsort(flat_probes,kind='stable')
+        bounds = np.searchsorted(flat_probes[order],np.arange(self.n_lists+1))
+        for list_id in np.flatnonzero(np.diff(bounds)):
+            rows = self._lists[list_id]
+            if len(rows) == 0:
+                continue
+            entries = order[bounds[list_id]:bounds[list_id+1]]
+            query_ids,probe_ids = entries//nprobe,entries % nprobe
+            distances = (sq_queries[query_ids,None] + self._sq_norms[rows][None,:]
+                         - 2*queries[query_ids] @ self._matrix[rows].T)
+            n = min(k,len(rows))
+            top = np.argpartition(distances,n-1,axis=1)[:,:n] if n < len(rows) else np.broadcast_to(np.arange(n),(len(entries),n))
+            slots = probe_ids[:,None]*k + np.arange(n)[None,:]
+            candidate_rows[query_ids[:,None],slots] = rows[top]
+            candidate_distances[query_ids[:,None],slots] = np.take_along_axis(distances,top,axis=1)
+        top = np.argpartition(candidate_distances,k-1,axis=1)[:,:k] if k < nprobe*k else np.broadcast_to(np.arange(k),(len(queries),k))
+        top_distances = np.take_along_axis(candidate_distances,top,axis=1)
+        order = np.argsort(top_distances,axis=1,kind='stable')
+        top_rows = np.take_along_axis(np.take_along_axis(candidate_rows,top,axis=1),order,axis=1)
+        top_distances = np.take_along_axis(top_distances,order,axis=1)
+        top_rows[~np.isfinite(top_distances)] = -1
+        return top_rows,np.maximum(top_distances,0)
+
+    def _scan_per_query(self, queries: np.ndarray, probes: np.ndarray, k: int) -> Tuple[np.ndarray,np.ndarray]:
+        # a handful of queries: one gather and one matrix-vector product per query beats a pass over the lists
+        top_rows = np.full((len(queries),k),-1,dtype=np.int64)
+        top_distances = np.full((len(queries),k),np.inf,dtype=np.float32)
+        for i,(query,probe) in enumerate(zip(queries,probes)):
+            rows = np.concatenate([self._lists[list_id] for list_id in probe])
+            n = min(k,len(rows))
+            if n == 0:
+                continue
+            distances = float(query @ query) + self._sq_norms[rows] - 2*(self._matrix[rows] @ query)
+            top = np.argpartition(distances,n-1)[:n] if n < len(rows) else np.arange(len(rows))
+            top = top[np.argsort(distances[top],kind='stable')]
+            top_rows[i,:n] = rows[top]
+            top_distances[i,:n] = np.maximum(distances[top],0)
+        return top_rows,top_distances
+
+    def _to_documents(self, rows, distances) -> list[tuple]:
+        return super()._to_documents([r for r in rows if r >= 0],[d for r,d in zip(rows,distances) if r >= 0])
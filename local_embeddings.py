@@ -0,0 +1,41 @@
+import hashlib
+import math
+import re
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+class HashingEmbeddings:
+    """
+    Deterministic, dependency-free embedder for running the pipeline offline (tests, benchmarks, stub servers).
+
+    Lowercased word unigrams and bigrams are hashed into a fixed number of signed buckets and the resulting
+    vector is L2 normalized. Texts sharing vocabulary end up close in cosine distance, which is enough to get
+    meaningful retrievals without a network model. Implements the same embed_documents/embed_query interface
+    as the langchain embedders, so it can be passed anywhere an OpenAIEmbeddings instance is expected.
+
+    Args:
+        dim (int, optional): Dimension of the embeddings. Defaults to 256.
+    """
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.model = f'hashing-{dim}'
+
+    def _embed(self, text: str) -> list[float]:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [a + ' ' + b for a,b in zip(tokens,tokens[1:])]
+        vector = [0.0]*self.dim
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'),digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4],'little') % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v*v for v in vector))
+        if norm == 0:
+            # empty text, any fixed unit vector keeps distances well defined
+            vector[0] = norm = 1.0
+        return [v/norm for v in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
@@ -0,0 +1,198 @@
+import json
+import os
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+
+class NumpyVectorStore:
+    """
+    In-memory vector store holding all embeddings in one contiguous float32 matrix, answering top-k queries with a
+    vectorized dot product and argpartition. A drop-in alternative to Chroma for small to medium corpora, where
+    Chroma's round trip and persistence dominate query latency.
+
+    Distances are squared L2 distances, like the ones Chroma returns with its default settings, so scores and
+    rankings are interchangeable with the Chroma backend. The store can be saved to a directory (an .npy matrix
+    plus a JSON file with ids, texts and metadata) and loaded back, optionally memory-mapping the matrix instead
+    of reading it into memory; a memory-mapped matrix is copied into memory on the first write.
+
+    Args:
+        embedding_function: Embedder used for queries and add_texts (anything with embed_documents/embed_query).
+        persist_directory (str, optional): Directory the store is saved to and loaded from. Defaults to None (not persisted).
+        mmap (bool, optional): Whether to memory-map the saved matrix when loading. Defaults to False.
+    """
+    MATRIX_FNAME = 'embeddings.npy'
+    DOCUMENTS_FNAME = 'documents.json'
+
+    def __init__(self, embedding_function, persist_directory: Union[None,str] = None, mmap: bool = False):
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self._rows = {}
+        self._matrix = None
+        self._sq_norms = None
+        self._n = 0
+        # bumped on every write, caches of search results compare it (see retrieval.cache_state)
+        self.version = 0
+        if persist_directory is not None and os.path.exists(os.path.join(persist_directory,self.DOCUMENTS_FNAME)):
+            self._load(mmap)
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The (n, dim) float32 matrix of the stored embeddings."""
+        if self._matrix is None:
+            return np.zeros((0,0),dtype=np.float32)
+        return self._matrix[:self._n]
+
+    def __len__(self) -> int:
+        return self._n
+
+    #-------------------------------------------------------------------
+    # persistence
+    def _load(self, mmap: bool) -> None:
+        with open(os.path.join(self.persist_directory,self.DOCUMENTS_FNAME),'r') as f:
+            documents = json.load(f)
+        self.ids,self.texts,self.metadatas = documents['ids'],documents['texts'],documents['metadatas']
+        self._rows = {i:row for row,i in enumerate(self.ids)}
+        self._n = len(self.ids)
+        self.version += 1
+        if self._n:
+            self._matrix = np.load(os.path.join(self.persist_directory,self.MATRIX_FNAME),mmap_mode='r' if mmap else None)
+            self._sq_norms = np.einsum('ij,ij->i',self._matrix,self._matrix)
+
+    def save(self) -> None:
+        """Writes the store to persist_directory."""
+        os.makedirs(self.persist_directory,exist_ok=True)
+        if self._n and not isinstance(self._matrix,np.memmap):
+            np.save(os.path.join(self.persist_directory,self.MATRIX_FNAME),self.matrix)
+        with open(os.path.join(self.persist_directory,self.DOCUMENTS_FNAME),'w') as f:
+            json.dump({'ids':self.ids,'texts':self.texts,'metadatas':self.metadatas},f)
+
+    #-------------------------------------------------------------------
+    # writes
+    def _writable(self, n_rows: int, dim: int) -> None:
+        # amortized growth, and a memory-mapped matrix is brought into memory before it is modified
+        if self._matrix is None:
+            self._matrix = np.zeros((max(n_rows,16),dim),dtype=np.float32)
+            self._sq_norms = np.zeros(max(n_rows,16),dtype=np.float32)
+        elif n_rows > self._matrix.shape[0] or isinstance(self._matrix,np.memmap):
+            capacity = max(n_rows,2*self._matrix.shape[0]) if n_rows > self._matrix.shape[0] else self._matrix.shape[0]
+            matrix = np.zeros((capacity,self._matrix.shape[1]),dtype=np.float32)
+            matrix[:self._n] = self._matrix[:self._n]
+            sq_norms = np.zeros(capacity,dtype=np.float32)
+            sq_norms[:self._n] = self._sq_norms[:self._n]
+            self._matrix,self._sq_norms = matrix,sq_norms
+
+    def add_embeddings(self, ids: list[str], texts: list[str], metadatas: list[dict], embeddings: list[list[float]]) -> None:
+        """Upserts documents with precomputed embeddings."""
+        vectors = np.asarray(embeddings,dtype=np.float32).reshape(len(ids),-1)
+        new = [i for i,id_ in enumerate(ids) if id_ not in self._rows]
+        self._writable(self._n + len(new),vectors.shape[1])
+        for i,id_ in enumerate(ids):
+            row = self._rows.get(id_)
+            if row is None:
+                row = self._rows[id_] = self._n
+                self._n += 1
+                self.ids.append(id_)
+                self.texts.append(texts[i])
+                self.metadatas.append(metadatas[i] or {})
+            else:
+                self.texts[row],self.metadatas[row] = texts[i],metadatas[i] or {}
+            self._matrix[row] = vectors[i]
+        rows = [self._rows[id_] for id_ in ids]
+        self._sq_norms[rows] = np.einsum('ij,ij->i',vectors,vectors)
+        self.version += 1
+
+    def add_texts(self, texts: Iterable[str], metadatas: Union[None,list[dict]] = None, ids: Union[None,list[str]] = None) -> list[str]:
+        """Embeds and upserts texts, like the langchain VectorStore method."""
+        import uuid
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        self.add_embeddings(ids,texts,metadatas,self.embedding_function.embed_documents(texts))
+        return ids
+
+    def clear(self) -> None:
+        """Removes all documents."""
+        self.ids,self.texts,self.metadatas = [],[],[]
+        self._rows = {}
+        self._matrix,self._sq_norms = None,None
+        self._n = 0
+        self.version += 1
+
+    def delete(self, ids: list[str]) -> None:
+        rows = {self._rows[id_] for id_ in ids if id_ in self._rows}
+        if not rows:
+            return
+        keep = np.array([row for row in range(self._n) if row not in rows],dtype=np.int64)
+        self._writable(self._n,self._matrix.shape[1])
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._sq_norms[:len(keep)] = self._sq_norms[keep]
+        self.ids = [self.ids[row] for row in keep]
+        self.texts = [self.texts[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self._rows = {id_:row for row,id_ in enumerate(self.ids)}
+        self._n = len(keep)
+        self.version += 1
+
+    #-------------------------------------------------------------------
+    # reads
+    def get(self, ids: Union[None,list[str]] = None, include: Union[None,list[str]] = None) -> dict:
+        """Returns stored documents in the same format as Chroma's get: a dict with 'ids', 'documents' and 'metadatas'."""
+        rows = range(self._n) if ids is None else [self._rows[id_] for id_ in ids if id_ in self._rows]
+        include = ['documents','metadatas'] if include is None else include
+        result = {'ids':[self.ids[row] for row in rows]}
+        if 'documents' in include:
+            result['documents'] = [self.texts[row] for row in rows]
+        if 'metadatas' in include:
+            result['metadatas'] = [self.metadatas[row] for row in rows]
+        return result
+
+    def search(self, vectors, k: int) -> Tuple[np.ndarray,np.ndarray]:
+        """
+        Exact top-k search for a batch of query vectors.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (n_queries, k') row indices and squared L2 distances, sorted by distance, with k' = min(k, len(store)).
+        """
+        queries = np.asarray(vectors,dtype=np.float32).reshape(len(vectors),-1)
+        k = min(k,self._n)
+        if k == 0:
+            return np.zeros((len(queries),0),dtype=np.int64),np.zeros((len(queries),0),dtype=np.float32)
+        # |q - x|^2 = |q|^2 + |x|^2 - 2 q.x
+        distances = (np.einsum('ij,ij->i',queries,queries)[:,None] + self._sq_norms[None,:self._n]
+                     - 2*queries @ self._matrix[:self._n].T)
+        np.maximum(distances,0,out=distances)
+        if k < self._n:
+            top = np.argpartition(distances,k-1,axis=1)[:,:k]
+        else:
+            top = np.broadcast_to(np.arange(self._n),(len(queries),self._n))
+        top_distances = np.take_along_axis(distances,top,axis=1)
+        order = np.argsort(top_distances,axis=1,kind='stable')
+        return np.take_along_axis(top,order,axis=1),np.take_along_axis(top_distances,order,axis=1)
+
+    def _to_documents(self, rows, distances) -> list[tuple]:
+        from langchain_core.documents import Document
+        return [(Document(page_content=self.texts[row],metadata=self.metadatas[row]),float(distance))
+                for row,distance in zip(rows,distances)]
+
+    def similarity_search_by_vectors_with_score(self, vectors: list[list[float]], k: int = 4) -> list[list[tuple]]:
+        """Batched search: for each query vector, the top-k (Document, distance) tuples."""
+        rows,distances = self.search(vectors,k)
+        return [self._to_documents(r,d) for r,d in zip(rows,distances)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: list[float], k: int = 4) -> list[tuple]:
+        # same (misleading) name and distance semantics as in langchain's Chroma
+        return self.similarity_search_by_vectors_with_score([embedding],k=k)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> list[tuple]:
+        """The top-k (Document, distance) tuples for a query, as returned by the langchain vector stores."""
+        return self.similarity_search_by_vectors_with_score([self.embedding_function.embed_query(query)],k=k)[0]
+
+    def similarity_search(self, query: str, k: int = 4) -> list:
+        return [doc for doc,_ in self.similarity_search_with_score(query,k=k)]
@@ -0,0 +1,49 @@
+import threading
+
+class LazyRegistry:
+    """
+    Registry of expensive, shared objects (models, clients) that are only created when first used.
+
+    A loader is registered under a name, and the first get() of that name calls it, under a lock so concurrent
+    first uses load the object once. Later gets return the same instance. set() installs an instance directly
+    (e.g. a preloaded or fake model), and reset() drops instances so they are loaded again on next use.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader) -> None:
+        """Registers loader, a function without arguments returning the object, under name."""
+        self._loaders[name] = loader
+
+    def get(self, name: str, loader=None):
+        """
+        Returns the object registered under name, loading it on first use.
+
+        Args:
+            name (str): The name of the object.
+            loader (optional): Loader to use if name was not registered, e.g. for objects keyed on a parameter.
+        """
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = (loader or self._loaders[name])()
+            return self._instances[name]
+
+    def set(self, name: str, instance) -> None:
+        self._instances[name] = instance
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def reset(self, name: str = None) -> None:
+        """Drops the instance registered under name (all instances if name is None)."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name,None)
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+class RerankCache:
+    """
+    Bounded in-memory cache of cross-encoder scores, so popular (query, chunk) pairs are only scored once.
+
+    Entries are keyed on the normalized query (lowercased, whitespace collapsed) and a hash of the chunk's
+    content, expire after ttl seconds, and the least recently used entries are evicted beyond max_entries.
+    Every lookup names the reranker model: when it differs from the model the cached scores came from, the
+    cache is cleared, so swapping the reranker can never serve stale scores.
+
+    Args:
+        model_name (str): Name of the reranker model the scores come from.
+        max_entries (int, optional): Maximum number of cached scores. Defaults to 100000.
+        ttl (float, optional): Time to live of a score, in seconds. Defaults to 3600.
+        clock (callable, optional): Time source, in seconds. Defaults to time.monotonic.
+    """
+    def __init__(self, model_name: str, max_entries: int = 100_000, ttl: float = 3600.0, clock=time.monotonic):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, text: str) -> tuple[str,str]:
+        return ' '.join(query.lower().split()),hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _check_model(self, model_name: str) -> None:
+        if model_name != self.model_name:
+            self._entries.clear()
+            self.model_name = model_name
+
+    def get_many(self, model_name: str, pairs: list[tuple[str,str]]) -> list[Union[None,float]]:
+        """
+        Looks up the scores of (query, text) pairs.
+
+        Returns:
+            list[float or None]: The cached score of each pair, None where it is not cached (or expired).
+        """
+        now = self.clock()
+        scores = []
+        with self._lock:
+            self._check_model(model_name)
+            for query,text in pairs:
+                key = self.key(query,text)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    scores.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    scores.append(entry[0])
+        return scores
+
+    def put_many(self, model_name: str, pairs: list[tuple[str,str]], scores: list[float]) -> None:
+        """Caches the scores of (query, text) pairs computed with model_name."""
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._check_model(model_name)
+            for (query,text),score in zip(pairs,scores):
+                key = self.key(query,text)
+                self._entries[key] = (score,expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits/total if total else 0.0
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, hit rate and current number of cached scores."""
+        return {'hits':self.hits,'misses':self.misses,'hit_rate':self.hit_rate,'size':len(self)}
@@ -0,0 +1,53 @@
+import warnings
+from typing import Tuple, Union
+
+ENGINES = ('fp32','int8')
+
+def load_cross_encoder(model_name: str, engine: str = 'fp32', num_threads: Union[None,int] = None):
+    """
+    Loads a sentence_transformers CrossEncoder for CPU reranking.
+
+    With engine 'int8', the weights of every linear layer are quantized to int8 with PyTorch dynamic quantization
+    (activations are quantized on the fly), which cuts the matrix multiplications that dominate a MiniLM forward
+    pass at a small cost in score precision; benchmarks/rerank_engines.py measures the agreement with fp32.
+
+    Args:
+        model_name (str): Name or path of the cross-encoder model.
+        engine (str, optional): 'fp32' or 'int8'. Defaults to 'fp32'.
+        num_threads (int, optional): Number of intra-op CPU threads of PyTorch (a process-wide setting). Defaults to
+            None (PyTorch's default, one per core).
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"unknown reranking engine {engine!r}, expected one of {ENGINES}")
+    import torch
+    from sentence_transformers import CrossEncoder
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if engine == 'fp32':
+        return CrossEncoder(model_name)
+    # dynamically quantized kernels only run on CPU
+    cross_encoder = CrossEncoder(model_name,device='cpu')
+    # older sentence_transformers versions wrap the transformers model instead of being a torch module
+    module = cross_encoder if isinstance(cross_encoder,torch.nn.Module) else cross_encoder.model
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favor of torchao, which is not a dependency
+        warnings.simplefilter('ignore')
+        torch.ao.quantization.quantize_dynamic(module,{torch.nn.Linear},dtype=torch.qint8,inplace=True)
+    return cross_encoder
+
+def prune_candidates(results_and_scores: list[Tuple[object,float]], k: int, margin: float) -> list[Tuple[object,float]]:
+    """
+    Drops the dense candidates that are clearly out of the running before reranking.
+
+    Candidates are (document, distance) tuples sorted by distance. A candidate is kept if its distance is within
+    margin of the best one, and the k closest are always kept, so reranking still has k documents to return. When
+    the best candidate is separated from all the others by more than margin (and k = 1), a single candidate is
+    left and reranking costs one pair.
+
+    Returns:
+        list[Tuple[Document, float]]: The kept candidates, in their original order.
+    """
+    if not results_and_scores:
+        return results_and_scores
+    best = results_and_scores[0][1]
+    return [(r,s) for i,(r,s) in enumerate(results_and_scores) if i < k or s - best <= margin]
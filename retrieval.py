@@ -1,48 +1,217 @@
-#from langchain.embeddings import OpenAIEmbeddings
-from langchain_community.embeddings import OpenAIEmbeddings
-#from langchain.vectorstores import Chroma
-from langchain_community.vectorstores import Chroma
-from langchain.vectorstores.base import VectorStore
+from __future__ import annotations
 import os
 import json
-import shutil
-from typing import Tuple, Union
-from sentence_transformers import CrossEncoder
+import itertools
+import weakref
+from typing import TYPE_CHECKING, Iterable, Tuple, Union
+import chunking
+import ingest
+import tracing
+from embedding_cache import CachedEmbeddings
+from registry import LazyRegistry
+from rerank_cache import RerankCache
+if TYPE_CHECKING:
+    # langchain, chromadb and sentence_transformers take seconds to import, they are only imported on first use
+    from langchain.vectorstores.base import VectorStore
+    from langchain_core.documents import Document
+    from bm25 import BM25Index
+    from chunk_store import ChunkStore
+    from semantic_cache import SemanticCache
 PERSIST_DIRECTORY = "./chroma_db"
-# Set OpenAI API Key
-with open('secrets.json','r') as f:
-    os.environ["OPENAI_API_KEY"] = json.load(f)['OPENAI_API_KEY']
-cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+NUMPY_PERSIST_DIRECTORY = "./numpy_db"
+IVF_PERSIST_DIRECTORY = PERSIST_DIRECTORY + "_ivf"
+LEXICAL_INDEX_FNAME = "bm25.json"
+RRF_K = 60
+COLLECTION_NAME = "langchain"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite"
+CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+# reranking engine ('fp32' or 'int8', see reranker.load_cross_encoder) and CPU threads, set with configure_reranker
+RERANK_ENGINE = 'fp32'
+RERANK_THREADS = None
+SECRETS_PATH = 'secrets.json'
+rerank_cache = RerankCache(CROSS_ENCODER_MODEL)
+# process-unique tokens of the in-memory objects semantic cache keys refer to (id() values are reused once freed)
+_cache_tokens = weakref.WeakKeyDictionary()
+_next_cache_token = itertools.count()
 
-def create_vector_store(chunks:list[dict], overwrite:bool=False) -> VectorStore:
-    """Creates a vector store using OpenAI embeddings and ChromaDB.
+def _load_cross_encoder():
+    from reranker import load_cross_encoder
+    return load_cross_encoder(CROSS_ENCODER_MODEL,engine=RERANK_ENGINE,num_threads=RERANK_THREADS)
+
+def _load_embeddings():
+    #from langchain.embeddings import OpenAIEmbeddings
+    from langchain_community.embeddings import OpenAIEmbeddings
+    # Set OpenAI API Key
+    if "OPENAI_API_KEY" not in os.environ:
+        with open(SECRETS_PATH,'r') as f:
+            os.environ["OPENAI_API_KEY"] = json.load(f)['OPENAI_API_KEY']
+    return CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL),model_name=EMBEDDING_MODEL,path=EMBEDDING_CACHE_PATH)
+
+# models and clients, loaded on first use and shared afterwards
+models = LazyRegistry()
+models.register('cross_encoder',_load_cross_encoder)
+models.register('embeddings',_load_embeddings)
+
+def __getattr__(name):
+    # retrieval.cross_encoder used to be loaded at import time
+    if name == 'cross_encoder':
+        return models.get('cross_encoder')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_cross_encoder():
+    """Returns the shared cross-encoder used for reranking, loading it on first use."""
+    return models.get('cross_encoder')
+
+def configure_reranker(engine: str = 'fp32', num_threads: Union[None,int] = None) -> None:
+    """
+    Selects the reranking engine, 'fp32' or 'int8' (dynamically quantized, CPU), and the number of CPU threads.
+    The cross-encoder is loaded again with the new settings on next use.
+    """
+    from reranker import ENGINES
+    if engine not in ENGINES:
+        raise ValueError(f"unknown reranking engine {engine!r}, expected one of {ENGINES}")
+    global RERANK_ENGINE,RERANK_THREADS
+    RERANK_ENGINE,RERANK_THREADS = engine,num_threads
+    models.reset('cross_encoder')
+
+def reranker_name() -> str:
+    """Name of the active reranker, the cross-encoder model and engine its scores come from (e.g. for the rerank cache)."""
+    return CROSS_ENCODER_MODEL if RERANK_ENGINE == 'fp32' else f'{CROSS_ENCODER_MODEL}:{RERANK_ENGINE}'
+
+def get_embeddings():
+    """Returns the shared OpenAI text-embedding-3-small embedder, wrapped in the persistent embedding cache."""
+    return models.get('embeddings')
+
+def get_chroma_client(persist_directory: str):
+    """Returns the shared ChromaDB client persisting to persist_directory, creating it on first use."""
+    persist_directory = os.path.abspath(persist_directory)
+    def load():
+        import chromadb
+        return chromadb.PersistentClient(path=persist_directory)
+    return models.get(f'chroma_client:{persist_directory}',loader=load)
+
+def default_persist_directory(backend: str = 'chroma') -> str:
+    """The directory a backend persists to when create_vector_store is not given one."""
+    return {'numpy':NUMPY_PERSIST_DIRECTORY,'ivf':IVF_PERSIST_DIRECTORY}.get(backend,PERSIST_DIRECTORY)
+
+def load_lexical_index(persist_directory: Union[None,str] = None, backend: str = 'chroma') -> Union[None,BM25Index]:
+    """Loads the lexical index saved next to a vector store by create_vector_store, None if there is none."""
+    from bm25 import BM25Index
+    path = os.path.join(persist_directory or default_persist_directory(backend),LEXICAL_INDEX_FNAME)
+    return BM25Index.load(path) if os.path.exists(path) else None
+
+def create_vector_store(chunks:Iterable[dict], overwrite:bool=False, incremental:bool=False, embeddings=None, max_workers:int=ingest.MAX_WORKERS, persist_directory:Union[None,str]=None, backend:str='chroma', mmap:bool=False, nprobe:int=8, lexical_index:Union[None,BM25Index]=None) -> VectorStore:
+    """Creates a vector store using OpenAI embeddings and ChromaDB (or the in-memory NumPy backend).
 
     Args:
-        chunks (list[dict]): A list of dictionaries where each dictionary contains 'text' and 'metadata' keys. 
+        chunks (Iterable[dict]): A list (or a generator, e.g. chunking.iter_process_document) of dictionaries where each dictionary contains 'text' and 'metadata' keys. 
             The 'text' is the content to be embedded, and 'metadata' contains relevant metadata for each chunk.
+            An optional 'id' key (as set by chunking.process_document) is used as the chunk's ID in the store,
+            otherwise the content-hash ID is computed here. A chunk_store.ChunkStore is stored slim: the raw
+            content is left out of the metadata, and results are rehydrated from the ChunkStore (pass it as
+            chunk_store to retrieve_and_rerank).
         overwrite (bool, optional): If True, existing vector store data at the persist directory will be 
             deleted before creating the new store. Defaults to False.
+        incremental (bool, optional): If True, the existing collection at the persist directory is kept and
+            synced with the chunks: only new or changed chunks are embedded and upserted, and chunks that
+            are no longer present are deleted. Defaults to False.
+        embeddings (optional): The embedder to use. Defaults to the cached OpenAI embedder from get_embeddings().
+        max_workers (int, optional): Number of concurrent embedding requests during ingestion. Defaults to 4.
+        persist_directory (str, optional): Where the store is persisted. Defaults to PERSIST_DIRECTORY, or
+            NUMPY_PERSIST_DIRECTORY / IVF_PERSIST_DIRECTORY for the NumPy / IVF backends.
+        backend (str, optional): 'chroma', 'numpy' for numpy_store.NumpyVectorStore, which keeps the embeddings
+            in one float32 matrix and searches it exactly, or 'ivf' for the approximate ivf_index.IVFVectorStore
+            on top of it. Defaults to 'chroma'.
+        mmap (bool, optional): With the NumPy and IVF backends, memory-map the persisted embeddings instead of loading them. Defaults to False.
+        nprobe (int, optional): With the IVF backend, the number of lists scanned per query. Defaults to 8.
+        lexical_index (bm25.BM25Index, optional): A lexical index of the chunks (see chunking.process_document) to keep
+            in sync with the store and save next to it, as LEXICAL_INDEX_FNAME in the persist directory. Chunks
+            missing from it are added and stale chunks are deleted from it. Defaults to None.
 
     Returns:
-        VectorStore: A ChromaDB vector store containing the embedded text data, ready for querying and persistence.
-    """
-    # Initialize OpenAI Embeddings with text-embedding-3-small
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-
-    # Create ChromaDB vector store
-    if overwrite:
-        if os.path.exists(PERSIST_DIRECTORY):
-            shutil.rmtree(PERSIST_DIRECTORY)
-
-    vectorstore = Chroma.from_texts(
-        texts=[c['text'] for c in chunks],
-        metadatas = [c['metadata'] for c in chunks],
-        embedding=embeddings,
-        persist_directory=PERSIST_DIRECTORY
-    )
+        VectorStore: A ChromaDB (or NumPy) vector store containing the embedded text data, ready for querying and persistence.
+    """
+    # Initialize OpenAI Embeddings with text-embedding-3-small, behind the embedding cache
+    if embeddings is None:
+        embeddings = get_embeddings()
+    if persist_directory is None:
+        persist_directory = default_persist_directory(backend)
+    if hasattr(chunks,'iter_chunks'):
+        chunks = chunks.iter_chunks(slim=True)
+    vectorstore = open_vector_store(embeddings,persist_directory=persist_directory,backend=backend,mmap=mmap,nprobe=nprobe,overwrite=overwrite)
+    existing_ids = set()
+    if incremental:
+        existing_ids = set(vectorstore.get(include=[])['ids'])
+    seen_ids = set()
+    def new_chunks():
+        # content-hash IDs, identical chunks collapse onto one entry
+        for c in chunks:
+            chunk_id = c.get('id') or chunking.chunk_id(c)
+            if lexical_index is not None and chunk_id not in lexical_index:
+                lexical_index.add([chunk_id],[c['text']])
+            if chunk_id in seen_ids:
+                continue
+            seen_ids.add(chunk_id)
+            if chunk_id not in existing_ids:
+                yield dict(c,id=chunk_id)
+    # embed in token-budgeted batches on a thread pool, streaming each batch into the store as it completes
+    with tracing.span('ingest'):
+        ingest.ingest_chunks(new_chunks(),vectorstore,embeddings,max_workers=max_workers)
+    if incremental:
+        stale_ids = list(existing_ids - seen_ids)
+        if stale_ids:
+            with tracing.span('vectorstore.delete'):
+                vectorstore.delete(ids=stale_ids)
+    if lexical_index is not None:
+        if incremental or overwrite:
+            lexical_index.delete(set(lexical_index.ids) - seen_ids - {None})
+        lexical_index.save(os.path.join(persist_directory,LEXICAL_INDEX_FNAME))
+    save_vector_store(vectorstore,backend)
+    return vectorstore
+
+def open_vector_store(embeddings, persist_directory: Union[None,str] = None, backend: str = 'chroma', mmap: bool = False, nprobe: int = 8, overwrite: bool = False) -> VectorStore:
+    """
+    Opens (or creates) the vector store persisted at persist_directory, without adding anything to it.
+
+    See create_vector_store for the arguments. With overwrite, the store is emptied.
+    """
+    if persist_directory is None:
+        persist_directory = default_persist_directory(backend)
+    if backend == 'chroma':
+        #from langchain.vectorstores import Chroma
+        from langchain_community.vectorstores import Chroma
+        # Create ChromaDB vector store
+        client = get_chroma_client(persist_directory)
+        if overwrite:
+            if COLLECTION_NAME in {getattr(c,'name',c) for c in client.list_collections()}:
+                client.delete_collection(COLLECTION_NAME)
+        vectorstore = Chroma(collection_name=COLLECTION_NAME,embedding_function=embeddings,client=client)
+    elif backend == 'numpy':
+        from numpy_store import NumpyVectorStore
+        vectorstore = NumpyVectorStore(embeddings,persist_directory=persist_directory,mmap=mmap)
+    elif backend == 'ivf':
+        from ivf_index import IVFVectorStore
+        vectorstore = IVFVectorStore(embeddings,persist_directory=persist_directory,mmap=mmap,nprobe=nprobe)
+    else:
+        raise ValueError(f"unknown vector store backend {backend!r}, expected 'chroma', 'numpy' or 'ivf'")
+    if overwrite and backend != 'chroma':
+        vectorstore.clear()
     return vectorstore
 
-def retrieve_and_rerank(query: str,vectorstore : VectorStore , k: int, first_k: Union[None,int] = None, do_rerank : bool = True) -> list[Tuple[dict,float]]:
+def save_vector_store(vectorstore: VectorStore, backend: str = 'chroma') -> None:
+    """
+    Persists the NumPy and IVF stores (training the IVF index first once it is large enough), Chroma persists itself.
+    """
+    if backend == 'ivf' and not vectorstore.is_trained and len(vectorstore) >= vectorstore.min_train_size:
+        # train before saving, so the persisted index is used right away on the next load
+        with tracing.span('vectorstore.train'):
+            vectorstore.train()
+    if backend != 'chroma':
+        with tracing.span('vectorstore.save'):
+            vectorstore.save()
+
+def retrieve_and_rerank(query: str,vectorstore : VectorStore , k: int, first_k: Union[None,int] = None, do_rerank : bool = True, lexical_index: Union[None,BM25Index] = None, rrf_k: int = RRF_K, early_exit_margin: Union[None,float] = None, chunk_store: Union[None,ChunkStore] = None, semantic_cache: Union[None,SemanticCache] = None) -> list[Tuple[dict,float]]:
     """
     Retrieves the top-k most similar documents to a given query from a vector store and re-ranks them using a cross-encoder model.
 
@@ -51,27 +220,369 @@ def retrieve_and_rerank(query: str,vectorstore : VectorStore , k: int, first_k:
         vectorstore (VectorStore): A vector store containing document embeddings for similarity search.
         k (int): The number of top similar documents to retrieve.
         first_k (None or int): The initial number of retrievals before reranking. If None, first_k = k. Default is None
+        lexical_index (None or bm25.BM25Index): If given, hybrid retrieval: the first_k candidates are the best of the
+            dense and lexical (BM25) results, fused with reciprocal rank fusion (see fuse_results). Without reranking,
+            the scores are then the fused scores (higher is better) instead of distances. Default is None
+        rrf_k (int): The rank offset of reciprocal rank fusion. Default is 60
+        early_exit_margin (None or float): If given, adaptive reranking: dense candidates farther than this margin
+            from the closest one are not reranked, and reranking is skipped when only one candidate is left (see
+            rerank). Not applied in hybrid mode, where the fused scores are not distances. Default is None
+        chunk_store (None or chunk_store.ChunkStore): The store the vector store was created from, the final
+            results are rehydrated from it (see rehydrate). Default is None
+        semantic_cache (None or semantic_cache.SemanticCache): If given, a query whose embedding is close enough to
+            one already answered with the same arguments gets its results back without searching or reranking.
+            Cached results are dropped as soon as the store (or lexical index) they came from changes, see
+            cache_state. Not used with stores whose changes cannot be tracked or that do not expose their
+            embeddings. Default is None
     Returns:
         list[Tuple[dict, float]]: A sorted list of tuples where each tuple contains a document (dict) and its re-ranked similarity score (float).
     """
     if first_k is None or do_rerank is False:
         first_k = k
-    results_and_scores = vectorstore.similarity_search_with_score(query, k=first_k)
+    tracing.count('queries')
+    if semantic_cache is not None:
+        key,version = _semantic_cache_key(vectorstore,k,first_k,do_rerank,lexical_index,rrf_k,early_exit_margin,chunk_store)
+        if version is None:
+            semantic_cache = None
+    vector = None
+    if _embeds_queries(vectorstore,semantic_cache):
+        with tracing.span('retrieve.embed'):
+            vector = vectorstore.embeddings.embed_query(query)
+    if semantic_cache is not None and vector is not None:
+        cached = semantic_cache.get(vector,key,version)
+        if cached is not None:
+            tracing.count('semantic_cache_hits')
+            return cached
+        tracing.count('semantic_cache_misses')
+    with tracing.span('retrieve.search'):
+        results_and_scores = similarity_search_by_vectors(vectorstore,[vector],first_k,queries=[query])[0]
+    if lexical_index is not None:
+        results_and_scores = hybrid_search([query],[results_and_scores],vectorstore,lexical_index,first_k,rrf_k=rrf_k,
+                                           chunk_store=chunk_store)[0]
     if do_rerank:
-        #cross encoder reranker
-        retrieved_texts = [r.page_content for r,s in results_and_scores]
-        response = [[query, text] for text in retrieved_texts]
-        cross_encoder_scores = cross_encoder.predict(response)
-        results_and_scores = [(r,s1) for (r,s),s1 in zip(results_and_scores,cross_encoder_scores)]
-        results_and_scores = list(sorted(results_and_scores,key=lambda el:el[1],reverse=True))[:k]
+        with tracing.span('rerank'):
+            results_and_scores = rerank([query],[results_and_scores],k,
+                                        early_exit_margin=early_exit_margin if lexical_index is None else None)[0]
+    if chunk_store is not None:
+        results_and_scores = rehydrate([results_and_scores],chunk_store)[0]
+    if semantic_cache is not None and vector is not None:
+        semantic_cache.put(vector,key,results_and_scores,version)
     return results_and_scores
+
+def _cache_token(obj) -> int:
+    # a token unique to obj for the lifetime of the process
+    token = _cache_tokens.get(obj)
+    if token is None:
+        token = _cache_tokens[obj] = next(_next_cache_token)
+    return token
+
+def cache_state(vectorstore: VectorStore) -> Tuple[Union[None,tuple],Union[None,tuple]]:
+    """
+    Identifies a vector store and the current state of its contents, for caching its search results.
+
+    A Chroma store is identified by its persist directory and collection name, so the cached results are shared by
+    every handle opened on it, and its version is the modification time and size of its SQLite file, which every
+    add, upsert and delete rewrites (including writes made by other processes). The NumPy and IVF stores are
+    identified by the object itself and versioned by the counter their writes bump.
+
+    Returns:
+        Tuple[tuple, tuple]: The identity and version of the store, (None, None) when its changes cannot be tracked
+            (stores other than the above, in-memory Chroma stores).
+    """
+    if hasattr(vectorstore,'version'):
+        return ('store',_cache_token(vectorstore)),(vectorstore.version,)
+    from langchain_community.vectorstores import Chroma
+    if isinstance(vectorstore,Chroma):
+        settings = vectorstore._client.get_settings()
+        if settings.is_persistent:
+            persist_directory = settings.persist_directory
+            try:
+                stat = os.stat(os.path.join(persist_directory,'chroma.sqlite3'))
+            except OSError:
+                return None,None
+            return (('chroma',os.path.abspath(persist_directory),vectorstore._collection.name),
+                    (stat.st_mtime_ns,stat.st_size))
+    return None,None
+
+def _semantic_cache_key(vectorstore: VectorStore, k: int, first_k: int, do_rerank: bool, lexical_index: Union[None,BM25Index],
+                        rrf_k: int, early_exit_margin: Union[None,float], chunk_store: Union[None,ChunkStore]) -> Tuple[tuple,Union[None,tuple]]:
+    # the arguments the results depend on, besides the query: cached results are only served to identical ones,
+    # and only as long as the version of the store and lexical index they came from is unchanged
+    identity,version = cache_state(vectorstore)
+    if version is None:
+        return None,None
+    key = (identity,k,first_k,do_rerank,_cache_token(lexical_index) if lexical_index is not None else None,rrf_k,
+           early_exit_margin,_cache_token(chunk_store) if chunk_store is not None else None,
+           reranker_name() if do_rerank else None)
+    return key,version + (lexical_index.version if lexical_index is not None else None,)
+
+def rehydrate(results_per_query: list[list[Tuple[Document,float]]], chunk_store: ChunkStore) -> list[list[Tuple[Document,float]]]:
+    """
+    Restores the full metadata (with raw_content) of results stored slim from a chunk_store.ChunkStore.
+
+    Only the given results are rebuilt, so the raw contents of a document are materialized for the top-k results
+    and not for every chunk. Results without a chunk ID in their metadata, or whose ID is not in the store, are
+    returned as they are.
+    """
+    from langchain_core.documents import Document
+    from chunk_store import CHUNK_ID_KEY
+    rehydrated = []
+    for results_and_scores in results_per_query:
+        results = []
+        for r,score in results_and_scores:
+            i = chunk_store.index(r.metadata[CHUNK_ID_KEY]) if CHUNK_ID_KEY in r.metadata else None
+            if i is not None:
+                r = Document(page_content=r.page_content,metadata=chunk_store.metadata(i))
+            results.append((r,score))
+        rehydrated.append(results)
+    return rehydrated
+
+def _result_key(document: Document) -> tuple[str,str]:
+    return document.page_content,json.dumps(document.metadata,sort_keys=True)
+
+def fuse_results(ranked_lists: list[list[Document]], n: int, rrf_k: int = RRF_K) -> list[Tuple[Document,float]]:
+    """
+    Reciprocal rank fusion: a document scores sum(1/(rrf_k + rank)) over the ranked lists it appears in (ranks
+    start at 1), so documents ranked well by several retrievers come first. Ties keep the order of the lists.
+
+    Args:
+        ranked_lists (list[list[Document]]): The ranked results of each retriever, best first.
+        n (int): The number of fused results to return.
+        rrf_k (int, optional): The rank offset, damping the weight of the first ranks. Defaults to RRF_K.
+
+    Returns:
+        list[Tuple[Document, float]]: The top-n documents and their fused scores, best first.
+    """
+    fused = {}
+    for documents in ranked_lists:
+        for rank,document in enumerate(documents,start=1):
+            key = _result_key(document)
+            entry = fused.setdefault(key,[document,0.0])
+            entry[1] += 1/(rrf_k + rank)
+    # sorted is stable, so ties keep their first-seen order
+    return [tuple(entry) for entry in sorted(fused.values(),key=lambda entry:entry[1],reverse=True)[:n]]
+
+def fetch_documents(vectorstore: VectorStore, ids: list[str], chunk_store: Union[None,ChunkStore] = None) -> dict[str,Document]:
+    """
+    Resolves chunk IDs to documents, in the form the store's searches return them.
+
+    The chunk_store the store was created from is used when given (the documents are then slim, like the
+    store's), otherwise the store's get (Chroma and the NumPy backends, one call for all the IDs) or the
+    get_by_ids of other langchain VectorStores.
+
+    Raises:
+        ValueError: If the store can resolve neither, e.g. for hybrid retrieval on a store without them.
+
+    Returns:
+        dict[str, Document]: The documents of the IDs found, by ID.
+    """
+    from langchain_core.documents import Document
+    if chunk_store is not None:
+        from chunk_store import CHUNK_ID_KEY
+        documents = {}
+        for id_ in ids:
+            i = chunk_store.index(id_)
+            if i is not None:
+                documents[id_] = Document(page_content=chunk_store.text(i),
+                                          metadata=dict(chunk_store.metadata(i,raw_content=False),**{CHUNK_ID_KEY:id_}))
+        return documents
+    if hasattr(vectorstore,'get'):
+        stored = vectorstore.get(ids=ids,include=['documents','metadatas'])
+        return {id_:Document(page_content=text,metadata=metadata or {})
+                for id_,text,metadata in zip(stored['ids'],stored['documents'],stored['metadatas'])}
+    if hasattr(vectorstore,'get_by_ids'):
+        return {document.id:Document(page_content=document.page_content,metadata=document.metadata or {})
+                for document in vectorstore.get_by_ids(ids)}
+    raise ValueError(f'{type(vectorstore).__name__} cannot fetch documents by ID (no get or get_by_ids), '
+                     'pass the chunk_store it was created from for hybrid retrieval')
+
+def hybrid_search(queries: list[str], dense_results_per_query: list[list[Tuple[Document,float]]], vectorstore: VectorStore,
+                  lexical_index: BM25Index, first_k: int, rrf_k: int = RRF_K, chunk_store: Union[None,ChunkStore] = None) -> list[list[Tuple[Document,float]]]:
+    """
+    Fuses the dense results of each query with its top-first_k lexical (BM25) results, keeping first_k candidates.
+    The documents of the lexical hits are fetched at once for all queries, see fetch_documents.
+
+    Returns:
+        list[list[Tuple[Document, float]]]: For each query, the fused candidates and their reciprocal rank fusion scores.
+    """
+    with tracing.span('retrieve.lexical'):
+        lexical_ids = [[id_ for id_,_ in lexical_index.search(query,first_k)] for query in queries]
+    unique_ids = list(dict.fromkeys(id_ for ids in lexical_ids for id_ in ids))
+    documents = {}
+    if unique_ids:
+        with tracing.span('retrieve.fetch'):
+            documents = fetch_documents(vectorstore,unique_ids,chunk_store=chunk_store)
+    return [fuse_results([[r for r,_ in dense_results],[documents[id_] for id_ in ids if id_ in documents]],first_k,rrf_k=rrf_k)
+            for dense_results,ids in zip(dense_results_per_query,lexical_ids)]
+
+def rerank(queries: list[str], results_per_query: list[list[Tuple[Document,float]]], k: int, batch_size: int = 32, early_exit_margin: Union[None,float] = None) -> list[list[Tuple[Document,float]]]:
+    """
+    Re-ranks the retrieved documents of one or more queries with the cross-encoder, in a single batched predict call.
+    Scores of (query, text) pairs found in the rerank cache are reused, only the other pairs go to the cross-encoder.
+
+    Args:
+        queries (list[str]): The queries.
+        results_per_query (list[list[Tuple[Document, float]]]): For each query, the retrieved documents and their distances.
+        k (int): The number of documents to keep per query after reranking.
+        batch_size (int, optional): Batch size of the cross-encoder. Defaults to 32.
+        early_exit_margin (float, optional): Adaptive reranking: candidates farther than this from the closest one
+            (in distance) are not reranked, see reranker.prune_candidates. A query left with a single candidate
+            still has it scored (one pair), so that every result carries a cross-encoder score. Defaults to None
+            (rerank every candidate).
+
+    Returns:
+        list[list[Tuple[Document, float]]]: For each query, the top-k documents sorted by their cross-encoder score
+            (higher is better), with or without early exit: dense distances are never returned.
+    """
+    if early_exit_margin is not None:
+        from reranker import prune_candidates
+        pruned = [prune_candidates(results_and_scores,k,early_exit_margin) for results_and_scores in results_per_query]
+        tracing.count('pairs_pruned',sum(len(r) for r in results_per_query) - sum(len(r) for r in pruned))
+        results_per_query = pruned
+    #cross encoder reranker, all (query, text) pairs of all queries in one pass
+    model_name = reranker_name()
+    pairs = [[query, r.page_content] for query,results_and_scores in zip(queries,results_per_query) for r,s in results_and_scores]
+    cross_encoder_scores = rerank_cache.get_many(model_name,pairs)
+    uncached = [i for i,score in enumerate(cross_encoder_scores) if score is None]
+    tracing.count('rerank_cache_hits',len(pairs) - len(uncached))
+    if uncached:
+        uncached_pairs = [pairs[i] for i in uncached]
+        with tracing.span('rerank.predict'):
+            uncached_scores = list(get_cross_encoder().predict(uncached_pairs,batch_size=batch_size))
+        tracing.count('pairs_reranked',len(uncached_pairs))
+        rerank_cache.put_many(model_name,uncached_pairs,uncached_scores)
+        for i,score in zip(uncached,uncached_scores):
+            cross_encoder_scores[i] = score
+    reranked = []
+    for results_and_scores in results_per_query:
+        scores,cross_encoder_scores = cross_encoder_scores[:len(results_and_scores)],cross_encoder_scores[len(results_and_scores):]
+        results_and_scores = [(r,s1) for (r,s),s1 in zip(results_and_scores,scores)]
+        reranked.append(list(sorted(results_and_scores,key=lambda el:el[1],reverse=True))[:k])
+    return reranked
+
+def _searches_by_vectors(vectorstore: VectorStore) -> bool:
+    """Whether similarity_search_by_vectors searches vectorstore with the query embeddings (rather than the texts)."""
+    if hasattr(vectorstore,'similarity_search_by_vectors_with_score'):
+        return True
+    from langchain_community.vectorstores import Chroma
+    return isinstance(vectorstore,Chroma)
+
+def _embeds_queries(vectorstore: VectorStore, semantic_cache: Union[None,SemanticCache]) -> bool:
+    # embedding up front only pays off when the vectors are used: by the semantic cache, or by the batched
+    # searches, other stores embed the query texts themselves
+    return getattr(vectorstore,'embeddings',None) is not None and (semantic_cache is not None or _searches_by_vectors(vectorstore))
+
+def similarity_search_by_vectors(vectorstore: VectorStore, vectors: list[list[float]], k: int, queries: Union[None,list[str]] = None) -> list[list[Tuple[Document,float]]]:
+    """
+    Runs the similarity searches for several query embeddings together.
+
+    Stores that implement similarity_search_by_vectors_with_score are used as is, a langchain Chroma store is
+    searched with a single collection query for all the embeddings. Any other langchain VectorStore is searched
+    one query at a time through its public API: similarity_search_with_score_by_vector on the embeddings when
+    the store has it, similarity_search_with_score on the query texts otherwise (the store embeds them), and
+    similarity_search_by_vector_with_relevance_scores when only the embeddings are given.
+
+    Args:
+        vectorstore (VectorStore): The store to search.
+        vectors (list[list[float]]): The query embeddings (None where they were not computed, see _embeds_queries).
+        k (int): The number of documents to retrieve per query.
+        queries (list[str], optional): The query texts, for the fallback on other stores.
+
+    Returns:
+        list[list[Tuple[Document, float]]]: For each query, the retrieved documents and their distances, as similarity_search_with_score returns them.
+    """
+    if hasattr(vectorstore,'similarity_search_by_vectors_with_score'):
+        return vectorstore.similarity_search_by_vectors_with_score(vectors,k=k)
+    if not _searches_by_vectors(vectorstore):
+        results_per_query = []
+        for i,vector in enumerate(vectors):
+            if vector is not None and hasattr(vectorstore,'similarity_search_with_score_by_vector'):
+                results_per_query.append(vectorstore.similarity_search_with_score_by_vector(vector,k=k))
+            elif queries is not None:
+                results_per_query.append(vectorstore.similarity_search_with_score(queries[i],k=k))
+            else:
+                results_per_query.append(vectorstore.similarity_search_by_vector_with_relevance_scores(vector,k=k))
+        return results_per_query
+    from langchain_core.documents import Document
+    results = vectorstore._collection.query(query_embeddings=vectors,n_results=k,include=['documents','metadatas','distances'])
+    return [[(Document(page_content=text,metadata=metadata or {}),distance)
+             for text,metadata,distance in zip(results['documents'][i],results['metadatas'][i],results['distances'][i])]
+            for i in range(len(vectors))]
+
+def retrieve_and_rerank_batch(queries: list[str], vectorstore: VectorStore, k: int, first_k: Union[None,int] = None, do_rerank: bool = True, batch_size: int = 32, lexical_index: Union[None,BM25Index] = None, rrf_k: int = RRF_K, early_exit_margin: Union[None,float] = None, chunk_store: Union[None,ChunkStore] = None, semantic_cache: Union[None,SemanticCache] = None) -> list[list[Tuple[Document,float]]]:
+    """
+    Batched version of retrieve_and_rerank: embeds all queries in one call, runs the similarity searches together and
+    scores every (query, candidate) pair in one batched cross-encoder pass.
+
+    The per-query results are the same as calling retrieve_and_rerank on each query (the cross-encoder scores can only
+    differ by float rounding, as the pairs are padded to a common length within a batch).
+
+    Args:
+        queries (list[str]): The search queries.
+        vectorstore (VectorStore): A vector store containing document embeddings for similarity search.
+        k (int): The number of top similar documents to retrieve per query.
+        first_k (None or int): The initial number of retrievals before reranking. If None, first_k = k. Default is None
+        do_rerank (bool): Whether to rerank with the cross-encoder. Default is True
+        batch_size (int): Batch size of the cross-encoder. Default is 32
+        lexical_index (None or bm25.BM25Index): If given, hybrid dense + lexical retrieval, as in retrieve_and_rerank. Default is None
+        rrf_k (int): The rank offset of reciprocal rank fusion. Default is 60
+        early_exit_margin (None or float): Adaptive reranking margin, as in retrieve_and_rerank. Default is None
+        chunk_store (None or chunk_store.ChunkStore): The store to rehydrate the results from, as in retrieve_and_rerank. Default is None
+        semantic_cache (None or semantic_cache.SemanticCache): Result cache, as in retrieve_and_rerank: only the queries
+            it misses are searched and reranked (in one batch). Default is None
+    Returns:
+        list[list[Tuple[Document, float]]]: For each query, the sorted list of (document, score) tuples retrieve_and_rerank returns.
+    """
+    if not queries:
+        return []
+    if first_k is None or do_rerank is False:
+        first_k = k
+    tracing.count('queries',len(queries))
+    if semantic_cache is not None:
+        key,version = _semantic_cache_key(vectorstore,k,first_k,do_rerank,lexical_index,rrf_k,early_exit_margin,chunk_store)
+        if version is None:
+            semantic_cache = None
+    vectors = [None]*len(queries)
+    if _embeds_queries(vectorstore,semantic_cache):
+        with tracing.span('retrieve.embed'):
+            vectors = vectorstore.embeddings.embed_documents(queries)
+    elif semantic_cache is not None:
+        # the store does not expose its embeddings, there is nothing to look up
+        semantic_cache = None
+    if semantic_cache is not None:
+        all_results = [semantic_cache.get(vector,key,version) for vector in vectors]
+        misses = [i for i,cached in enumerate(all_results) if cached is None]
+        tracing.count('semantic_cache_hits',len(queries) - len(misses))
+        tracing.count('semantic_cache_misses',len(misses))
+        if not misses:
+            return all_results
+        queries,vectors = [queries[i] for i in misses],[vectors[i] for i in misses]
+    with tracing.span('retrieve.search'):
+        results_per_query = similarity_search_by_vectors(vectorstore,vectors,first_k,queries=queries)
+    if lexical_index is not None:
+        results_per_query = hybrid_search(queries,results_per_query,vectorstore,lexical_index,first_k,rrf_k=rrf_k,
+                                          chunk_store=chunk_store)
+    if do_rerank:
+        with tracing.span('rerank'):
+            results_per_query = rerank(queries,results_per_query,k,batch_size=batch_size,
+                                       early_exit_margin=early_exit_margin if lexical_index is None else None)
+    if chunk_store is not None:
+        results_per_query = rehydrate(results_per_query,chunk_store)
+    if semantic_cache is not None:
+        # a query repeated within the batch is searched twice, the cache is only consulted before the batch runs
+        for i,vector,results_and_scores in zip(misses,vectors,results_per_query):
+            semantic_cache.put(vector,key,results_and_scores,version)
+            all_results[i] = results_and_scores
+        results_per_query = all_results
+    return results_per_query
+
 def retrieve_chunks(query: str, chunks: list[dict], top_k: int = 3) -> list[dict]:
     """
     Retrieve the most relevant chunks for a given query from a list of chunk dictionaries.
 
     Args:
         query (str): The search query to find relevant chunks.
-        chunks (list[dict]): A list of dictionaries containing chunk data, including 'page_content' and metadata.
+        chunks (list[dict]): A list of dictionaries containing chunk data, including 'page_content' and metadata, or a chunk_store.ChunkStore.
         top_k (int, optional): The number of top relevant chunks to return. Default is 3.
 
     Returns:
@@ -81,9 +592,9 @@ def retrieve_chunks(query: str, chunks: list[dict], top_k: int = 3) -> list[dict
             - 'original_content': The raw content of the chunk.
             - 'context': Metadata of the chunk, excluding 'raw_content'.
     """
-    vectorstore = create_vector_store(chunks,overwrite=True)
+    vectorstore = create_vector_store(chunks,incremental=True)
     #results_and_scores = vectorstore.similarity_search_with_score(query, k=top_k)
-    results_and_scores = retrieve_and_rerank(query,vectorstore,top_k)
+    results_and_scores = retrieve_and_rerank(query,vectorstore,top_k,chunk_store=chunks if hasattr(chunks,'iter_chunks') else None)
     results = [{'score':2-dist,'chunk':r.page_content, 'original_content': r.metadata['raw_content'], 'context':{k:v for k,v in r.metadata.items() if k not in ['raw_content']}} for r,dist in results_and_scores]
     return results
 
@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Union
+
+import numpy as np
+
+class SemanticCache:
+    """
+    Bounded in-memory cache of retrieval results, served to any query whose embedding is close to a cached one.
+
+    Paraphrases of a question ("How do I set up IPv4?", "How to configure IPv4?") embed close together, so once
+    one of them has been retrieved and reranked, the others can reuse its top-k without searching or reranking.
+    A lookup compares the query embedding with every cached one (a single matrix-vector product) and returns the
+    results of the most similar cached query if their cosine similarity is at least threshold. The least recently
+    used entries are evicted beyond max_entries.
+
+    Entries are stored under a key (the store and retrieval parameters, see retrieval.retrieve_and_rerank) and only
+    match lookups with the same key. Every lookup and insertion also names the version of the data behind the key
+    (see retrieval.cache_state): when it differs from the version the key's results were cached at, they are
+    dropped, so a store that changed never serves stale results, while the entries of other stores are kept.
+
+    Args:
+        threshold (float, optional): Minimum cosine similarity between a query and a cached query. Defaults to 0.95.
+        max_entries (int, optional): Maximum number of cached queries. Defaults to 1024.
+    """
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # normalized query embeddings, one row per slot, allocated on the first put
+        self._vectors = None
+        # slots in use are all below this, only they are scanned
+        self._n_slots = 0
+        # key ID of each slot, -1 for free slots
+        self._slot_keys = np.full(max_entries,-1,dtype=np.int64)
+        self._key_ids = {}
+        # key ID -> version its cached results were computed at
+        self._key_versions = {}
+        # slot -> cached results, in least recently used order
+        self._entries = OrderedDict()
+        self._free = list(range(max_entries-1,-1,-1))
+        self._lock = threading.Lock()
+
+    def _check_version(self, key_id: int, version: Hashable) -> None:
+        if self._key_versions.get(key_id,version) != version:
+            for slot in np.flatnonzero(self._slot_keys[:self._n_slots] == key_id).tolist():
+                del self._entries[slot]
+                self._slot_keys[slot] = -1
+                self._free.append(slot)
+        self._key_versions[key_id] = version
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._slot_keys[:] = -1
+        self._key_ids.clear()
+        self._key_versions.clear()
+        self._n_slots = 0
+        self._free = list(range(self.max_entries-1,-1,-1))
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector,dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector/norm if norm > 0 else vector
+
+    def get(self, vector, key: Hashable, version: Hashable = None) -> Union[None,list]:
+        """
+        Looks up the results cached for the query closest to vector, among the entries stored under key.
+
+        Args:
+            vector: The query embedding.
+            key (Hashable): The retrieval parameters the results must have been computed with.
+            version (Hashable, optional): The current version of the data behind key. Defaults to None.
+
+        Returns:
+            list or None: A copy of the cached results, None on a miss.
+        """
+        vector = self._normalize(vector)
+        with self._lock:
+            key_id = self._key_ids.get(key)
+            if key_id is not None:
+                self._check_version(key_id,version)
+            if key_id is None or self._vectors is None or self._vectors.shape[1] != len(vector):
+                self.misses += 1
+                return None
+            similarities = self._vectors[:self._n_slots] @ vector
+            similarities[self._slot_keys[:self._n_slots] != key_id] = -np.inf
+            slot = int(np.argmax(similarities))
+            if similarities[slot] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(slot)
+            return list(self._entries[slot])
+
+    def put(self, vector, key: Hashable, results: list, version: Hashable = None) -> None:
+        """Caches the results retrieved for the query embedding vector with the parameters key, at version."""
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._clear()
+                self._vectors = np.zeros((self.max_entries,len(vector)),dtype=np.float32)
+            key_id = self._key_ids.setdefault(key,len(self._key_ids))
+            self._check_version(key_id,version)
+            if not self._free:
+                slot,_ = self._entries.popitem(last=False)
+                self._slot_keys[slot] = -1
+                self._free.append(slot)
+            slot = self._free.pop()
+            self._n_slots = max(self._n_slots,slot + 1)
+            self._vectors[slot] = vector
+            self._slot_keys[slot] = key_id
+            self._entries[slot] = list(results)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits/total if total else 0.0
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, hit rate and current number of cached queries."""
+        return {'hits':self.hits,'misses':self.misses,'hit_rate':self.hit_rate,'size':len(self)}
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+import chunking
+import retrieval
+from bm25 import BM25Index
+
+class LatencyStats:
+    """
+    Rolling window of request latencies, for reporting percentiles.
+
+    Args:
+        window (int, optional): Number of most recent latencies kept. Defaults to 10000.
+    """
+    def __init__(self, window: int = 10_000):
+        self.latencies = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+
+    def percentile(self, p: float) -> Union[None,float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies)-1,int(p/100*len(latencies)))]
+
+class MicroBatcher:
+    '''
+    Gathers items submitted concurrently into batches and processes each batch with a single call.
+
+    The first item of a batch waits at most max_wait seconds for others to join, and a batch is closed early
+    once it holds max_batch_size items. Batches are processed one at a time on a worker thread, so while one
+    batch runs the next one fills up, and the event loop keeps accepting requests.
+
+    Args:
+        process_batch: Function taking a list of items and returning the list of their results.
+        max_batch_size (int, optional): Maximum number of items per batch. Defaults to 32.
+        max_wait (float, optional): Batching window in seconds. Defaults to 0.005.
+    '''
+    def __init__(self, process_batch, max_batch_size: int = 32, max_wait: float = 0.005):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.n_batches = 0
+        self.n_items = 0
+        self.max_queue_depth = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, item):
+        """Queues item and waits for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item,future))
+        self.max_queue_depth = max(self.max_queue_depth,self.queue.qsize())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),timeout))
+                except asyncio.TimeoutError:
+                    break
+            items = [item for item,_ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor,self.process_batch,items)
+            except Exception as error:
+                for _,future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.n_batches += 1
+            self.n_items += len(batch)
+            for (_,future),result in zip(batch,results):
+                if not future.done():
+                    future.set_result(result)
+
+def _result_to_dict(result, score) -> dict:
+    return {'score':float(score),
+            'chunk':result.page_content,
+            'original_content':result.metadata.get('raw_content'),
+            'context':{k:v for k,v in result.metadata.items() if k not in ['raw_content']}}
+
+class RetrievalService:
+    """
+    Resident retrieval service: keeps the vector store and cross-encoder warm and serves queries over HTTP.
+
+    Concurrent requests are micro-batched (see MicroBatcher) and each batch goes through
+    retrieval.retrieve_and_rerank_batch, so reranking runs as batched inference. Endpoints:
+
+    - POST /query with a JSON body {"query": ..., "k": 1, "first_k": 4, "do_rerank": true}, returns the
+      results in the format of retrieval.retrieve_chunks. Malformed bodies get a 400 (see parse_request).
+    - GET /metrics, returns p50/p99 latency, current and max queue depth, and batching counters.
+
+    Args:
+        vectorstore (VectorStore): The store to query.
+        max_batch_size (int, optional): Maximum number of queries per batch. Defaults to 32.
+        max_wait (float, optional): Batching window in seconds. Defaults to 0.005.
+        first_k (int, optional): Default number of candidates to rerank. Defaults to 4.
+        do_rerank (bool, optional): Default for whether to rerank. Defaults to True.
+        lexical_index (bm25.BM25Index, optional): If given, candidates are retrieved in hybrid dense + lexical mode. Defaults to None.
+        early_exit_margin (float, optional): Adaptive reranking margin, see retrieval.rerank. Defaults to None.
+    """
+    def __init__(self, vectorstore, max_batch_size: int = 32, max_wait: float = 0.005, first_k: int = 4, do_rerank: bool = True, lexical_index=None, early_exit_margin: Union[None,float] = None):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.early_exit_margin = early_exit_margin
+        self.first_k = first_k
+        self.do_rerank = do_rerank
+        self.batcher = MicroBatcher(self._process_batch,max_batch_size=max_batch_size,max_wait=max_wait)
+        self.latency = LatencyStats()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.server = None
+
+    def _process_batch(self, requests: list[dict]) -> list[list[dict]]:
+        # queries sharing the same retrieval parameters are served by one batched call
+        groups = {}
+        for i,request in enumerate(requests):
+            params = (request['k'],request['first_k'],request['do_rerank'])
+            groups.setdefault(params,[]).append(i)
+        results = [None]*len(requests)
+        for (k,first_k,do_rerank),indices in groups.items():
+            batch_results = retrieval.retrieve_and_rerank_batch([requests[i]['query'] for i in indices],self.vectorstore,
+                                                                k=k,first_k=first_k,do_rerank=do_rerank,
+                                                                lexical_index=self.lexical_index,
+                                                                early_exit_margin=self.early_exit_margin)
+            for i,results_and_scores in zip(indices,batch_results):
+                results[i] = [_result_to_dict(r,s) for r,s in results_and_scores]
+        return results
+
+    def metrics(self) -> dict:
+        p50,p99 = self.latency.percentile(50),self.latency.percentile(99)
+        return {'requests':self.n_requests,
+                'errors':self.n_errors,
+                'p50_ms':None if p50 is None else p50*1000,
+                'p99_ms':None if p99 is None else p99*1000,
+                'queue_depth':self.batcher.queue.qsize(),
+                'max_queue_depth':self.batcher.max_queue_depth,
+                'batches':self.batcher.n_batches,
+                'mean_batch_size':self.batcher.n_items/self.batcher.n_batches if self.batcher.n_batches else None}
+
+    def parse_request(self, request) -> dict:
+        """
+        Validates a /query body and fills in the defaults.
+
+        Raises:
+            ValueError: If the body is not an object with a "query" string, if "k" or "first_k" is not a positive
+                integer, or if "do_rerank" is neither a JSON boolean nor "true"/"false".
+        """
+        if not isinstance(request,dict) or not isinstance(request.get('query'),str):
+            raise ValueError('expected a JSON body with a "query" string')
+        parsed = {'query':request['query']}
+        for name,default in [('k',1),('first_k',self.first_k)]:
+            value = request.get(name,default)
+            # bool is an int subclass, but true/false are not counts
+            if not isinstance(value,int) or isinstance(value,bool) or value < 1:
+                raise ValueError(f'"{name}" must be a positive integer, got {value!r}')
+            parsed[name] = value
+        do_rerank = request.get('do_rerank',self.do_rerank)
+        if isinstance(do_rerank,str) and do_rerank.lower() in ('true','false'):
+            do_rerank = do_rerank.lower() == 'true'
+        if not isinstance(do_rerank,bool):
+            raise ValueError(f'"do_rerank" must be true or false, got {do_rerank!r}')
+        parsed['do_rerank'] = do_rerank
+        return parsed
+
+    async def query(self, request: dict) -> dict:
+        """Answers a /query body already validated by parse_request."""
+        start = time.perf_counter()
+        results = await self.batcher.submit(request)
+        latency = time.perf_counter() - start
+        self.latency.add(latency)
+        return {'results':results,'latency_ms':latency*1000}
+
+    async def _respond(self, method: str, path: str, body: bytes) -> tuple[int,dict]:
+        if method == 'GET' and path == '/metrics':
+            return 200,self.metrics()
+        if method == 'POST' and path == '/query':
+            self.n_requests += 1
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return 400,{'error':'invalid JSON body'}
+            try:
+                request = self.parse_request(request)
+            except ValueError as error:
+                return 400,{'error':str(error)}
+            try:
+                return 200,await self.query(request)
+            except Exception as error:
+                self.n_errors += 1
+                return 500,{'error':repr(error)}
+        return 404,{'error':f'no route for {method} {path}'}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # minimal HTTP/1.1 with keep-alive, enough for JSON requests from curl or the load generator
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method,path,_ = request_line.decode('latin-1').split(' ',2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n',b'\n',b''):
+                        break
+                    name,_,value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length',0)))
+                status,payload = await self._respond(method,path,body)
+                data = json.dumps(payload).encode('utf-8')
+                keep_alive = headers.get('connection','keep-alive').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                             f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError,asyncio.IncompleteReadError,ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080, unix_socket: Union[None,str] = None):
+        """Starts the batcher and listens on host:port, or on unix_socket if given."""
+        self.batcher.start()
+        if unix_socket is not None:
+            self.server = await asyncio.start_unix_server(self._handle_connection,path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self._handle_connection,host=host,port=port)
+        return self.server
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+
+async def serve(synthetic: bool = False,
+                host: str = '127.0.0.1',
+                port: int = 8080,
+                unix_socket: Union[None,str] = None,
+                max_batch_size: int = 32,
+                batch_window_ms: float = 5.0,
+                first_k: int = 4,
+                do_rerank: bool = True,
+                backend: str = 'chroma',
+                hybrid: bool = False,
+                rerank_engine: str = 'fp32',
+                rerank_threads: Union[None,int] = None,
+                early_exit_margin: Union[None,float] = None) -> None:
+    document_fname = 'data/document.json'
+    if synthetic:
+        document_fname = 'data/synthetic_document.json'
+    lexical_index = BM25Index() if hybrid else None
+    with open(document_fname,'r') as f:
+        chunks = chunking.process_document(json.load(f),lexical_index=lexical_index)
+    # load everything once, before accepting requests
+    vectorstore = retrieval.create_vector_store(chunks,incremental=True,backend=backend,lexical_index=lexical_index)
+    if do_rerank:
+        retrieval.configure_reranker(rerank_engine,num_threads=rerank_threads)
+        retrieval.get_cross_encoder()
+    service = RetrievalService(vectorstore,max_batch_size=max_batch_size,max_wait=batch_window_ms/1000,
+                               first_k=first_k,do_rerank=do_rerank,lexical_index=lexical_index,
+                               early_exit_margin=early_exit_margin)
+    server = await service.start(host=host,port=port,unix_socket=unix_socket)
+    print(f'serving retrieval on {unix_socket or f"http://{host}:{port}"}')
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='resident retrieval service with request micro-batching')
+    parser.add_argument('--synthetic',action='store_true',default=False,help="serve the synthetic document. default is to use the document provided in the problem statement")
+    parser.add_argument('--host',default='127.0.0.1',type=str,help="host to listen on. Default 127.0.0.1")
+    parser.add_argument('--port',default=8080,type=int,help="port to listen on. Default 8080")
+    parser.add_argument('--unix_socket',default=None,type=str,help="listen on this unix socket instead of host:port")
+    parser.add_argument('--max_batch_size',default=32,type=int,help="maximum number of queries per batch. Default 32")
+    parser.add_argument('--batch_window_ms',default=5.0,type=float,help="how long a query waits for others to batch with. Default 5")
+    parser.add_argument('--first_k',default=4,type=int,help="default number of candidates to rerank. Default 4")
+    parser.add_argument('--do_rerank',default=True,type=lambda t:t.lower()=='true',help="whether to do reranking by default. Default true")
+    parser.add_argument('--backend',default='chroma',choices=['chroma','numpy','ivf'],help="vector store backend. Default chroma")
+    parser.add_argument('--hybrid',action='store_true',default=False,help="fuse dense and BM25 lexical candidates before reranking")
+    parser.add_argument('--rerank_engine',default='fp32',choices=['fp32','int8'],help="cross-encoder engine, int8 is dynamically quantized for CPU. Default fp32")
+    parser.add_argument('--rerank_threads',default=None,type=int,help="CPU threads of the cross-encoder. Default one per core")
+    parser.add_argument('--early_exit_margin',default=None,type=float,help="skip reranking candidates farther than this from the closest one. Default none")
+    args = parser.parse_args()
+    asyncio.run(serve(**vars(args)))
@@ -0,0 +1,152 @@
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import chunking
+from ingest import RateLimitError
+from local_embeddings import HashingEmbeddings
+
+class StubEmbeddingServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the OpenAI embeddings endpoint, for benchmarking ingestion without network.
+
+    Serves POST /v1/embeddings in the OpenAI request/response format using HashingEmbeddings. Every request
+    sleeps for latency + latency_per_token * tokens, and is answered with a 429 (and a Retry-After header)
+    with probability error_rate, or whenever more than max_concurrent requests are already being served.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        latency (float): Fixed latency per request, in seconds.
+        latency_per_token (float): Additional latency per (estimated) input token, in seconds.
+        error_rate (float): Probability of answering a request with a 429.
+        max_concurrent (int or None): Concurrent requests allowed before answering with 429s.
+        retry_after (float): Value of the Retry-After header on 429s, in seconds.
+        seed (int): Seed for the injected errors.
+    """
+    daemon_threads = True
+
+    def __init__(self,
+                 port: int = 0,
+                 latency: float = 0.05,
+                 latency_per_token: float = 0.0,
+                 error_rate: float = 0.0,
+                 max_concurrent: int = None,
+                 retry_after: float = 0.1,
+                 seed: int = 0):
+        super().__init__(('127.0.0.1',port),_Handler)
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.error_rate = error_rate
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.embeddings = HashingEmbeddings()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.n_active = 0
+        self.n_requests = 0
+        self.n_rate_limited = 0
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1/embeddings'
+
+    def start(self) -> 'StubEmbeddingServer':
+        """Serves requests on a daemon thread and returns the server."""
+        threading.Thread(target=self.serve_forever,daemon=True).start()
+        return self
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict, headers: dict = {}):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        for k,v in headers.items():
+            self.send_header(k,v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        texts = request['input']
+        if isinstance(texts,str):
+            texts = [texts]
+        with server.lock:
+            server.n_requests += 1
+            throttled = (server.random.random() < server.error_rate
+                         or (server.max_concurrent is not None and server.n_active >= server.max_concurrent))
+            if throttled:
+                server.n_rate_limited += 1
+            else:
+                server.n_active += 1
+        if throttled:
+            self._reply(429,{'error':{'message':'Rate limit reached','type':'requests'}},
+                        headers={'Retry-After':str(server.retry_after)})
+            return
+        try:
+            n_tokens = sum(chunking.estimate_tokens(t) for t in texts)
+            time.sleep(server.latency + server.latency_per_token*n_tokens)
+            vectors = server.embeddings.embed_documents(texts)
+        finally:
+            with server.lock:
+                server.n_active -= 1
+        self._reply(200,{'object':'list',
+                         'model':request.get('model',server.embeddings.model),
+                         'data':[{'object':'embedding','index':i,'embedding':v} for i,v in enumerate(vectors)],
+                         'usage':{'prompt_tokens':n_tokens,'total_tokens':n_tokens}})
+
+class HTTPEmbeddings:
+    """
+    Minimal client for an OpenAI compatible embeddings endpoint, such as StubEmbeddingServer.
+
+    Unlike the openai client it does not retry on its own: a 429 is raised as ingest.RateLimitError so that
+    the retry and backoff behavior of the ingestion pipeline is what gets measured.
+
+    Args:
+        url (str): Full URL of the embeddings endpoint.
+        model (str, optional): Model name sent with every request.
+        timeout (float, optional): Request timeout in seconds.
+    """
+    def __init__(self, url: str, model: str = 'text-embedding-3-small', timeout: float = 60.0):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        request = urllib.request.Request(self.url,
+                                         data=json.dumps({'input':texts,'model':self.model}).encode('utf-8'),
+                                         headers={'Content-Type':'application/json'})
+        try:
+            with urllib.request.urlopen(request,timeout=self.timeout) as response:
+                data = json.loads(response.read())['data']
+        except urllib.error.HTTPError as error:
+            if error.code == 429:
+                retry_after = error.headers.get('Retry-After')
+                raise RateLimitError(retry_after=float(retry_after) if retry_after else None) from None
+            raise
+        return [d['embedding'] for d in sorted(data,key=lambda d:d['index'])]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local stub of the OpenAI embeddings endpoint, with injected latency and 429s')
+    parser.add_argument('--port',default=8765,type=int,help="port to listen on. Default 8765")
+    parser.add_argument('--latency',default=0.05,type=float,help="fixed latency per request in seconds. Default 0.05")
+    parser.add_argument('--latency_per_token',default=0.0,type=float,help="additional latency per input token in seconds. Default 0")
+    parser.add_argument('--error_rate',default=0.0,type=float,help="probability of answering with a 429. Default 0")
+    parser.add_argument('--max_concurrent',default=None,type=int,help="concurrent requests served before answering with 429s. Default unlimited")
+    parser.add_argument('--retry_after',default=0.1,type=float,help="Retry-After sent with 429s, in seconds. Default 0.1")
+    args = parser.parse_args()
+    server = StubEmbeddingServer(**vars(args))
+    print(f'serving stub embeddings on {server.url}')
+    server.serve_forever()
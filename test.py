@@ -1,7 +1,31 @@
 #TODO run this with unittest test runner or some other repo
+import ast
+import bm25
+import bulk_ingest
+import chunk_store
 import chunking
 import retrieval
+import embedding_cache
+import ingest
+import ivf_index
+import local_embeddings
+import numpy_store
+import rerank_cache
+import reranker
+import semantic_cache
+import service
+import tracing
+import json
+import asyncio
+import io
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
+from benchmarks import harness, loadgen, synthetic
 class TestCase(unittest.TestCase):
     def test_table_chunking(self):
         '''
@@ -81,6 +105,665 @@ class TestCase(unittest.TestCase):
         assert len(chunks) == len(expected_chunks)
         for c_expected,c_found in zip(expected_chunks,chunks):
             assert c_expected == c_found, c_found
+    def test_chunk_ids(self):
+        '''
+        Tests that process_document gives every chunk a stable content-hash ID: unchanged chunks keep their ID
+        across runs, and only the edited chunk gets a new one.
+        '''
+        #...........................................................................
+        document = {
+            'title': 'Manual',
+            'sections':[
+                {'title': 'Install', 'content': 'Run the installer.'},
+                {'title': 'Uninstall', 'content': 'Run the uninstaller.'},
+            ]
+        }
+        #...........................................................................
+        ids = [c['id'] for c in chunking.process_document(document)]
+        self.assertEqual(ids, [c['id'] for c in chunking.process_document(document)])
+        self.assertEqual(len(set(ids)), 2)
+
+        document['sections'][1]['content'] = 'Run the uninstaller as admin.'
+        new_ids = [c['id'] for c in chunking.process_document(document)]
+        self.assertEqual(new_ids[0], ids[0])
+        self.assertNotEqual(new_ids[1], ids[1])
+    def test_streaming_chunking(self):
+        '''
+        Tests that iter_process_document, which parses the JSON incrementally, yields the same chunks as process_document
+        on the bundled documents.
+        '''
+        for document_fname in ['data/document.json','data/synthetic_document.json']:
+            with open(document_fname,'r') as f:
+                expected_chunks = chunking.process_document(json.load(f))
+            with open(document_fname,'rb') as f:
+                chunks = chunking.iter_process_document(f)
+                self.assertFalse(isinstance(chunks,list))
+                self.assertEqual(list(chunks), expected_chunks)
+            with open(document_fname,'r') as f:
+                expected_chunks = chunking.process_document(json.load(f),N_MAX_TABLE_ROWS=2)
+            self.assertEqual(list(chunking.iter_process_document(document_fname,N_MAX_TABLE_ROWS=2)), expected_chunks)
+        # anchors after the sections: the chunks come in another order, but with the same metadata and IDs
+        document = {'title':'A',
+                    'sections':[{'title':'B','subsections':[{'title':'C','content':'z'}],'code_block':'print(1)'},
+                                {'title':'D','content':'w'}],
+                    'content':'y'}
+        expected_chunks = chunking.process_document(document)
+        chunks = list(chunking.iter_process_document(io.BytesIO(json.dumps(document).encode())))
+        key = lambda chunk:chunk['id']
+        self.assertEqual(sorted(chunks,key=key), sorted(expected_chunks,key=key))
+        metadata = {c['metadata']['raw_content']:c['metadata'] for c in chunks}
+        self.assertEqual((metadata['print(1)'].get('section'),metadata['y'].get('section')), ('B',None))
+    def test_embedding_cache(self):
+        '''
+        Tests that the embedding cache only sends unseen texts to the wrapped embedder, survives a restart
+        (it is disk backed), and evicts the least recently used vectors beyond its size cap.
+        '''
+        class CountingEmbeddings(local_embeddings.HashingEmbeddings):
+            n_embedded = 0
+            def embed_documents(self, texts):
+                CountingEmbeddings.n_embedded += len(texts)
+                return super().embed_documents(texts)
+        texts = ['The sky is blue', 'The grass is green', 'Roses are red']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir,'cache.sqlite')
+            cache = embedding_cache.CachedEmbeddings(CountingEmbeddings(),model_name='hashing',path=path,max_entries=3)
+            vectors = cache.embed_documents(texts)
+            self.assertEqual(CountingEmbeddings.n_embedded, 3)
+
+            cache = embedding_cache.CachedEmbeddings(CountingEmbeddings(),model_name='hashing',path=path,max_entries=3)
+            self.assertEqual(cache.embed_documents(texts), vectors)
+            self.assertEqual(CountingEmbeddings.n_embedded, 3)
+            self.assertEqual(cache.stats()['hit_rate'], 1.0)
+
+            # 'The sky is blue' was used last, 'The grass is green' is the LRU entry and gets evicted
+            cache.embed_documents(['Roses are red', 'The sky is blue'])
+            cache.embed_documents(['Violets are blue'])
+            self.assertEqual(len(cache), 3)
+            cache.embed_documents(['The sky is blue', 'Roses are red'])
+            self.assertEqual(CountingEmbeddings.n_embedded, 4)
+            cache.embed_documents(['The grass is green'])
+            self.assertEqual(CountingEmbeddings.n_embedded, 5)
+    def test_ingest_chunks(self):
+        '''
+        Tests that the ingestion pipeline splits chunks into token-budgeted batches, recovers from rate limited
+        requests, and writes every chunk into the store with its vector.
+        '''
+        class FlakyEmbeddings(local_embeddings.HashingEmbeddings):
+            n_calls = 0
+            def embed_documents(self, texts):
+                FlakyEmbeddings.n_calls += 1
+                if FlakyEmbeddings.n_calls % 3 == 1:
+                    raise ingest.RateLimitError(retry_after=0.01)
+                return super().embed_documents(texts)
+        class Store:
+            def __init__(self):
+                self.vectors = {}
+            def add_embeddings(self, ids, texts, metadatas, embeddings):
+                self.vectors.update(zip(ids,embeddings))
+        chunks = [{'id':str(i),'text':'word '*(40*(i%5)),'metadata':{}} for i in range(50)]
+        #...........................................................................
+        batches = list(ingest.token_batches(chunks,max_tokens=100))
+        self.assertEqual([c for b in batches for c in b], chunks)
+        for b in batches:
+            self.assertTrue(len(b) == 1 or sum(chunking.estimate_tokens(c['text']) for c in b) <= 100)
+
+        store = Store()
+        stats = ingest.ingest_chunks(chunks,store,FlakyEmbeddings(),max_tokens=100,max_workers=3,base_delay=0.001)
+        self.assertEqual(stats['chunks'], len(chunks))
+        self.assertGreater(stats['rate_limited'], 0)
+        expected = local_embeddings.HashingEmbeddings().embed_documents([c['text'] for c in chunks])
+        self.assertEqual([store.vectors[c['id']] for c in chunks], expected)
+    def test_retrieve_and_rerank_batch(self):
+        '''
+        Tests that the batched retrieval path returns the same per-query results as the sequential one, and that it
+        scores all the (query, candidate) pairs in a single cross-encoder call.
+        '''
+        class OverlapCrossEncoder:
+            n_calls = 0
+            def predict(self, pairs, batch_size=32):
+                OverlapCrossEncoder.n_calls += 1
+                return [len(set(q.lower().split()) & set(t.lower().split())) + 1/len(t) for q,t in pairs]
+        with open('data/queries.json','r') as f:
+            queries = json.load(f)['queries']
+        with open('data/document.json','r') as f:
+            chunks = chunking.process_document(json.load(f))
+        cache = retrieval.rerank_cache
+        retrieval.models.set('cross_encoder',OverlapCrossEncoder())
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                vectorstore = retrieval.create_vector_store(chunks,embeddings=local_embeddings.HashingEmbeddings(),persist_directory=tmpdir)
+                retrieval.rerank_cache = rerank_cache.RerankCache('overlap')
+                sequential = [retrieval.retrieve_and_rerank(q,vectorstore,k=2,first_k=4) for q in queries]
+                retrieval.rerank_cache = rerank_cache.RerankCache('overlap')
+                OverlapCrossEncoder.n_calls = 0
+                batched = retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=2,first_k=4)
+        finally:
+            retrieval.models.reset('cross_encoder')
+            retrieval.rerank_cache = cache
+        self.assertEqual(OverlapCrossEncoder.n_calls, 1)
+        self.assertEqual([[(r.page_content,s) for r,s in rs] for rs in batched],
+                         [[(r.page_content,s) for r,s in rs] for rs in sequential])
+    def test_rerank_cache(self):
+        '''
+        Tests that the rerank cache serves scores for normalized repeats of a query, expires them after the TTL,
+        evicts the least recently used pairs, and is invalidated when the reranker model changes.
+        '''
+        now = [0.0]
+        cache = rerank_cache.RerankCache('model-a',max_entries=2,ttl=10,clock=lambda:now[0])
+        cache.put_many('model-a',[('How do I configure IPv4?','chunk 1'),('How do I configure IPv4?','chunk 2')],[0.5,0.25])
+        self.assertEqual(cache.get_many('model-a',[('how do I  configure ipv4?','chunk 2'),('How do I configure IPv4?','chunk 3')]), [0.25,None])
+        self.assertEqual(cache.hit_rate, 0.5)
+
+        cache.put_many('model-a',[('How do I configure IPv4?','chunk 3')],[0.125])
+        self.assertEqual(cache.get_many('model-a',[('How do I configure IPv4?','chunk 1')]), [None])
+
+        now[0] = 11
+        self.assertEqual(cache.get_many('model-a',[('How do I configure IPv4?','chunk 3')]), [None])
+
+        cache.put_many('model-a',[('q','chunk')],[1.0])
+        self.assertEqual(cache.get_many('model-b',[('q','chunk')]), [None])
+        self.assertEqual(len(cache), 0)
+    def test_lazy_imports(self):
+        '''
+        Tests that importing retrieval (and hence the chunking-only code paths) does not load the heavy model
+        and vector store dependencies, nor read the secrets file. These are loaded on first use.
+        '''
+        code = 'import retrieval,sys; print(sorted(m for m in ["langchain_community","chromadb","sentence_transformers","torch","numpy"] if m in sys.modules))'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # run from a directory without secrets.json
+            output = subprocess.run([sys.executable,'-c',code],cwd=tmpdir,capture_output=True,text=True,check=True,
+                                    env=dict(os.environ,PYTHONPATH=os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(output.stdout.strip(), '[]')
+    def test_service_micro_batching(self):
+        '''
+        Tests that the retrieval service answers concurrent HTTP queries with the same results as retrieve_and_rerank,
+        serving them in fewer (micro-batched) reranking passes, and reports its metrics.
+        '''
+        class OverlapCrossEncoder:
+            def predict(self, pairs, batch_size=32):
+                return [len(set(q.lower().split()) & set(t.lower().split())) + 1/len(t) for q,t in pairs]
+        with open('data/queries.json','r') as f:
+            queries = json.load(f)['queries']
+        with open('data/document.json','r') as f:
+            chunks = chunking.process_document(json.load(f))
+
+        async def run(vectorstore):
+            retrieval_service = service.RetrievalService(vectorstore,max_wait=0.05)
+            server = await retrieval_service.start(port=0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                responses = await asyncio.gather(*[loadgen.request('POST','/query',{'query':q,'k':2},port=port) for q in queries])
+                _,metrics = await loadgen.request('GET','/metrics',port=port)
+                malformed = [await loadgen.request('POST','/query',body,port=port)
+                             for body in [{'query':'q','k':'2'},{'query':'q','k':True},{'query':'q','first_k':0},
+                                          {'query':'q','do_rerank':'no'},['q']]]
+            finally:
+                await retrieval_service.stop()
+            return responses,metrics,malformed
+
+        cache = retrieval.rerank_cache
+        retrieval.models.set('cross_encoder',OverlapCrossEncoder())
+        retrieval.rerank_cache = rerank_cache.RerankCache('overlap')
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                vectorstore = retrieval.create_vector_store(chunks,embeddings=local_embeddings.HashingEmbeddings(),persist_directory=tmpdir)
+                responses,metrics,malformed = asyncio.run(run(vectorstore))
+                expected = [retrieval.retrieve_and_rerank(q,vectorstore,k=2,first_k=4) for q in queries]
+        finally:
+            retrieval.models.reset('cross_encoder')
+            retrieval.rerank_cache = cache
+        self.assertEqual([status for status,_ in responses], [200]*len(queries))
+        self.assertEqual([[r['chunk'] for r in response['results']] for _,response in responses],
+                         [[r.page_content for r,_ in results] for results in expected])
+        self.assertEqual(metrics['requests'], len(queries))
+        self.assertLess(metrics['batches'], len(queries))
+        self.assertIsNotNone(metrics['p99_ms'])
+        self.assertEqual([status for status,_ in malformed], [400]*5)
+        self.assertTrue(all('error' in response for _,response in malformed))
+        parse = service.RetrievalService(vectorstore).parse_request
+        self.assertIs(parse({'query':'q','do_rerank':'false'})['do_rerank'], False)
+        self.assertEqual(parse({'query':'q','k':3,'do_rerank':True}), {'query':'q','k':3,'first_k':4,'do_rerank':True})
+    def test_numpy_vector_store(self):
+        '''
+        Tests that the NumPy backend is a drop-in for Chroma: same rankings and (squared L2) distances on the bundled
+        queries, incremental updates through create_vector_store, and a memory-mapped reload of the persisted store.
+        '''
+        with open('data/synthetic_document.json','r') as f:
+            chunks = chunking.process_document(json.load(f))
+        with open('data/queries_for_synthetic.json','r') as f:
+            queries = json.load(f)['queries']
+        embeddings = local_embeddings.HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chroma = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=os.path.join(tmpdir,'chroma'))
+            numpy_dir = os.path.join(tmpdir,'numpy')
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=numpy_dir,backend='numpy')
+            self.assertIsInstance(vectorstore, numpy_store.NumpyVectorStore)
+            for query in queries:
+                expected = chroma.similarity_search_with_score(query,k=3)
+                found = vectorstore.similarity_search_with_score(query,k=3)
+                self.assertEqual([r.page_content for r,_ in found], [r.page_content for r,_ in expected])
+                for (_,d_found),(_,d_expected) in zip(found,expected):
+                    self.assertAlmostEqual(d_found, d_expected, places=4)
+
+            edited = chunks[:-1] + [dict(chunks[-1],text=chunks[-1]['text']+' (edited)',id='edited')]
+            retrieval.create_vector_store(edited,embeddings=embeddings,persist_directory=numpy_dir,backend='numpy',incremental=True)
+            reloaded = numpy_store.NumpyVectorStore(embeddings,persist_directory=numpy_dir,mmap=True)
+            self.assertEqual(sorted(reloaded.get()['ids']), sorted(c['id'] for c in edited))
+            self.assertEqual(reloaded.similarity_search(edited[-1]['text'],k=1)[0].page_content, edited[-1]['text'])
+    def test_ivf_index(self):
+        '''
+        Tests the IVF backend against exact search on a scaled synthetic corpus: exact when probing every list,
+        good recall at a moderate nprobe, including for vectors inserted after training, and a reload of the index.
+        '''
+        embeddings = local_embeddings.HashingEmbeddings()
+        chunks = chunking.process_document(synthetic.scale_document(100))
+        with open('data/queries_for_synthetic.json','r') as f:
+            queries = embeddings.embed_documents(synthetic.perturbed_queries(json.load(f)['queries'],50))
+        exact = numpy_store.NumpyVectorStore(embeddings)
+        exact.add_texts([c['text'] for c in chunks],ids=[c['id'] for c in chunks])
+        kth_distances = exact.search(queries,4)[1][:,-1:]
+        def recall(store, nprobe):
+            # tolerant to ties: a result counts if it is no farther than the exact k-th nearest neighbor
+            distances = store.search(queries,4,nprobe=nprobe)[1]
+            return (distances <= kth_distances + 1e-5).mean()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            n_first = len(chunks)//2
+            vectorstore = retrieval.create_vector_store(chunks[:n_first],embeddings=embeddings,persist_directory=tmpdir,backend='ivf')
+            vectorstore.train()
+            vectorstore.save()
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=tmpdir,backend='ivf',incremental=True)
+            self.assertIsInstance(vectorstore, ivf_index.IVFVectorStore)
+            self.assertTrue(vectorstore.is_trained)
+            self.assertEqual(recall(vectorstore,vectorstore.n_lists), 1.0)
+            self.assertGreaterEqual(recall(vectorstore,vectorstore.n_lists//2), 0.9)
+            # one query at a time takes the per-query scan
+            self.assertEqual([vectorstore.search(queries[:1],4,nprobe=5)[0][0].tolist()],
+                             vectorstore.search(queries[:ivf_index.IVFVectorStore.PER_QUERY_SCAN],4,nprobe=5)[0][:1].tolist())
+            reloaded = ivf_index.IVFVectorStore(embeddings,persist_directory=tmpdir)
+            self.assertTrue(reloaded.is_trained)
+            self.assertEqual(recall(reloaded,reloaded.n_lists), 1.0)
+            self.assertEqual(reloaded.similarity_search(chunks[-1]['text'],k=1)[0].page_content, chunks[-1]['text'])
+    def test_hybrid_retrieval(self):
+        '''
+        Tests the BM25 index built during chunking: identifier-preserving tokenization, exact-identifier queries
+        reaching the candidates in hybrid mode, and the index being kept in sync with and saved next to the store.
+        '''
+        self.assertEqual(bm25.tokenize("What does config.set_ip('192.168.1.1') do?"),
+                         ['config.set_ip','config','set','ip','192.168.1.1','192','168','1','1'])
+        with open('data/document.json','r') as f:
+            document = json.load(f)
+        lexical_index = bm25.BM25Index()
+        chunks = chunking.process_document(document,lexical_index=lexical_index)
+        self.assertEqual(len(lexical_index), len(chunks))
+        code_chunk = next(c for c in chunks if 'config.set_ip' in c['text'])
+        self.assertEqual(lexical_index.search('config.set_ip',1)[0][0], code_chunk['id'])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            vectorstore = retrieval.create_vector_store(chunks,embeddings=local_embeddings.HashingEmbeddings(),persist_directory=tmpdir,
+                                                        backend='numpy',lexical_index=lexical_index)
+            query = 'Where is config.set_ip used?'
+            results = retrieval.retrieve_and_rerank(query,vectorstore,k=2,first_k=2,do_rerank=False,lexical_index=lexical_index)
+            self.assertIn(code_chunk['text'], [r.page_content for r,_ in results])
+            batched = retrieval.retrieve_and_rerank_batch([query],vectorstore,k=2,first_k=2,do_rerank=False,lexical_index=lexical_index)[0]
+            self.assertEqual([(r.page_content,s) for r,s in batched], [(r.page_content,s) for r,s in results])
+
+            # an incremental update drops the stale chunk from the saved index too
+            retrieval.create_vector_store(chunks[1:],embeddings=local_embeddings.HashingEmbeddings(),persist_directory=tmpdir,
+                                          backend='numpy',incremental=True,lexical_index=lexical_index)
+            reloaded = retrieval.load_lexical_index(tmpdir)
+            self.assertEqual(reloaded.ids, [c['id'] for c in chunks[1:]])
+            self.assertEqual(reloaded.search('config.set_ip',1), lexical_index.search('config.set_ip',1))
+
+        # stores without get: documents resolved through get_by_ids, or the chunk store, or a clear error
+        from langchain_core.vectorstores import InMemoryVectorStore
+        class OpaqueVectorStore(InMemoryVectorStore):
+            def __getattribute__(self, name):
+                if name == 'get_by_ids':
+                    raise AttributeError(name)
+                return super().__getattribute__(name)
+        store = chunking.process_document(document,as_store=True)
+        for vectorstore_class in [InMemoryVectorStore,OpaqueVectorStore]:
+            vectorstore = vectorstore_class(local_embeddings.HashingEmbeddings())
+            slim = list(store.iter_chunks(slim=True))
+            vectorstore.add_texts([c['text'] for c in slim],metadatas=[c['metadata'] for c in slim],ids=[c['id'] for c in slim])
+            if vectorstore_class is InMemoryVectorStore:
+                results = retrieval.retrieve_and_rerank(query,vectorstore,k=2,first_k=2,do_rerank=False,lexical_index=lexical_index)
+                self.assertIn(code_chunk['text'], [r.page_content for r,_ in results])
+            else:
+                with self.assertRaises(ValueError):
+                    retrieval.retrieve_and_rerank(query,vectorstore,k=2,first_k=2,do_rerank=False,lexical_index=lexical_index)
+            results = retrieval.retrieve_and_rerank(query,vectorstore,k=2,first_k=2,do_rerank=False,lexical_index=lexical_index,chunk_store=store)
+            self.assertIn(code_chunk, [{'text':r.page_content,'metadata':r.metadata,'id':code_chunk['id']} for r,_ in results])
+    def test_evaluation_harness(self):
+        '''
+        Tests that every gold label matches a chunk of its document, and the recall@k / MRR computation.
+        '''
+        for entry in harness.load_gold_labels().values():
+            with open(entry['document'],'r') as f:
+                chunks = chunking.process_document(json.load(f))
+            for label in entry['labels']:
+                for relevant in label['relevant']:
+                    self.assertTrue(any(harness.is_relevant(c['text'],c['metadata'],relevant) for c in chunks), (label['query'],relevant))
+        labels = [[{'section':'A','contains':'x'}],[{'section':'B','contains':'y'},{'section':'B','contains':'z'}]]
+        rankings = [[('no',{'section':'A'}),('x1',{'section':'A'})],[('y',{'section':'B'}),('x',{'section':'A'})]]
+        metrics = harness.ranking_metrics(rankings,labels,ks=[1,2])
+        self.assertEqual(metrics, {'recall@1':0.25,'recall@2':0.75,'mrr':0.75})
+    def test_tracing(self):
+        '''
+        Tests that spans and counters are recorded across chunking, ingestion and retrieval when tracing is enabled,
+        nothing is recorded while it is disabled, and the exporters' output.
+        '''
+        with open('data/document.json','r') as f:
+            document = json.load(f)
+        embeddings = local_embeddings.HashingEmbeddings()
+        tracer = tracing.tracer
+        tracer.reset()
+        chunking.process_document(document)
+        self.assertEqual(tracer.snapshot(), {'spans':{},'counters':{}})
+        prometheus = tracing.PrometheusExporter()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                tracing.enable([prometheus,tracing.JSONFileExporter(os.path.join(tmpdir,'trace.jsonl'))])
+                chunks = chunking.process_document(document)
+                vectorstore = retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=tmpdir,backend='numpy')
+                retrieval.retrieve_and_rerank('What is the default firewall setting?',vectorstore,k=1,do_rerank=False)
+                tracer.export()
+            finally:
+                tracing.disable()
+                tracer.exporters = []
+            snapshot = tracer.snapshot()
+            tracer.reset()
+            with open(os.path.join(tmpdir,'trace.jsonl'),'r') as f:
+                self.assertEqual(json.loads(f.readline())['counters'], snapshot['counters'])
+        for name in ['chunking.flatten','chunking.standardize','ingest','ingest.embed','ingest.write','retrieve.embed','retrieve.search']:
+            self.assertEqual(snapshot['spans'][name]['calls'], 1)
+        self.assertEqual(snapshot['counters'], {'chunks_produced':len(chunks),'chunks_embedded':len(chunks),
+                                                'tokens_embedded':sum(chunking.estimate_tokens(c['text']) for c in chunks),'queries':1})
+        self.assertIn('rag_span_calls_total{span="retrieve.search"} 1\n', prometheus.last)
+        self.assertIn(f'rag_chunks_produced_total {len(chunks)}\n', prometheus.last)
+    def test_adaptive_reranking(self):
+        '''
+        Tests that adaptive reranking only sends the candidates within the margin of the closest one to the
+        cross-encoder, still scores a single remaining candidate (no dense distance leaks into the scores), and that
+        the engine is part of the cached scores' key.
+        '''
+        class CountingCrossEncoder:
+            pairs = []
+            def predict(self, pairs, batch_size=32):
+                self.pairs.extend(pairs)
+                return [len(t) for q,t in pairs]
+        class Doc:
+            def __init__(self, text):
+                self.page_content = text
+        candidates = [(Doc('a'),0.1),(Doc('bbb'),0.15),(Doc('cc'),0.5)]
+        self.assertEqual(reranker.prune_candidates(candidates,1,0.1), candidates[:2])
+        self.assertEqual(reranker.prune_candidates(candidates,3,0.0), candidates)
+        cross_encoder = CountingCrossEncoder()
+        cache = retrieval.rerank_cache
+        try:
+            retrieval.models.set('cross_encoder',cross_encoder)
+            retrieval.rerank_cache = rerank_cache.RerankCache(retrieval.reranker_name())
+            results = retrieval.rerank(['q','q'],[candidates,[(Doc('d'),0.1),(Doc('eeee'),0.9)]],k=1,early_exit_margin=0.1)
+            self.assertEqual([[(r.page_content,s) for r,s in rs] for rs in results], [[('bbb',3)],[('d',1)]])
+            self.assertEqual(cross_encoder.pairs, [['q','a'],['q','bbb'],['q','d']])
+            with self.assertRaises(ValueError):
+                retrieval.configure_reranker('fp16')
+            retrieval.configure_reranker('int8',num_threads=1)
+            self.assertFalse(retrieval.models.is_loaded('cross_encoder'))
+            self.assertEqual(retrieval.reranker_name(), retrieval.CROSS_ENCODER_MODEL + ':int8')
+        finally:
+            retrieval.configure_reranker('fp32')
+            retrieval.rerank_cache = cache
+    def test_chunk_store(self):
+        '''
+        Tests that a ChunkStore rehydrates the chunks of process_document, and that results retrieved from a store
+        ingested slim get their raw content back
+        '''
+        with open('data/synthetic_document.json','r') as f:
+            document = json.load(f)
+        document['sections'][0]['title'] = 'Réseau'
+        for n_max_table_rows in [1,2]:
+            chunks = chunking.process_document(document,N_MAX_TABLE_ROWS=n_max_table_rows)
+            store = chunking.process_document(document,N_MAX_TABLE_ROWS=n_max_table_rows,as_store=True)
+            self.assertIsInstance(store,chunk_store.ChunkStore)
+            self.assertEqual(list(store), chunks)
+            self.assertEqual(store.index(chunks[-1]['id']), len(chunks) - 1)
+        self.assertIsNone(store.index('0'*64))
+        self.assertEqual(store.titles(1), ['System Configuration Guide','Réseau','IPv4 Configuration'])
+        embeddings = local_embeddings.HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(store,embeddings=embeddings,persist_directory=persist_directory,backend='numpy')
+            self.assertNotIn('raw_content', vectorstore.get(include=['metadatas'])['metadatas'][0])
+            query = 'How do I configure a static IPv4 address?'
+            results = retrieval.retrieve_and_rerank(query,vectorstore,k=2,do_rerank=False,chunk_store=store)
+            by_text = {c['text']:c['metadata'] for c in chunks}
+            self.assertEqual([r.metadata for r,_ in results], [by_text[r.page_content] for r,_ in results])
+    def test_bulk_ingest(self):
+        '''
+        Tests that bulk ingestion tags chunks with their source document, and resumes from its manifest: unchanged
+        documents are skipped, the stale chunks of a changed document are replaced, disjoint sources share a store,
+        and the chunks of a removed document are only deleted when pruning
+        '''
+        embeddings = local_embeddings.HashingEmbeddings()
+        with tempfile.TemporaryDirectory() as corpus, tempfile.TemporaryDirectory() as persist_directory:
+            os.makedirs(os.path.join(corpus,'synthetic'))
+            with open('data/document.json','r') as f:
+                document = json.load(f)
+            with open(os.path.join(corpus,'document.json'),'w') as f:
+                json.dump(document,f)
+            with open('data/synthetic_document.json','r') as f:
+                synthetic_document = json.load(f)
+            with open(os.path.join(corpus,'synthetic','document.json'),'w') as f:
+                json.dump(synthetic_document,f)
+            def ingest(source=corpus,prune=False):
+                return bulk_ingest.bulk_ingest(source,embeddings=embeddings,persist_directory=persist_directory,backend='numpy',
+                                               n_workers=2,prune=prune)
+            stats = ingest()
+            n_chunks = len(chunking.process_document(document)) + len(chunking.process_document(synthetic_document))
+            self.assertEqual((stats['ingested'],stats['chunks']), (2,n_chunks))
+            vectorstore = numpy_store.NumpyVectorStore(embeddings,persist_directory=persist_directory)
+            sources = [m[bulk_ingest.SOURCE_KEY] for m in vectorstore.get(include=['metadatas'])['metadatas']]
+            self.assertEqual(sorted(set(sources)), ['document.json',os.path.join('synthetic','document.json')])
+            self.assertEqual(ingest()['skipped'], 2)
+            document['sections'][0]['content'] += ' Updated.'
+            with open(os.path.join(corpus,'document.json'),'w') as f:
+                json.dump(document,f)
+            stats = ingest()
+            self.assertEqual((stats['skipped'],stats['ingested'],stats['chunks'],stats['deleted']), (1,1,1,1))
+            vectorstore = numpy_store.NumpyVectorStore(embeddings,persist_directory=persist_directory)
+            self.assertEqual(len(vectorstore), n_chunks)
+            os.remove(os.path.join(corpus,'synthetic','document.json'))
+            self.assertEqual(ingest()['removed'], 0)
+            stats = ingest(prune=True)
+            self.assertEqual((stats['removed'],stats['deleted'],stats['skipped']), (1,len(chunking.process_document(synthetic_document)),1))
+            vectorstore = numpy_store.NumpyVectorStore(embeddings,persist_directory=persist_directory)
+            self.assertEqual(len(vectorstore), len(chunking.process_document(document)))
+            self.assertEqual(list(bulk_ingest.Manifest(os.path.join(persist_directory,bulk_ingest.MANIFEST_FNAME)).files), ['document.json'])
+        # two disjoint sources ingested into one store both survive
+        with tempfile.TemporaryDirectory() as corpus, tempfile.TemporaryDirectory() as persist_directory:
+            for name,document_fname in [('a','data/document.json'),('b','data/synthetic_document.json')]:
+                os.makedirs(os.path.join(corpus,name))
+                shutil.copy(document_fname,os.path.join(corpus,name,'document.json'))
+                bulk_ingest.bulk_ingest(os.path.join(corpus,name,'*.json'),embeddings=embeddings,persist_directory=persist_directory,
+                                        backend='numpy',n_workers=1)
+            vectorstore = numpy_store.NumpyVectorStore(embeddings,persist_directory=persist_directory)
+            self.assertEqual(len(vectorstore), n_chunks)
+    def test_token_budget_splitting(self):
+        '''
+        Tests that with max_tokens oversized content, code and tables are split within budget on paragraph, sentence,
+        statement and row boundaries, every piece keeping its title, and that the ChunkStore splits the same way
+        '''
+        paragraphs = [' '.join(f'Sentence {i}.{j} describes step {j} of the setup.' for j in range(6)) for i in range(4)]
+        functions = [f'def step_{i}(config):\n    # apply step {i}\n    config.apply({i})\n    return config\n' for i in range(8)]
+        document = {'title':'Guide','sections':[{'title':'Setup','content':'\n\n'.join(paragraphs),
+                                                  'code_block':'import config\n\n' + '\n'.join(functions),
+                                                  'table':{'headers':['step','value'],'rows':[[i,f'value {i}'] for i in range(30)]}}]}
+        self.assertEqual(chunking.process_document(document,max_tokens=10000), chunking.process_document(document,N_MAX_TABLE_ROWS=30))
+        chunks = chunking.process_document(document,max_tokens=60,overlap_tokens=15)
+        self.assertTrue(all(chunking.estimate_tokens(c['text']) <= 60 for c in chunks))
+        texts = [c['text'] for c in chunks if c['text'].startswith('Title: Guide,Setup\n\n')]
+        code = [c['text'] for c in chunks if c['text'].startswith('# Code Block for: Guide,Setup\n\n')]
+        tables = [c for c in chunks if c['text'].startswith('# Table for: Guide,Setup\n')]
+        self.assertEqual(len(texts) + len(code) + len(tables), len(chunks))
+        # prose pieces end on sentence boundaries and cover every sentence, consecutive pieces overlap
+        self.assertTrue(all(t.endswith('.') for t in texts))
+        sentences = [re.findall(r'Sentence \d+\.\d+',t) for t in texts]
+        self.assertEqual(set(sum(sentences,[])), set(re.findall(r'Sentence \d+\.\d+',' '.join(paragraphs))))
+        self.assertTrue(any(s[0] in p for s,p in zip(sentences[1:],sentences)))
+        # code pieces are whole top-level statements
+        for c in code:
+            ast.parse(c.split('\n\n',1)[1])
+        self.assertEqual(sum(c.count('def step_') for c in code), len(functions))
+        # table pieces are budgeted by tokens, not rows, and their raw content holds their rows
+        self.assertGreater(len(json.loads(tables[0]['text'].split('\n',1)[1])), 1)
+        self.assertEqual([row for c in tables for row in eval(c['metadata']['raw_content'])['rows']], document['sections'][0]['table']['rows'])
+        self.assertEqual(list(chunking.process_document(document,max_tokens=60,overlap_tokens=15,as_store=True)), chunks)
+    def test_semantic_cache(self):
+        '''
+        Tests that the semantic cache serves the results of a near-duplicate query, misses below the threshold or
+        under other retrieval parameters, evicts the least recently used queries, and drops the results of a store
+        (only) once it changes, whoever changes it
+        '''
+        cache = semantic_cache.SemanticCache(threshold=0.9,max_entries=2)
+        cache.put([1.0,0.0,0.0],'k=3',['a'])
+        self.assertEqual(cache.get([2.0,0.1,0.0],'k=3'), ['a'])
+        self.assertIsNone(cache.get([1.0,1.0,0.0],'k=3'))
+        self.assertIsNone(cache.get([1.0,0.0,0.0],'k=5'))
+        cache.put([0.0,1.0,0.0],'k=3',['b'])
+        cache.get([1.0,0.0,0.0],'k=3')
+        cache.put([0.0,0.0,1.0],'k=3',['c'])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get([0.0,1.0,0.0],'k=3'))
+        self.assertEqual(cache.get([1.0,0.0,0.0],'k=3'), ['a'])
+        cache.clear()
+        cache.put([1.0,0.0,0.0],'k=3',['a'],version=1)
+        cache.put([1.0,0.0,0.0],'k=5',['a','b'],version=1)
+        self.assertIsNone(cache.get([1.0,0.0,0.0],'k=3',version=2))
+        self.assertEqual((len(cache),cache.get([1.0,0.0,0.0],'k=5',version=1)), (1,['a','b']))
+
+        with open('data/synthetic_document.json','r') as f:
+            chunks = chunking.process_document(json.load(f))
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(chunks[1:],embeddings=local_embeddings.HashingEmbeddings(),
+                                                        persist_directory=persist_directory,backend='numpy')
+            cache = semantic_cache.SemanticCache(threshold=0.9)
+            query = 'How do I configure a static IPv4 address?'
+            expected = retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False)
+            results = retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(results, expected)
+            tracing.tracer.reset()
+            try:
+                tracing.enable()
+                self.assertEqual(retrieval.retrieve_and_rerank(query.lower(),vectorstore,k=3,do_rerank=False,semantic_cache=cache), expected)
+                batch = retrieval.retrieve_and_rerank_batch([query,'What is the default encryption standard?'],vectorstore,k=3,
+                                                            do_rerank=False,semantic_cache=cache)
+            finally:
+                tracing.disable()
+            counters = tracing.tracer.snapshot()['counters']
+            tracing.tracer.reset()
+            self.assertEqual((counters['semantic_cache_hits'],counters['semantic_cache_misses']), (2,1))
+            self.assertEqual(batch[0], expected)
+            self.assertEqual(batch[1], retrieval.retrieve_and_rerank_batch(['What is the default encryption standard?'],vectorstore,k=3,do_rerank=False)[0])
+            self.assertEqual(len(cache), 2)
+            # another handle on the same directory is a different store, writes to it are not tracked here
+            hits = cache.hits
+            reopened = retrieval.open_vector_store(local_embeddings.HashingEmbeddings(),persist_directory=persist_directory,backend='numpy')
+            retrieval.retrieve_and_rerank(query,reopened,k=3,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(cache.hits, hits)
+            # writing to the store directly, outside create_vector_store/save_vector_store, drops its results only
+            vectorstore.add_texts([chunks[0]['text']],metadatas=[chunks[0]['metadata']],ids=[chunks[0]['id']])
+            self.assertEqual(retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,semantic_cache=cache),
+                             retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False))
+            self.assertEqual(cache.hits, hits)
+            retrieval.retrieve_and_rerank(query,reopened,k=3,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(cache.hits, hits + 1)
+            vectorstore.delete([chunks[0]['id']])
+            retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(cache.hits, hits + 1)
+            # so does a write to the lexical index
+            lexical_index = bm25.BM25Index()
+            lexical_index.add([c['id'] for c in chunks[1:]],[c['text'] for c in chunks[1:]])
+            retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,lexical_index=lexical_index,semantic_cache=cache)
+            lexical_index.delete([chunks[1]['id']])
+            retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,lexical_index=lexical_index,semantic_cache=cache)
+            self.assertEqual(cache.hits, hits + 1)
+        # a Chroma store is keyed on its directory, shared by its handles, and versioned by its files
+        with tempfile.TemporaryDirectory() as persist_directory:
+            vectorstore = retrieval.create_vector_store(chunks[1:],embeddings=local_embeddings.HashingEmbeddings(),
+                                                        persist_directory=persist_directory)
+            cache = semantic_cache.SemanticCache(threshold=0.9)
+            retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,semantic_cache=cache)
+            reopened = retrieval.open_vector_store(local_embeddings.HashingEmbeddings(),persist_directory=persist_directory)
+            retrieval.retrieve_and_rerank(query,reopened,k=3,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(cache.hits, 1)
+            reopened.add_texts([chunks[0]['text']],metadatas=[chunks[0]['metadata']],ids=[chunks[0]['id']])
+            self.assertEqual(retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False,semantic_cache=cache),
+                             retrieval.retrieve_and_rerank(query,vectorstore,k=3,do_rerank=False))
+            self.assertEqual(cache.hits, 1)
+    def test_incremental_chroma(self):
+        '''
+        Tests an incremental update of the default Chroma store through create_vector_store: editing one chunk
+        embeds only that chunk, and the stale ID is deleted from the collection
+        '''
+        class CountingEmbeddings(local_embeddings.HashingEmbeddings):
+            calls = []
+            def embed_documents(self, texts):
+                CountingEmbeddings.calls.append(list(texts))
+                return super().embed_documents(texts)
+        with open('data/synthetic_document.json','r') as f:
+            document = json.load(f)
+        chunks = chunking.process_document(document)
+        embeddings = CountingEmbeddings()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            retrieval.create_vector_store(chunks,embeddings=embeddings,persist_directory=tmpdir)
+            document['sections'][0]['content'] += ' (edited)'
+            edited = chunking.process_document(document)
+            changed = [c for c in edited if c['id'] not in {c['id'] for c in chunks}]
+            self.assertEqual(len(changed), 1)
+            CountingEmbeddings.calls.clear()
+            vectorstore = retrieval.create_vector_store(edited,embeddings=embeddings,persist_directory=tmpdir,incremental=True)
+            self.assertEqual(CountingEmbeddings.calls, [[changed[0]['text']]])
+            self.assertEqual(sorted(vectorstore.get(include=[])['ids']), sorted(c['id'] for c in edited))
+    def test_generic_vector_store(self):
+        '''
+        Tests that retrieval falls back on the public VectorStore API for stores other than Chroma and the NumPy
+        backends, including stores that do not expose their embeddings
+        '''
+        from langchain_core.vectorstores import InMemoryVectorStore
+        class OpaqueVectorStore(InMemoryVectorStore):
+            @property
+            def embeddings(self):
+                return None
+        class CountingEmbeddings(local_embeddings.HashingEmbeddings):
+            n_calls = 0
+            def embed_query(self, text):
+                CountingEmbeddings.n_calls += 1
+                return super().embed_query(text)
+            def embed_documents(self, texts):
+                CountingEmbeddings.n_calls += len(texts)
+                return super().embed_documents(texts)
+        with open('data/document.json','r') as f:
+            chunks = chunking.process_document(json.load(f))
+        with open('data/queries.json','r') as f:
+            queries = json.load(f)['queries'][:3]
+        for store_class in [InMemoryVectorStore,OpaqueVectorStore]:
+            vectorstore = store_class(local_embeddings.HashingEmbeddings())
+            vectorstore.add_texts([c['text'] for c in chunks],metadatas=[c['metadata'] for c in chunks])
+            expected = [vectorstore.similarity_search_with_score(q,k=2) for q in queries]
+            cache = semantic_cache.SemanticCache()
+            self.assertEqual([retrieval.retrieve_and_rerank(q,vectorstore,k=2,do_rerank=False,semantic_cache=cache) for q in queries], expected)
+            self.assertEqual(retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=2,do_rerank=False,semantic_cache=cache), expected)
+        # the queries are embedded once each, with or without the semantic cache
+        vectorstore = InMemoryVectorStore(CountingEmbeddings())
+        vectorstore.add_texts([c['text'] for c in chunks])
+        for cache in [None,semantic_cache.SemanticCache()]:
+            CountingEmbeddings.n_calls = 0
+            retrieval.retrieve_and_rerank(queries[0],vectorstore,k=2,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(CountingEmbeddings.n_calls, 1)
+            CountingEmbeddings.n_calls = 0
+            retrieval.retrieve_and_rerank_batch(queries,vectorstore,k=2,do_rerank=False,semantic_cache=cache)
+            self.assertEqual(CountingEmbeddings.n_calls, len(queries))
     def test_retrieve_chunks(self):
 
         '''
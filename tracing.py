@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class _NullSpan:
+    # shared no-op span handed out while tracing is disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('tracer','name','start')
+
+    def __init__(self, tracer, name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer._record(self.name,time.perf_counter() - self.start)
+        return False
+
+class Tracer:
+    """
+    Collects timed spans and counters of the pipeline stages, and hands them to exporters.
+
+    While disabled, span() returns a shared no-op context manager and count() returns immediately, so the
+    instrumentation left in the code costs one attribute check per call. Spans are aggregated per name (calls,
+    total, max), and spans recorded on worker threads (e.g. embedding batches) add up their own time, so the total
+    of a stage can exceed the wall-clock time it overlapped with.
+
+    Args:
+        enabled (bool, optional): Whether spans and counters are recorded. Defaults to False.
+        exporters (list, optional): Exporters called by export(), see LogExporter, JSONFileExporter and PrometheusExporter.
+    """
+    def __init__(self, enabled: bool = False, exporters: list = None):
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str):
+        """Context manager timing the enclosed block under name."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self,name)
+
+    def count(self, name: str, value: float = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name,0) + value
+
+    def _record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                self._spans[name] = [1,seconds,seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                span[2] = max(span[2],seconds)
+
+    def snapshot(self) -> dict:
+        """Returns the aggregated spans (calls, total_ms, mean_ms, max_ms per name) and counters."""
+        with self._lock:
+            return {'spans':{name:{'calls':calls,'total_ms':1000*total,'mean_ms':1000*total/calls,'max_ms':1000*longest}
+                             for name,(calls,total,longest) in self._spans.items()},
+                    'counters':dict(self._counters)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def export(self) -> None:
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            exporter.export(snapshot)
+
+    def report(self) -> str:
+        """A human readable per-stage breakdown, slowest stages first."""
+        snapshot = self.snapshot()
+        lines = [f"{'stage':<28}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}"]
+        for name,span in sorted(snapshot['spans'].items(),key=lambda item:-item[1]['total_ms']):
+            lines.append(f"{name:<28}{span['calls']:>8}{span['total_ms']:>12.2f}{span['mean_ms']:>10.2f}{span['max_ms']:>10.2f}")
+        for name,value in sorted(snapshot['counters'].items()):
+            lines.append(f"{name:<28}{value:>8}")
+        return '\n'.join(lines)
+
+class LogExporter:
+    """Exports a snapshot as a single log line."""
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger('tracing')
+        self.level = level
+
+    def export(self, snapshot: dict) -> None:
+        spans = ' '.join(f"{name}={span['total_ms']:.2f}ms/{span['calls']}" for name,span in snapshot['spans'].items())
+        counters = ' '.join(f'{name}={value}' for name,value in snapshot['counters'].items())
+        self.logger.log(self.level,f'spans {spans} counters {counters}')
+
+class JSONFileExporter:
+    """Appends each snapshot, with a timestamp, as one JSON line to path."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, snapshot: dict) -> None:
+        with open(self.path,'a') as f:
+            f.write(json.dumps(dict(snapshot,timestamp=time.time())) + '\n')
+
+class PrometheusExporter:
+    """
+    Renders snapshots in the Prometheus text exposition format, and writes them to path if given (e.g. for the
+    node exporter's textfile collector). Spans become <prefix>_span_seconds_total and <prefix>_span_calls_total
+    with a span label, counters become <prefix>_<name>_total.
+    """
+    def __init__(self, path: str = None, prefix: str = 'rag'):
+        self.path = path
+        self.prefix = prefix
+        self.last = ''
+
+    def render(self, snapshot: dict) -> str:
+        lines = [f'# HELP {self.prefix}_span_seconds_total Time spent in each pipeline stage.',
+                 f'# TYPE {self.prefix}_span_seconds_total counter']
+        lines += [f'{self.prefix}_span_seconds_total{{span="{name}"}} {span["total_ms"]/1000:.6f}' for name,span in snapshot['spans'].items()]
+        lines += [f'# HELP {self.prefix}_span_calls_total Number of times each pipeline stage ran.',
+                  f'# TYPE {self.prefix}_span_calls_total counter']
+        lines += [f'{self.prefix}_span_calls_total{{span="{name}"}} {span["calls"]}' for name,span in snapshot['spans'].items()]
+        for name,value in snapshot['counters'].items():
+            lines += [f'# TYPE {self.prefix}_{name}_total counter',f'{self.prefix}_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+    def export(self, snapshot: dict) -> None:
+        self.last = self.render(snapshot)
+        if self.path is not None:
+            # write then rename, so a scraper never reads a partial file
+            with open(self.path + '.tmp','w') as f:
+                f.write(self.last)
+            os.replace(self.path + '.tmp',self.path)
+
+# the process-wide tracer the pipeline is instrumented with, disabled until enable() is called
+tracer = Tracer()
+
+def span(name: str):
+    return tracer.span(name)
+
+def count(name: str, value: float = 1) -> None:
+    tracer.count(name,value)
+
+def enable(exporters: list = None) -> Tracer:
+    """Turns tracing on, optionally replacing the exporters, and returns the tracer."""
+    if exporters is not None:
+        tracer.exporters = list(exporters)
+    tracer.enabled = True
+    return tracer
+
+def disable() -> None:
+    tracer.enabled = False